@@ -0,0 +1,147 @@
+"""
+@author natidemis
+October 2026
+
+Result cache for repeated similarity queries.
+
+Dashboards poll '/getbug' with the same text and k. `QueryCache` keeps the
+ids and distances of recent results keyed by (user_id, hash of the cleaned
+text, k, filters), together with the version of the user's index they were
+computed on, the change log sequence number. A result is only returned for
+the same version, so any write of the user invalidates its results.
+Memory is bounded by QUERY_CACHE_BYTES in '.env' (64MiB by default, 0 turns
+the cache off), least recently used results are evicted first.
+Hits and misses are counted in `bcj_cache_requests_total{cache="query"}`.
+"""
+
+from __future__ import annotations
+import os
+import hashlib
+from collections import OrderedDict
+from typing import Dict, Hashable, Set, Tuple, Union
+import numpy as np
+from dotenv import load_dotenv
+from Misc.metrics import CACHE_REQUESTS, CACHE_BYTES
+
+load_dotenv()
+QUERY_CACHE_BYTES = int(os.getenv('QUERY_CACHE_BYTES', str(64 << 20)))
+#estimated bytes of an entry besides its arrays: key, tuple and dict slots
+ENTRY_OVERHEAD = 256
+
+
+class QueryCache:
+    """
+    LRU cache of similarity results bounded by the bytes of the stored arrays.
+    Used from the event loop only.
+    Static methods:
+        key
+    Instance methods:
+        get
+        put
+        invalidate
+        stats
+    Instance variables:
+        max_bytes
+        nbytes
+        hits
+        misses
+    """
+
+    def __init__(self, max_bytes: int = QUERY_CACHE_BYTES, name: str = 'query'):
+        """
+        Arguments
+        ---------
+        max_bytes: int
+            bytes the cached results may take, 0 stores nothing
+        name: str
+            'cache' label of the metrics
+        """
+        self.max_bytes = max_bytes
+        self.name = name
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        #key -> (version, ids, dists, size), least recently used first
+        self._entries: OrderedDict = OrderedDict()
+        self._users: Dict[str, Set[tuple]] = {}
+
+    @staticmethod
+    def key(user_id: str, text: str, k: int, filters: Hashable = None) -> tuple:
+        """
+        Cache key of a query for the `k` bugs most similar to the cleaned `text`
+        """
+        digest = hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+        return (user_id, digest, k, filters)
+
+    def get(self, key: tuple, version: int) -> Union[None, Tuple[np.ndarray, np.ndarray]]:
+        """
+        The ids and distances cached for `key` at index `version`
+        Returns
+        -------
+        (ids, dists) as read-only arrays, None on a miss
+        """
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] != version:
+            self._remove(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            CACHE_REQUESTS.inc(self.name, 'miss')
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        CACHE_REQUESTS.inc(self.name, 'hit')
+        return entry[1], entry[2]
+
+    def put(self, key: tuple, version: int, ids: np.ndarray, dists: np.ndarray) -> None:
+        """
+        Cache the result of `key` computed at index `version`,
+        evicting the least recently used results to stay within `max_bytes`
+        """
+        size = ids.nbytes + dists.nbytes + ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        ids, dists = np.array(ids), np.array(dists)
+        ids.setflags(write=False)
+        dists.setflags(write=False)
+        self._entries[key] = (version, ids, dists, size)
+        self._users.setdefault(key[0], set()).add(key)
+        self.nbytes += size
+        while self.nbytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+        CACHE_BYTES.set(self.nbytes, self.name)
+
+    def invalidate(self, user_id: str) -> int:
+        """
+        Drop every result of `user_id`
+        Returns
+        -------
+        number of dropped results
+        """
+        keys = self._users.get(user_id, ())
+        count = len(keys)
+        for key in list(keys):
+            self._remove(key)
+        CACHE_BYTES.set(self.nbytes, self.name)
+        return count
+
+    def stats(self) -> dict:
+        """
+        Hits, misses, hit ratio, number of results and bytes used
+        """
+        lookups = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._entries),
+                'bytes': self.nbytes}
+
+    def _remove(self, key: tuple) -> None:
+        _, _, _, size = self._entries.pop(key)
+        self.nbytes -= size
+        keys = self._users[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self._users[key[0]]
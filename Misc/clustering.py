@@ -0,0 +1,144 @@
+"""
+@author natidemis
+October 2026
+
+Near-duplicate clusters of a user's bugs.
+
+Every pair of bugs closer than a threshold is linked and the connected
+components are the clusters, found with union-find. The pairwise distances
+are computed in (block, block) tiles of the embedding matrix through
+|a|^2 + |b|^2 - 2ab, so memory stays at a few tiles however many bugs the
+user has, and only the upper triangle is computed. Row blocks run in a
+thread pool, NumPy releases the GIL in the matrix products.
+CLUSTER_BLOCK and CLUSTER_WORKERS in '.env' set the tile size (1024) and
+the number of threads (the number of cores).
+"""
+
+from __future__ import annotations
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+import numpy as np
+from dotenv import load_dotenv
+from Misc.metrics import STAGE_SECONDS
+
+load_dotenv()
+CLUSTER_BLOCK = int(os.getenv('CLUSTER_BLOCK', '1024'))
+CLUSTER_WORKERS = int(os.getenv('CLUSTER_WORKERS', str(os.cpu_count() or 1)))
+
+
+class UnionFind:
+    """
+    Disjoint sets of the integers 0..n-1
+    Instance methods:
+        find
+        union
+        groups
+    """
+    __slots__ = ('parent',)
+
+    def __init__(self, n: int):
+        self.parent = list(range(n))
+
+    def find(self, x: int) -> int:
+        """
+        Representative of the set of `x`, halving the path on the way
+        """
+        parent = self.parent
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(self, x: int, y: int) -> None:
+        """
+        Merge the sets of `x` and `y`, the smaller representative is kept
+        """
+        x, y = self.find(x), self.find(y)
+        if x != y:
+            self.parent[max(x, y)] = min(x, y)
+
+    def groups(self) -> List[List[int]]:
+        """
+        Sets with more than one member, ordered by their smallest member
+        """
+        members = {}
+        for x in range(len(self.parent)):
+            members.setdefault(self.find(x), []).append(x)
+        return [group for group in members.values() if len(group) > 1]
+
+
+def close_pairs(embeddings: np.ndarray, norms: np.ndarray, start: int,
+                bound: float, block: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Pairs (i, j), i < j, of rows within squared distance `bound`
+    where i is in the row block beginning at `start`
+    Arguments
+    ---------
+    embeddings: np.ndarray
+        (n, dim) embeddings
+    norms: np.ndarray
+        squared norms of the rows of `embeddings`
+    start: int
+        first row of the block
+    bound: float
+        squared distance threshold, inclusive
+    block: int
+        rows and columns per tile
+    Returns
+    -------
+    row indices i, row indices j
+    """
+    stop = min(start + block, len(embeddings))
+    rows, row_norms = embeddings[start:stop], norms[start:stop, None]
+    found_i, found_j = [], []
+    for col in range(start, len(embeddings), block):
+        cols = embeddings[col:col + block]
+        squared = row_norms + norms[None, col:col + block] - 2.0 * (rows @ cols.T)
+        i, j = np.nonzero(squared <= bound)
+        i, j = i + start, j + col
+        upper = i < j
+        found_i.append(i[upper])
+        found_j.append(j[upper])
+    return np.concatenate(found_i), np.concatenate(found_j)
+
+
+def find_clusters(ids: np.ndarray, embeddings: np.ndarray, threshold: float,
+                block: int = CLUSTER_BLOCK, workers: int = CLUSTER_WORKERS) -> List[List[int]]:
+    """
+    Clusters of bugs linked by distances of at most `threshold`
+    Arguments
+    ---------
+    ids: np.ndarray
+        ids of the bugs
+    embeddings: np.ndarray
+        (len(ids), dim) embeddings, row i belongs to ids[i]
+    threshold: float
+        largest distance between linked bugs
+    block: int
+        rows and columns per tile
+    workers: int
+        threads computing the tiles
+    Returns
+    -------
+    list of clusters with at least two bugs, each a sorted list of ids,
+    ordered by their smallest id
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    if len(ids) < 2:
+        return []
+    order = np.argsort(ids, kind='stable')
+    ids = ids[order]
+    embeddings = np.asarray(embeddings, dtype=np.float64).reshape(len(ids), -1)[order]
+    norms = np.einsum('ij,ij->i', embeddings, embeddings)
+    bound = threshold * threshold
+    sets = UnionFind(len(ids))
+    with STAGE_SECONDS.time('clustering'):
+        with ThreadPoolExecutor(max_workers=max(workers, 1),
+                                thread_name_prefix='clustering') as executor:
+            for found_i, found_j in executor.map(
+                    lambda start: close_pairs(embeddings, norms, start, bound, block),
+                    range(0, len(ids), block)):
+                for i, j in zip(found_i.tolist(), found_j.tolist()):
+                    sets.union(i, j)
+    return [ids[group].tolist() for group in sets.groups()]
@@ -1,6 +1,10 @@
+import os
+from copy import deepcopy
 from datetime import datetime
+from functools import lru_cache
 from typing import Optional, List
-from pydantic import BaseModel, validator, Extra
+from dotenv import load_dotenv
+from pydantic import BaseModel, ValidationError, validator, root_validator, Extra
 
 """
 @authors: natidemis
@@ -8,6 +12,23 @@ May-June 2021
 Datastructures for input requests
 """
 
+load_dotenv()
+#'light' validates the items of 'post' on '/batch' without building a model per item
+BATCH_VALIDATION = os.getenv('BATCH_VALIDATION', 'light')
+
+
+@lru_cache(maxsize=4096)
+def valid_date(value: str) -> bool:
+    """
+    Whether `value` is a date in YYYY-MM-DD format. Cached, the dates
+    of a batch mostly repeat.
+    """
+    try:
+        datetime.strptime(value, '%Y-%m-%d')
+    except (TypeError, ValueError):
+        return False
+    return True
+
 class StructuredInfoBaseModel(BaseModel, extra=Extra.forbid):
     """
     Base Model for all 'structured_info' variables
@@ -27,9 +48,11 @@ class StructuredInfoBaseModel(BaseModel, extra=Extra.forbid):
         'v', raises ValueError if 'date' is invalid
         """
         try:
-            datetime.strptime(value, '%Y-%m-%d')
-        except (TypeError, ValueError) as exp:
+            valid = valid_date(value)
+        except TypeError as exp: #unhashable
             raise ValueError('Not in correct format') from exp
+        if not valid:
+            raise ValueError('Not in correct format')
         return value
 
 class StructuredInfoMainModel(StructuredInfoBaseModel):
@@ -77,11 +100,23 @@ class MainDataModel(BaseDataModel):
 
 
 
-class GetDataModel(BaseDataModel):
+class GetDataModel(BaseDataModel, optional_fields=['structured_info']):
     """
-    Validator for 'get' on '/bug'
+    Validator for 'get' on '/bug', queries by the text of a bug
+    or by the 'id' of a stored bug
     """
+    id: Optional[int] = None
     k: Optional[int] = 5
+    radius: Optional[float] = None
+
+    @root_validator(skip_on_failure=True)
+    def validate_query(cls, values: dict) -> dict: #pylint: disable=E0213
+        """
+        Validates 'structured_info' is given unless 'id' is
+        """
+        assert values.get('id') is not None or values.get('structured_info') is not None, \
+            '"structured_info" is required unless "id" is given'
+        return values
 
     @validator('k', pre= True)
     def validate_k(cls,value) -> int: #pylint: disable=E0213
@@ -92,6 +127,15 @@ class GetDataModel(BaseDataModel):
             assert value > 0, '"k" must meet the constraint k > 0'
         return value
 
+    @validator('radius')
+    def validate_radius(cls,value) -> float: #pylint: disable=E0213
+        """
+        Validates 'value' > 0
+        """
+        if value is not None:
+            assert value > 0, '"radius" must meet the constraint radius > 0'
+        return value
+
 class ValidBatchModel(BaseModel):
     """
     Validates data for 'post' on '/batch'
@@ -102,12 +146,103 @@ class ValidBatchModel(BaseModel):
 
 
 
+class BatchItems(list):
+    """
+    Light validator for the items of 'post' on '/batch', checks the same
+    constraints as `ValidBatchModel` on the parsed json but keeps the items
+    as dicts. Items whose types don't match exactly, e.g. '"id": "5"', are
+    validated and coerced by `ValidBatchModel` instead, so both accept the same input.
+    """
+    KEYS = {'summary', 'description', 'structured_info'}
+    INFO_KEYS = {'id', 'date', 'batch_id'}
+
+    @classmethod
+    def __get_validators__(cls):
+        yield cls.validate
+
+    @classmethod
+    def __modify_schema__(cls, field_schema: dict) -> None:
+        #inline the structured_info definition, the schema is nested in the route's
+        item = deepcopy(ValidBatchModel.schema())
+        definitions = item.pop('definitions')
+        item['properties']['structured_info'] = definitions['StructuredInfoBatchModel']
+        field_schema.update(type='array', items=item)
+
+    @staticmethod
+    def _int(value) -> bool:
+        return isinstance(value, int) and not isinstance(value, bool)
+
+    @classmethod
+    def validate(cls, value) -> List[dict]:
+        """
+        Validates `value` is a list of bugs as in `ValidBatchModel`
+        Returns
+        -------
+        list of dicts with 'summary', 'description' and 'structured_info',
+        raises TypeError or ValueError naming the first invalid item
+        """
+        if not isinstance(value, list):
+            raise TypeError('value is not a valid list')
+        items = []
+        for i, item in enumerate(value):
+            info = item.get('structured_info') if isinstance(item, dict) else None
+            summary = item.get('summary') if isinstance(item, dict) else None
+            description = item.get('description') if isinstance(item, dict) else None
+            if isinstance(info, dict) and set(info) <= cls.INFO_KEYS and \
+                isinstance(summary, (str, type(None))) and \
+                isinstance(description, (str, type(None))) and \
+                cls._int(info.get('id')) and cls._int(info.get('batch_id')) and \
+                isinstance(info.get('date'), str) and valid_date(info['date']):
+                items.append({'summary': summary, 'description': description,
+                            'structured_info': {'id': info['id'], 'date': info['date'],
+                                                'batch_id': info['batch_id']}})
+                continue
+            try:
+                items.append(ValidBatchModel.parse_obj(item).dict())
+            except ValidationError as e:
+                raise ValueError('item {}: {}'.format(i, e)) from e
+        return items
+
 class BatchDataModel(BaseModel):
     """
     Validator for 'post' on '/batch'
     """
     user_id: str
-    data: List[ValidBatchModel]
+    data: BatchItems if BATCH_VALIDATION == 'light' else List[ValidBatchModel]
+
+    def items(self) -> List[dict]:
+        """
+        The bugs of the batch as dicts
+        """
+        return [item if isinstance(item, dict) else item.dict() for item in self.data]
+
+class ValidUpdateModel(BaseModel):
+    """
+    Validates data for 'patch' on '/bug/batch'
+    """
+    summary: Optional[str] = None
+    description: Optional[str] = None
+    structured_info: StructuredInfoMainModel
+
+class UpdateManyDataModel(BaseModel):
+    """
+    Validator for 'patch' on '/bug/batch'
+    """
+    user_id: str
+    data: List[ValidUpdateModel]
+
+    @validator('data')
+    def validate_data(cls, value: List[ValidUpdateModel]) -> List[ValidUpdateModel]: #pylint: disable=E0213
+        """
+        Validates 'value' isn't empty, the ids are unique and every bug has
+        a summary, a description or a batch_id to update
+        """
+        assert len(value) > 0, '"data" must contain at least one bug'
+        ids = [bug.structured_info.id for bug in value]
+        assert len(set(ids)) == len(ids), 'Each id may only be updated once'
+        assert all(bug.summary or bug.description or bug.structured_info.batch_id is not None
+            for bug in value), 'Each bug must have a summary, a description or a batch_id'
+        return value
 
 class DeleteDataModel(BaseModel):
     """
@@ -121,4 +256,41 @@ class DeleteBatchDataModel(BaseModel):
     Validator for 'delete' on '/batch'
     """
     user_id: str
-    batch_id: int
\ No newline at end of file
+    batch_id: int
+
+class DeleteManyDataModel(BaseModel):
+    """
+    Validator for 'delete' on '/bug/batch'
+    """
+    user_id: str
+    ids: List[int]
+
+    @validator('ids')
+    def validate_ids(cls, value: List[int]) -> List[int]: #pylint: disable=E0213
+        """
+        Validates 'value' isn't empty
+        """
+        assert len(value) > 0, '"ids" must contain at least one id'
+        return value
+
+class ReembedDataModel(BaseModel):
+    """
+    Validator for 'post' on '/reembed'
+    """
+    user_id: str
+    model_version: Optional[str] = None
+
+class ClusterDataModel(BaseModel):
+    """
+    Validator for 'post' on '/clusters'
+    """
+    user_id: str
+    threshold: float
+
+    @validator('threshold')
+    def validate_threshold(cls, value: float) -> float: #pylint: disable=E0213
+        """
+        Validates 'value' > 0
+        """
+        assert value > 0, '"threshold" must meet the constraint threshold > 0'
+        return value
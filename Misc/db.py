@@ -10,66 +10,194 @@ making query to the database
 
 from __future__ import annotations
 import os
-from typing import Union, List, Sequence
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Union, List, Sequence, Dict, NamedTuple, Tuple
 from enum import Enum
 from dotenv import load_dotenv
 import asyncpg
 from Misc.log import logger
+from Misc.migrations import migrate
+from Misc.metrics import DB_ACQUIRE_SECONDS, DB_SECONDS, DB_POOL_CONNECTIONS, DB_REPLICA_LAG
+from Misc.tracing import span
 
 
 
 
 load_dotenv()
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', '10'))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '10'))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv('DB_STATEMENT_CACHE_SIZE', '100'))
+DB_MAX_QUERIES = int(os.getenv('DB_MAX_QUERIES', '50000'))
+DB_MAX_INACTIVE_LIFETIME = float(os.getenv('DB_MAX_INACTIVE_LIFETIME', '300'))
+DB_COMMAND_TIMEOUT = float(os.getenv('DB_COMMAND_TIMEOUT', '60'))
+REPLICA_MAX_LAG = float(os.getenv('REPLICA_MAX_LAG', '1'))
+REPLICA_LAG_CHECK_INTERVAL = float(os.getenv('REPLICA_LAG_CHECK_INTERVAL', '5'))
 
 class QueryString(Enum):
     """
     Query strings for the database
     """
     INSERT = """
-    INSERT INTO Vectors(id,user_id,embeddings,batch_id)
-    VALUES($1,$2,$3,$4);"""
+    INSERT INTO Vectors(id,user_id,embeddings,batch_id,model_version,sentence)
+    VALUES($1,$2,$3,$4,$5,$6);"""
     INSERT_USER = """
-    INSERT INTO Users(user_id) VALUES($1) RETURNING *;
+    INSERT INTO Users(user_id,model_version) VALUES($1,$2) RETURNING *;
     """
     FETCH = "SELECT id,embeddings,batch_id FROM Vectors WHERE user_id = $1;"
     FETCH_USERS = "SELECT user_id from Users;"
+    FETCH_MODEL_VERSIONS = "SELECT user_id, model_version from Users;"
+    LOCK_USER = "SELECT model_version, log_seq FROM Users WHERE user_id = $1 FOR UPDATE;"
     DELETE = """
-    WITH deleted AS (
-        DELETE FROM Vectors 
-        WHERE id = $1 AND user_id = $2 RETURNING *
-        )
-    SELECT count(*) 
-    FROM deleted;"""
+    DELETE FROM Vectors
+    WHERE id = $1 AND user_id = $2 RETURNING id;"""
     UPDATE_EMBS_W_BATCH = """
     UPDATE Vectors
     SET embeddings = $1,
-    batch_id = $2
-    WHERE id = $3 AND user_id = $4 RETURNING * ;
+    batch_id = $2,
+    sentence = $3
+    WHERE id = $4 AND user_id = $5 RETURNING id, embeddings, batch_id;
     """
     UPDATE_BATCH_NO_EMBS = """
     UPDATE Vectors
     SET batch_id = $1
-    WHERE id = $2 AND user_id = $3 RETURNING *;
+    WHERE id = $2 AND user_id = $3 RETURNING id, embeddings, batch_id;
     """
     UPDATE_NO_BATCH_W_EMBS = """
     UPDATE Vectors
-    SET embeddings = $1
-    WHERE id = $2 AND user_id = $3 RETURNING *;
+    SET embeddings = $1,
+    sentence = $2
+    WHERE id = $3 AND user_id = $4 RETURNING id, embeddings, batch_id;
     """
 
+    UPDATE_MANY = """
+    UPDATE Vectors v
+    SET embeddings = CASE WHEN u.emb > 0
+        THEN ($6::double precision[])[u.emb:u.emb] ELSE v.embeddings END,
+    sentence = CASE WHEN u.emb > 0 THEN u.sentence ELSE v.sentence END,
+    batch_id = COALESCE(u.batch_id, v.batch_id)
+    FROM unnest($2::bigint[], $3::bigint[], $4::text[], $5::int[]) AS u(id, batch_id, sentence, emb)
+    WHERE v.user_id = $1 AND v.id = u.id
+    RETURNING v.id, v.embeddings, u.emb;"""
+
+    DELETE_MANY = """
+    DELETE FROM Vectors
+    WHERE user_id = $1 AND id = ANY($2::bigint[]) RETURNING id;"""
+
     DELETE_BATCH = """
-    WITH deleted AS (
-        DELETE FROM Vectors 
-        WHERE batch_id = $1 AND user_id = $2 RETURNING *
-        )
-    SELECT count(*) 
-    FROM deleted;"""
+    DELETE FROM Vectors
+    WHERE batch_id = $1 AND user_id = $2 RETURNING id;"""
 
     GET_BATCH_BY_ID = """
     SELECT * FROM Vectors
     WHERE batch_id = $1;
     """
 
+    FETCH_SENTENCES = """
+    SELECT id, sentence FROM Vectors
+    WHERE user_id = $1 AND id > $2
+    ORDER BY id LIMIT $3;
+    """
+    STAGE = """
+    INSERT INTO StagedVectors(id,user_id,model_version,embeddings,sentence)
+    VALUES($1,$2,$3,$4,$5)
+    ON CONFLICT (user_id, model_version, id) DO UPDATE
+    SET embeddings = EXCLUDED.embeddings,
+    sentence = EXCLUDED.sentence;
+    """
+    UNSTAGED = """
+    SELECT v.id, v.sentence FROM Vectors v
+    WHERE v.user_id = $1 AND NOT EXISTS (
+        SELECT 1 FROM StagedVectors s
+        WHERE s.user_id = v.user_id AND s.model_version = $2 AND s.id = v.id
+        AND s.sentence IS NOT DISTINCT FROM v.sentence
+        );"""
+    CUTOVER = """
+    UPDATE Vectors v
+    SET embeddings = s.embeddings,
+    model_version = s.model_version
+    FROM StagedVectors s
+    WHERE v.user_id = $1 AND s.user_id = v.user_id
+    AND s.model_version = $2 AND s.id = v.id;
+    """
+    SET_USER_VERSION = "UPDATE Users SET model_version = $2 WHERE user_id = $1;"
+    CLEAR_STAGED = "DELETE FROM StagedVectors WHERE user_id = $1;"
+    LOG_CHANGE = """
+    INSERT INTO ChangeLog(user_id,seq,op,id,embeddings)
+    VALUES($1,$2,$3,$4,$5);"""
+    SET_LOG_SEQ = "UPDATE Users SET log_seq = $2 WHERE user_id = $1;"
+    FETCH_CHANGES = """
+    SELECT seq, op, id, embeddings FROM ChangeLog
+    WHERE user_id = $1 AND seq > $2
+    ORDER BY seq;"""
+    FETCH_USER_STATE = "SELECT model_version, log_seq FROM Users WHERE user_id = $1;"
+    FETCH_LOG_SEQS = "SELECT user_id, log_seq FROM Users;"
+    PRUNE_CHANGES = """
+    DELETE FROM ChangeLog
+    WHERE created_at < now() - make_interval(secs => $1);"""
+    CLEAR_CLUSTERS = "DELETE FROM Clusters WHERE user_id = $1;"
+    INSERT_CLUSTERS = """
+    INSERT INTO Clusters(user_id,id,cluster_id)
+    SELECT $1, c.id, c.cluster_id FROM unnest($2::bigint[], $3::bigint[]) AS c(id, cluster_id);"""
+    SET_CLUSTER_RUN = """
+    INSERT INTO ClusterRuns(user_id,threshold,log_seq) VALUES($1,$2,$3)
+    ON CONFLICT (user_id) DO UPDATE
+    SET threshold = EXCLUDED.threshold,
+    log_seq = EXCLUDED.log_seq,
+    computed_at = now();"""
+    FETCH_CLUSTER_RUN = "SELECT threshold, log_seq, computed_at FROM ClusterRuns WHERE user_id = $1;"
+    FETCH_CLUSTERS = """
+    SELECT id, cluster_id FROM Clusters
+    WHERE user_id = $1
+    ORDER BY cluster_id, id;"""
+    REPLICA_LAG = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END;"""
+
+
+class _Statement:
+    """
+    A query run through the connection's statement cache, which prepares it
+    on first use per connection unless DB_STATEMENT_CACHE_SIZE is 0, named
+    statements don't survive pgbouncer in transaction mode.
+    Explicit prepared statements are not kept, asyncpg invalidates them each
+    time the connection goes back to the pool.
+    """
+    __slots__ = ('_conn', '_query')
+
+    def __init__(self, conn: asyncpg.Connection, query: str):
+        self._conn = conn
+        self._query = query
+
+    async def fetch(self, *args):
+        return await self._conn.fetch(self._query, *args)
+
+    async def fetchrow(self, *args):
+        return await self._conn.fetchrow(self._query, *args)
+
+    async def fetchval(self, *args):
+        return await self._conn.fetchval(self._query, *args)
+
+    async def executemany(self, args):
+        return await self._conn.executemany(self._query, args)
+
+
+class PreparedConnection(asyncpg.Connection):
+    """
+    Connection running the `QueryString`s through its statement cache
+    Instance methods:
+        prepared
+    """
+
+    def prepared(self, query: QueryString) -> _Statement:
+        """
+        Statement of `query`, valid for the current acquisition of the connection
+        """
+        return _Statement(self, query.value)
+
 class NotFoundError(Exception):
     """
     Database error when return value is empty.
@@ -108,6 +236,33 @@ class NoUpdatesError(Exception):
         return "{}: {}".format(self.message,self.args)
 
 
+class Change(NamedTuple):
+    """
+    Entry of the change log, written in the same transaction as the change.
+    op is 'U' for an added or updated bug, 'D' for a removed bug and 'R' when
+    all of the user's bugs changed, e.g. by a cutover, and must be reloaded.
+    """
+    user_id: str
+    seq: int
+    op: str
+    id: Union[None,int]
+    embeddings: Union[None,List[float]]
+
+
+class VersionMismatchError(Exception):
+    """
+    Database error when embeddings are written with a model version
+    other than the user's current one.
+    """
+    def __init__(self,message, *args):
+        super().__init__(message, *args)
+        self.message = message
+        self.args = args
+
+    def __str__(self):
+        return "{}: {}".format(self.message,self.args)
+
+
 class Database:
     """
     Class for handling database connection and queries
@@ -120,36 +275,183 @@ class Database:
     insert_batch
     fetch_all
     update
+    update_many
     delete
     delete_batch
+    delete_many
     fetch_users
+    fetch_model_versions
+    fetch_snapshot
+    fetch_changes
+    fetch_log_seqs
+    prune_changes
+    fetch_sentences
+    stage_embeddings
+    cutover
+    warm_up
+    record_pool_metrics
     close_pool
     Instance variables:
     pool
+    replica
     """
-    def __init__(self, pool: asyncpg.Pool):
+    def __init__(self, pool: asyncpg.Pool, replica: asyncpg.Pool = None):
         """
         Initialize Database
         Requirements:
             - DATABASE_URL variable in '.env' file.
         Arguments
         ---------
-        None
+        pool: asyncpg.Pool
+            pool of the primary, all writes go here
+        replica: asyncpg.Pool | None
+            pool of a read replica for read-only queries
         Returns
         -------
         Instance of a Database object
         """
         self.pool = pool
+        self.replica = replica
+        self._replica_lag: Union[None,float] = None
+        self._lag_checked = float('-inf')
+        self._lag_task = None
+        #monotonic time of the last write per user, reads of a user written to
+        #within REPLICA_MAX_LAG seconds go to the primary
+        self._writes: Dict[str, float] = {}
+        self._last_write = float('-inf')
 
     @classmethod
     async def connect_pool(cls) -> Database:
         """
         Creates a pool for the database. Database must be initalized using
         this class method.
+        Configured from '.env':
+            DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE - connections kept open / opened at most
+            DB_STATEMENT_CACHE_SIZE - statements cached per connection, 0 behind pgbouncer
+            DB_MAX_QUERIES - queries after which a connection is replaced
+            DB_MAX_INACTIVE_LIFETIME - seconds after which an idle connection is closed
+            DB_COMMAND_TIMEOUT - seconds a query may take
+            REPLICA_DATABASE_URL - optional read replica, read-only queries are sent there
+            REPLICA_MAX_LAG - seconds of replication lag above which reads go to the primary
+            REPLICA_LAG_CHECK_INTERVAL - seconds between replication lag checks
         """
-        pool = await asyncpg.create_pool(os.getenv('DATABASE_URL'), command_timeout=60)
+        pool = await Database._create_pool(os.getenv('DATABASE_URL'))
         logger.info('Constructed database with a pool connection, %s',pool)
-        return cls(pool=pool)
+        replica = None
+        if os.getenv('REPLICA_DATABASE_URL'):
+            replica = await Database._create_pool(os.getenv('REPLICA_DATABASE_URL'))
+            logger.info('Constructed read replica pool connection, %s', replica)
+        database = cls(pool=pool, replica=replica)
+        if replica is not None:
+            await database._check_replica_lag()
+        return database
+
+    @staticmethod
+    async def _create_pool(dsn: str) -> asyncpg.Pool:
+        """
+        Pool to `dsn` with the configured settings
+        """
+        return await asyncpg.create_pool(dsn,
+                                        min_size=DB_POOL_MIN_SIZE,
+                                        max_size=max(DB_POOL_MAX_SIZE, DB_POOL_MIN_SIZE),
+                                        statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+                                        max_queries=DB_MAX_QUERIES,
+                                        max_inactive_connection_lifetime=DB_MAX_INACTIVE_LIFETIME,
+                                        command_timeout=DB_COMMAND_TIMEOUT,
+                                        connection_class=PreparedConnection)
+
+    async def warm_up(self) -> None:
+        """
+        Open the minimum number of pool connections before serving
+        traffic, so the first requests don't pay for connecting.
+        """
+        async def touch(pool):
+            async with pool.acquire() as conn:
+                await conn.fetchval('SELECT 1;')
+
+        pools = [self.pool] if self.replica is None else [self.pool, self.replica]
+        await asyncio.gather(*(touch(pool) for pool in pools for _ in range(pool.get_min_size())))
+        logger.info('Warmed up %d database connections', sum(pool.get_size() for pool in pools))
+
+    async def _check_replica_lag(self) -> None:
+        """
+        Measure the replication lag of the replica, None if it can't be reached
+        """
+        self._lag_checked = time.monotonic()
+        try:
+            async with self.replica.acquire(timeout=REPLICA_LAG_CHECK_INTERVAL) as conn:
+                self._replica_lag = float(await conn.fetchval(QueryString.REPLICA_LAG.value,
+                                                    timeout=REPLICA_LAG_CHECK_INTERVAL))
+        except (OSError, asyncio.TimeoutError, asyncpg.exceptions.PostgresError) as e:
+            if self._replica_lag is not None:
+                logger.warning('Read replica unavailable, reading from the primary: %s', e)
+            self._replica_lag = None
+        DB_REPLICA_LAG.set(-1 if self._replica_lag is None else self._replica_lag)
+
+    def _written(self, *user_ids: str) -> None:
+        """
+        Record a write for `user_ids`, their reads go to the primary for a while
+        """
+        now = time.monotonic()
+        self._last_write = now
+        for user_id in user_ids:
+            self._writes[user_id] = now
+        if len(self._writes) > 10000:
+            self._writes = {user_id: t for user_id, t in self._writes.items()
+                            if now - t <= REPLICA_MAX_LAG}
+
+    def _read_pool(self, user_id: str = None) -> asyncpg.Pool:
+        """
+        Pool for a read-only query of `user_id`, or of all users if None.
+        The replica is used unless it lags more than REPLICA_MAX_LAG or
+        the data was written within that time.
+        """
+        if self.replica is None:
+            return self.pool
+        now = time.monotonic()
+        if now - self._lag_checked > REPLICA_LAG_CHECK_INTERVAL and \
+            (self._lag_task is None or self._lag_task.done()):
+            self._lag_task = asyncio.ensure_future(self._check_replica_lag())
+        if self._replica_lag is None or self._replica_lag > REPLICA_MAX_LAG:
+            return self.pool
+        written = self._last_write if user_id is None else self._writes.get(user_id)
+        if written is not None and now - written <= REPLICA_MAX_LAG:
+            return self.pool
+        return self.replica
+
+    @asynccontextmanager
+    async def _acquire(self, operation: str, pool: asyncpg.Pool = None,
+                    written: Sequence[str] = ()):
+        """
+        Acquire a connection from `pool`, the primary's by default, recording
+        the time waited for it and the time it was held for `operation`,
+        in a span when traced. Reads of the `written` users are sent to the
+        primary for a while afterwards.
+        """
+        pool = pool or self.pool
+        with span('db.' + operation, replica=pool is not self.pool):
+            start = time.perf_counter()
+            try:
+                async with pool.acquire() as conn:
+                    acquired = time.perf_counter()
+                    DB_ACQUIRE_SECONDS.observe(acquired - start)
+                    try:
+                        yield conn
+                    finally:
+                        DB_SECONDS.observe(time.perf_counter() - acquired, operation)
+            finally:
+                if written:
+                    self._written(*written)
+
+    def record_pool_metrics(self) -> None:
+        """
+        Update the pool connection gauges
+        """
+        for name, pool in (('primary', self.pool), ('replica', self.replica)):
+            if pool is not None:
+                idle = pool.get_idle_size()
+                DB_POOL_CONNECTIONS.set(idle, name, 'idle')
+                DB_POOL_CONNECTIONS.set(pool.get_size() - idle, name, 'busy')
 
     async def close_pool(self) -> None:
         """
@@ -157,11 +459,14 @@ class Database:
         """
         logger.info('closing pool connection %s',self.pool)
         await self.pool.close()
+        if self.replica is not None:
+            await self.replica.close()
 
 
     async def setup_database(self, reset: bool = False) -> bool:
         """
-        Instance method to setup the database tables
+        Instance method to setup the database tables by applying
+        the pending migrations in 'sql/migrations'
         Arguments
         ---------
         reset: bool
@@ -173,31 +478,88 @@ class Database:
         if reset:
             with open('sql/drop.sql','r') as sql_file:
                 query = sql_file.read()
-            async with self.pool.acquire() as conn:
+            async with self._acquire('setup_database') as conn:
                 try:
                     await conn.execute(query)
                     logger.info("Dropped tables.")
                 except Exception:
                     logger.info("Error dropping table")
 
-        with open('sql/schema.sql','r') as sql_file:
-            query = sql_file.read()
-
         try:
-            async with self.pool.acquire() as conn:
-                await conn.execute(query)
+            async with self._acquire('setup_database') as conn:
+                await migrate(conn)
                 logger.info("Checking and/or setting up database complete.")
+            #statements prepared before the schema changed are stale
+            await self.pool.expire_connections()
+            if self.replica is not None:
+                await self.replica.expire_connections()
             return True
-        except RuntimeError:
-            logger.error("Setting up database failed, re-evaluate enviroment variables.")
+        except (RuntimeError, asyncpg.PostgresError) as e:
+            logger.error("Setting up database failed, re-evaluate enviroment variables: %s", e)
             return False
 
 
+    @staticmethod
+    async def _lock_user(conn, user_id: str, model_version: Union[str,None] = None) -> Tuple[str,int]:
+        """
+        Lock the user's row until the transaction ends, serializing the user's
+        writes and change log entries and blocking a concurrent `cutover`.
+        Must be called within a transaction.
+        Arguments
+        ---------
+        conn: PreparedConnection
+        user_id: str
+        model_version: str | None
+            the version the embeddings were made with, not checked if None
+        Returns
+        -------
+        the user's model version and last change log sequence number,
+        raises NotFoundError if the user doesn't exist and
+        VersionMismatchError if the version differs from `model_version`
+        """
+        lock = conn.prepared(QueryString.LOCK_USER)
+        row = await lock.fetchrow(user_id)
+        if row is None:
+            raise NotFoundError('User not in database', user_id)
+        if model_version is not None and row['model_version'] != model_version:
+            raise VersionMismatchError('User is on another model version',
+                                    (user_id, row['model_version'], model_version))
+        return row['model_version'], row['log_seq']
+
+    @staticmethod
+    async def _log(conn, user_id: str, seq: int, entries: Sequence[tuple]) -> List[Change]:
+        """
+        Append `entries` to the user's change log after `seq`.
+        Must be called within the transaction that locked the user with `_lock_user`.
+        Arguments
+        ---------
+        conn: PreparedConnection
+        user_id: str
+        seq: int
+            the user's last sequence number
+        entries: list of (op, id, embeddings) tuples
+        Returns
+        -------
+        list of the logged Change
+        """
+        changes = [Change(user_id, seq + i, op, id, embeddings)
+                for i, (op, id, embeddings) in enumerate(entries, start=1)]
+        if changes:
+            log = conn.prepared(QueryString.LOG_CHANGE)
+            await log.executemany([(change.user_id, change.seq, change.op,
+                                    change.id, change.embeddings) for change in changes])
+            set_seq = conn.prepared(QueryString.SET_LOG_SEQ)
+            await set_seq.fetch(user_id, changes[-1].seq)
+        return changes
+
+
     async def insert(self,
                         id: int,
                         user_id: str,
                         embeddings: List[Union[int,float]],
-                        batch_id: int= None) -> None:
+                        batch_id: int= None,
+                        model_version: str = None,
+                        sentence: str = None) -> List[Change]:
         """
         Instance method for inserting into the database
         Arguments
@@ -210,13 +572,22 @@ class Database:
             The embeddings of the bug
         Batch_id: int, None
             Batch ID to associate bug with a batch of bugs
+        model_version: str | None
+            Version of the model the embeddings were made with, the user's if None
+        sentence: str | None
+            The cleaned text the embeddings were made from, needed for re-embedding
         Returns
         -------
-        None, raises DuplicateKeyError, NotFoundError on exception
+        list with the logged Change,
+        raises DuplicateKeyError, NotFoundError, VersionMismatchError on exception
         """
         try:
-            async with self.pool.acquire() as conn:
-                await conn.execute(QueryString.INSERT.value,id,user_id,embeddings,batch_id)
+            async with self._acquire('insert', written=(user_id,)) as conn:
+                async with conn.transaction():
+                    version, seq = await Database._lock_user(conn, user_id, model_version)
+                    insert = conn.prepared(QueryString.INSERT)
+                    await insert.fetch(id,user_id,embeddings,batch_id,version,sentence)
+                    return await Database._log(conn, user_id, seq, [('U', id, embeddings)])
         except asyncpg.exceptions.UniqueViolationError as e:
             logger.error("Duplicate key error: %s for user_id: %s and id: %s",e,user_id,id)
             raise DuplicateKeyError('Duplicate key error: %s' % e,(id,user_id)) from e
@@ -230,20 +601,22 @@ class Database:
             logger.error("Missing argument exception: %s",e)
 
 
-    async def insert_user(self, user_id: str) -> None:
+    async def insert_user(self, user_id: str, model_version: str = 'default') -> None:
         """
         Instance method for inserting a user into the database
         Arguments
         ---------
         user_id: str
             identification number for user.
+        model_version: str
+            version of the model the user's bugs are encoded with
         Returns
         -------
         None, raises DuplicateKeyError and TypeError on exception
         """
         try:
-            async with self.pool.acquire() as conn:
-                await conn.execute(QueryString.INSERT_USER.value,user_id)
+            async with self._acquire('insert_user', written=(user_id,)) as conn:
+                await conn.execute(QueryString.INSERT_USER.value,user_id,model_version)
         except asyncpg.exceptions.UniqueViolationError as e:
             logger.error("Duplicate key error: %s", e)
             raise DuplicateKeyError('Duplicate key for %s' % user_id,user_id) from e
@@ -252,23 +625,38 @@ class Database:
             raise TypeError('Incorrect type inserted' % e) from e
 
 
-    async def insert_batch(self,data: Sequence[tuple]) -> None:
+    async def insert_batch(self,data: Sequence[tuple], model_version: str = None) -> List[Change]:
         """
         Instance method for inserting a batch of data
         Arguments
         ---------
-        data: List of tuples [(id, user_id, embeddings, batch_id)]
+        data: List of tuples [(id, user_id, embeddings, batch_id[, sentence])]
             id: int - Identification value for the bug.
             user_id: str - Identification value for the user.
             embeddings: List of floats - The embeddings for this bug
             batch_id: int | None - A batch number to associate this bug with other bugs.
+            sentence: str | None - The cleaned text the embeddings were made from.
+        model_version: str | None
+            Version of the model the embeddings were made with, the users' if None
         Returns
         -------
-        None, raises NotFoundError, DuplicateKeyError on exception
+        list of the logged Change,
+        raises NotFoundError, DuplicateKeyError, VersionMismatchError on exception
         """
         try:
-            async with self.pool.acquire() as conn:
-                await conn.executemany(QueryString.INSERT.value,data)
+            async with self._acquire('insert_batch', written={row[1] for row in data}) as conn:
+                async with conn.transaction():
+                    users = {user_id: await Database._lock_user(conn, user_id, model_version)
+                            for user_id in sorted({row[1] for row in data})}
+                    insert = conn.prepared(QueryString.INSERT)
+                    await insert.executemany(
+                        [(*row[:4], users[row[1]][0], row[4] if len(row) > 4 else None)
+                            for row in data])
+                    changes = []
+                    for user_id, (_, seq) in users.items():
+                        changes.extend(await Database._log(conn, user_id, seq,
+                            [('U', row[0], row[2]) for row in data if row[1] == user_id]))
+                    return changes
 
         except asyncpg.exceptions.ForeignKeyViolationError as e:
             logger.error('User does not exist in database: %s',e)
@@ -293,8 +681,9 @@ class Database:
         a list of dict, Raises NotFoundError is user has no rows to fetch.
         raises NotFoundError if database is empty.
         """
-        async with self.pool.acquire() as conn:
-            rows = await conn.fetch(QueryString.FETCH.value,user_id)
+        async with self._acquire('fetch_all', self._read_pool(user_id)) as conn:
+            fetch = conn.prepared(QueryString.FETCH)
+            rows = await fetch.fetch(user_id)
         if err and not rows:
             raise NotFoundError("Nothing in the Database",rows)
         if not rows:
@@ -310,7 +699,9 @@ class Database:
                         id: int,
                         user_id: str,
                         embeddings: List[Union[int,float]] = None,
-                        batch_id: int=None) -> None:
+                        batch_id: int=None,
+                        model_version: str = None,
+                        sentence: str = None) -> List[Change]:
         """
         Instance method for updating a bug for a user.
         Arguments
@@ -323,51 +714,119 @@ class Database:
             The embeddings of the bug
         Batch_id: int | None
             Batch ID to associate bug with a batch of bugs
+        model_version: str | None
+            Version of the model the embeddings were made with, not checked if None
+        sentence: str | None
+            The cleaned text the embeddings were made from
         Returns
-        None, raises NoUpdatesError if nothing is updated.
+        list with the logged Change, empty if only the batch_id changed.
+        Raises NoUpdatesError if nothing is updated,
+        VersionMismatchError if `model_version` isn't the user's.
         """
         try:
-            async with self.pool.acquire() as conn:
-                if batch_id is not None and embeddings is not None:
-                    result = await conn.execute(
-                        QueryString.UPDATE_EMBS_W_BATCH.value,
-                        embeddings,
-                        batch_id,
-                        id,
-                        user_id
-                        )
-                elif batch_id is not None and embeddings is None:
-                    result = await conn.execute(
-                        QueryString.UPDATE_BATCH_NO_EMBS.value,
-                        batch_id,
-                        id,
-                        user_id
-                        )
-                elif batch_id is None and embeddings is not None:
-                    result = await conn.execute(
-                        QueryString.UPDATE_NO_BATCH_W_EMBS.value,
-                        embeddings,
-                        id,
-                        user_id
-                        )
-                else:
-                    result = await conn.execute(
-                        QueryString.UPDATE_BATCH_NO_EMBS.value,
-                        None,
-                        id,
-                        user_id
-                        )
-                if result == 'UPDATE 0':
-                    raise NoUpdatesError('No changes were made to the db',(id,user_id,batch_id))
-                logger.info("Update successful")
+            async with self._acquire('update', written=(user_id,)) as conn:
+                async with conn.transaction():
+                    if embeddings is not None:
+                        _, seq = await Database._lock_user(conn, user_id, model_version)
+                    if batch_id is not None and embeddings is not None:
+                        row = await conn.fetchrow(
+                            QueryString.UPDATE_EMBS_W_BATCH.value,
+                            embeddings,
+                            batch_id,
+                            sentence,
+                            id,
+                            user_id
+                            )
+                    elif batch_id is not None and embeddings is None:
+                        row = await conn.fetchrow(
+                            QueryString.UPDATE_BATCH_NO_EMBS.value,
+                            batch_id,
+                            id,
+                            user_id
+                            )
+                    elif batch_id is None and embeddings is not None:
+                        row = await conn.fetchrow(
+                            QueryString.UPDATE_NO_BATCH_W_EMBS.value,
+                            embeddings,
+                            sentence,
+                            id,
+                            user_id
+                            )
+                    else:
+                        row = await conn.fetchrow(
+                            QueryString.UPDATE_BATCH_NO_EMBS.value,
+                            None,
+                            id,
+                            user_id
+                            )
+                    if row is None:
+                        raise NoUpdatesError('No changes were made to the db',(id,user_id,batch_id))
+                    logger.info("Update successful")
+                    if embeddings is None:
+                        return []
+                    return await Database._log(conn, user_id, seq,
+                                            [('U', row['id'], row['embeddings'])])
 
         except asyncpg.exceptions.PostgresSyntaxError as e:
             logger.error("Missing argument exception: %s",e)
         except asyncpg.exceptions.DataError as e:
             logger.error("Incorrect type inserted: %s", e)
+        except NotFoundError as e:
+            raise NoUpdatesError('No changes were made to the db',(id,user_id,batch_id)) from e
+
+
+    async def update_many(self,
+                        user_id: str,
+                        data: Sequence[tuple],
+                        model_version: str = None) -> Tuple[List[int], List[Change]]:
+        """
+        Instance method for updating many bugs of a user in one statement
+        Arguments
+        ---------
+        user_id: str
+            Indentification number of the user
+        data: List of tuples [(id, embeddings, batch_id, sentence)], one per bug
+            id: int - Identification number of the bug, unique within `data`
+            embeddings: List of floats | None - The new embeddings, kept if None
+            batch_id: int | None - The new batch number, kept if None
+            sentence: str | None - The cleaned text the embeddings were made from
+        model_version: str | None
+            Version of the model the embeddings were made with, not checked if None
+        Returns
+        -------
+        ids of the updated bugs and a list of the logged Change, one per new embeddings.
+        Raises NoUpdatesError if nothing is updated,
+        VersionMismatchError if `model_version` isn't the user's.
+        """
+        #rows of the new embeddings, the 1-based row of each bug or 0 to keep its embeddings
+        embeddings, rows = [], []
+        for _, emb, _, _ in data:
+            if emb is not None:
+                embeddings.append(list(emb))
+            rows.append(len(embeddings) if emb is not None else 0)
+
+        async with self._acquire('update_many', written=(user_id,)) as conn:
+            async with conn.transaction():
+                try:
+                    _, seq = await Database._lock_user(conn, user_id,
+                                                    model_version if embeddings else None)
+                except NotFoundError as e:
+                    raise NoUpdatesError('No changes were made to the db', user_id) from e
+                #single bug updates store (1, dim) embeddings, slicing a row keeps that shape
+                updated = await conn.fetch(QueryString.UPDATE_MANY.value, user_id,
+                                        [row[0] for row in data],
+                                        [row[2] for row in data],
+                                        [row[3] for row in data],
+                                        rows,
+                                        embeddings)
+                if not updated:
+                    raise NoUpdatesError('No changes were made to the db', user_id)
+                changes = await Database._log(conn, user_id, seq,
+                    [('U', row['id'], row['embeddings']) for row in updated if row['emb'] > 0])
+                return [row['id'] for row in updated], changes
 
 
-    async def delete(self, id: int, user_id: str) -> None:
+    async def delete(self, id: int, user_id: str) -> List[Change]:
         """
         Instance method for removing a row from the database
         Arguments
@@ -378,17 +837,25 @@ class Database:
             User identification number
         Returns
         -------
-        None, raises NoUpdatesError if no deletion occurs.
+        list with the logged Change, raises NoUpdatesError if no deletion occurs.
         """
 
-        async with self.pool.acquire() as conn:
-            result = await conn.fetch(QueryString.DELETE.value,id,user_id)
-            if result[0]['count'] == 0:
-                raise NoUpdatesError('Nothing was changed in the database',(id,user_id))
+        async with self._acquire('delete', written=(user_id,)) as conn:
+            async with conn.transaction():
+                try:
+                    _, seq = await Database._lock_user(conn, user_id)
+                except NotFoundError as e:
+                    raise NoUpdatesError('Nothing was changed in the database',(id,user_id)) from e
+                delete = conn.prepared(QueryString.DELETE)
+                rows = await delete.fetch(id,user_id)
+                if not rows:
+                    raise NoUpdatesError('Nothing was changed in the database',(id,user_id))
+                return await Database._log(conn, user_id, seq,
+                                        [('D', row['id'], None) for row in rows])
 
 
 
-    async def delete_batch(self,batch_id: int,user_id: str) -> None:
+    async def delete_batch(self,batch_id: int,user_id: str) -> List[Change]:
         """
         Instance method for removing a batch of rows
         Arguments
@@ -399,13 +866,50 @@ class Database:
             User identification number assosicated with this batch
         Returns
         -------
-        None, raises NoUpdatesError if no deletes occur
+        list of the logged Change, raises NoUpdatesError if no deletes occur
+        """
+
+        async with self._acquire('delete_batch', written=(user_id,)) as conn:
+            async with conn.transaction():
+                try:
+                    _, seq = await Database._lock_user(conn, user_id)
+                except NotFoundError as e:
+                    raise NoUpdatesError('Nothing was changed in the database',
+                                        (batch_id,user_id)) from e
+                rows = await conn.fetch(QueryString.DELETE_BATCH.value,batch_id,user_id)
+                if not rows:
+                    raise NoUpdatesError('Nothing was changed in the database',(batch_id,user_id))
+                return await Database._log(conn, user_id, seq,
+                                        [('D', row['id'], None) for row in rows])
+
+
+
+    async def delete_many(self, ids: Sequence[int], user_id: str) -> List[Change]:
+        """
+        Instance method for removing the rows with the given ids in one statement
+        Arguments
+        ---------
+        ids: list of int
+            Ids of the bugs, unknown ids are ignored
+        user_id: str
+            User identification number
+        Returns
+        -------
+        list of the logged Change, one per removed bug,
+        raises NoUpdatesError if no deletes occur
         """
 
-        async with self.pool.acquire() as conn:
-            result = await conn.fetch(QueryString.DELETE_BATCH.value,batch_id,user_id)
-            if result[0]['count'] == 0:
-                raise NoUpdatesError('Nothing was changed in the database',(batch_id,user_id))
+        async with self._acquire('delete_many', written=(user_id,)) as conn:
+            async with conn.transaction():
+                try:
+                    _, seq = await Database._lock_user(conn, user_id)
+                except NotFoundError as e:
+                    raise NoUpdatesError('Nothing was changed in the database',(ids,user_id)) from e
+                rows = await conn.fetch(QueryString.DELETE_MANY.value, user_id, list(ids))
+                if not rows:
+                    raise NoUpdatesError('Nothing was changed in the database',(ids,user_id))
+                return await Database._log(conn, user_id, seq,
+                                        [('D', row['id'], None) for row in rows])
 
 
 
@@ -421,9 +925,229 @@ class Database:
         """
 
 
-        async with self.pool.acquire() as conn:
+        async with self._acquire('fetch_users', self._read_pool()) as conn:
             rows = await conn.fetch(QueryString.FETCH_USERS.value)
             if not rows:
                 raise NotFoundError("Nothing in the Database")
             logger.info("Fetching all succeeded")
             return [row['user_id'] for row in rows]
+
+    async def fetch_model_versions(self) -> Dict[str, str]:
+        """
+        Instance method for fetching the model version of every user
+        Arguments
+        ---------
+        None
+        Returns
+        -------
+        dict of user_id -> model version, raises NotFoundError if no users exist in the database
+        """
+
+        async with self._acquire('fetch_model_versions', self._read_pool()) as conn:
+            rows = await conn.fetch(QueryString.FETCH_MODEL_VERSIONS.value)
+            if not rows:
+                raise NotFoundError("Nothing in the Database")
+            return {row['user_id']: row['model_version'] for row in rows}
+
+
+    async def fetch_snapshot(self, user_id: str) -> Tuple[Union[None,List[dict]], int, str]:
+        """
+        Instance method for fetching all rows of a user together with the
+        change log sequence number they reflect, read in one snapshot.
+        Arguments
+        ---------
+        user_id: str
+            User identification number
+        Returns
+        -------
+        (rows as returned by `fetch_all` or None, sequence number, model version),
+        raises NotFoundError if the user doesn't exist
+        """
+        async with self._acquire('fetch_snapshot', self._read_pool(user_id)) as conn:
+            async with conn.transaction(isolation='repeatable_read', readonly=True):
+                state = await conn.fetchrow(QueryString.FETCH_USER_STATE.value, user_id)
+                if state is None:
+                    raise NotFoundError('User not in database', user_id)
+                fetch = conn.prepared(QueryString.FETCH)
+                rows = await fetch.fetch(user_id)
+        return ([{'id': row['id'],
+                'embeddings': row['embeddings'],
+                'batch_id': row['batch_id']} for row in rows] or None,
+                state['log_seq'], state['model_version'])
+
+
+    async def fetch_changes(self, user_id: str, after_seq: int) -> List[Change]:
+        """
+        Instance method for fetching the change log of a user
+        Arguments
+        ---------
+        user_id: str
+            User identification number
+        after_seq: int
+            only return changes with a greater sequence number
+        Returns
+        -------
+        list of Change in sequence order, the first may be later than
+        `after_seq` + 1 if older changes were pruned
+        """
+        async with self._acquire('fetch_changes', self._read_pool(user_id)) as conn:
+            rows = await conn.fetch(QueryString.FETCH_CHANGES.value, user_id, after_seq)
+        return [Change(user_id, row['seq'], row['op'], row['id'], row['embeddings'])
+            for row in rows]
+
+
+    async def fetch_log_seqs(self) -> Dict[str, int]:
+        """
+        Instance method for fetching the last change log sequence number of every user
+        Arguments
+        ---------
+        None
+        Returns
+        -------
+        dict of user_id -> sequence number
+        """
+        async with self._acquire('fetch_log_seqs', self._read_pool()) as conn:
+            rows = await conn.fetch(QueryString.FETCH_LOG_SEQS.value)
+        return {row['user_id']: row['log_seq'] for row in rows}
+
+
+    async def prune_changes(self, retention: float) -> int:
+        """
+        Instance method for removing change log entries older than `retention` seconds.
+        Indexes behind the pruned entries reload their user with `fetch_snapshot`.
+        Arguments
+        ---------
+        retention: float
+            age in seconds of the entries to keep
+        Returns
+        -------
+        number of removed entries
+        """
+        async with self._acquire('prune_changes') as conn:
+            result = await conn.execute(QueryString.PRUNE_CHANGES.value, float(retention))
+        return int(result.split()[-1])
+
+
+    async def fetch_sentences(self, user_id: str, after_id: int, limit: int) -> List[tuple]:
+        """
+        Instance method for paging through a user's bug texts in id order
+        Arguments
+        ---------
+        user_id: str
+            User identification number
+        after_id: int
+            only return bugs with a greater id
+        limit: int
+            maximum number of bugs to return
+        Returns
+        -------
+        list of (id, sentence) tuples, sentence is None for bugs stored without text
+        """
+        async with self._acquire('fetch_sentences', self._read_pool(user_id)) as conn:
+            rows = await conn.fetch(QueryString.FETCH_SENTENCES.value, user_id, after_id, limit)
+        return [(row['id'], row['sentence']) for row in rows]
+
+
+    async def stage_embeddings(self, user_id: str, model_version: str, data: Sequence[tuple]) -> None:
+        """
+        Instance method for storing re-computed embeddings until `cutover`
+        Arguments
+        ---------
+        user_id: str
+            User identification number
+        model_version: str
+            Version of the model the embeddings were made with
+        data: list of (id, embeddings, sentence) tuples
+        Returns
+        -------
+        None
+        """
+        async with self._acquire('stage_embeddings') as conn:
+            await conn.executemany(QueryString.STAGE.value,
+                [(id, user_id, model_version, embeddings, sentence)
+                    for id, embeddings, sentence in data])
+
+
+    async def cutover(self, user_id: str, model_version: str) -> List[tuple]:
+        """
+        Instance method for atomically switching a user to the staged embeddings
+        of `model_version`. Nothing is changed if some bugs have no up to date
+        staged embeddings, e.g. bugs added or updated after they were staged.
+        Arguments
+        ---------
+        user_id: str
+            User identification number
+        model_version: str
+            Version of the staged embeddings
+        Returns
+        -------
+        list of (id, sentence) tuples of bugs that still need staging,
+        empty if the cutover was done
+        """
+        async with self._acquire('cutover', written=(user_id,)) as conn:
+            async with conn.transaction():
+                #blocks inserts and updates of embeddings for the user until committed
+                _, seq = await Database._lock_user(conn, user_id)
+                missing = await conn.fetch(QueryString.UNSTAGED.value, user_id, model_version)
+                if missing:
+                    return [(row['id'], row['sentence']) for row in missing]
+                await conn.execute(QueryString.CUTOVER.value, user_id, model_version)
+                await conn.execute(QueryString.SET_USER_VERSION.value, user_id, model_version)
+                await conn.execute(QueryString.CLEAR_STAGED.value, user_id)
+                #every embedding changed, indexes reload the user
+                await Database._log(conn, user_id, seq, [('R', None, None)])
+        logger.info('Switched user %s to model version %s', user_id, model_version)
+        return []
+
+
+    async def save_clusters(self, user_id: str, threshold: float, seq: int,
+                            clusters: Sequence[Sequence[int]]) -> None:
+        """
+        Instance method for replacing the stored near-duplicate clusters of a user
+        Arguments
+        ---------
+        user_id: str
+            User identification number
+        threshold: float
+            distance the clusters were computed with
+        seq: int
+            change log sequence number of the index the clusters were computed on
+        clusters: list of lists of ids, each cluster is named by its smallest id
+        Returns
+        -------
+        None
+        """
+        ids = [id for cluster in clusters for id in cluster]
+        cluster_ids = [min(cluster) for cluster in clusters for _ in cluster]
+        async with self._acquire('save_clusters') as conn:
+            async with conn.transaction():
+                await conn.execute(QueryString.CLEAR_CLUSTERS.value, user_id)
+                await conn.execute(QueryString.INSERT_CLUSTERS.value, user_id, ids, cluster_ids)
+                await conn.execute(QueryString.SET_CLUSTER_RUN.value, user_id,
+                                float(threshold), seq)
+
+
+    async def fetch_clusters(self, user_id: str) -> Union[None, dict]:
+        """
+        Instance method for fetching the stored near-duplicate clusters of a user
+        Arguments
+        ---------
+        user_id: str
+            User identification number
+        Returns
+        -------
+        None if the user was never clustered, else dict with 'threshold', 'seq',
+        'computed_at' (iso format) and 'clusters', lists of ids ordered by their smallest id
+        """
+        async with self._acquire('fetch_clusters', self._read_pool(user_id)) as conn:
+            run = await conn.fetchrow(QueryString.FETCH_CLUSTER_RUN.value, user_id)
+            if run is None:
+                return None
+            rows = await conn.fetch(QueryString.FETCH_CLUSTERS.value, user_id)
+        clusters = {}
+        for row in rows:
+            clusters.setdefault(row['cluster_id'], []).append(row['id'])
+        return {'threshold': run['threshold'],
+                'seq': run['log_seq'],
+                'computed_at': run['computed_at'].isoformat(),
+                'clusters': list(clusters.values())}
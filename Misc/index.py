@@ -0,0 +1,261 @@
+"""
+@author natidemis
+October 2026
+
+In-memory vector index of a user's bugs.
+
+Keeps the ids and embeddings next to the KDTree built over them, so writes
+can be applied as exact deltas from the rows `Database` returns instead of
+re-fetching every row of the user. `KDTreeUP` can only append, so removals
+and replacements mark the tree stale and it is rebuilt from memory on the
+next query.
+"""
+
+from __future__ import annotations
+from itertools import groupby
+from typing import Iterable, Iterator, List, Tuple, Union
+import numpy as np
+from up_utils.kdtree import KDTreeUP as KDTree
+from Misc.metrics import STAGE_SECONDS
+
+#relative tolerance of the radius in `VectorIndex.within`, distances
+#computed in another order may differ in the last bits
+RADIUS_RTOL = 1e-9
+
+
+class VectorIndex:
+    """
+    Ids and embeddings of a user's bugs with a KDTree for nearest neighbour queries.
+    Must only be used while holding the user's lock.
+    Class methods:
+        from_rows
+    Instance methods:
+        query
+        ranked
+        within
+        embedding
+        add
+        remove
+    Instance variables:
+        ids
+        embeddings
+    """
+    __slots__ = ('ids', 'embeddings', '_tree')
+
+    def __init__(self, ids: np.ndarray, embeddings: np.ndarray):
+        """
+        Arguments
+        ---------
+        ids: np.ndarray
+            ids of the bugs, unique
+        embeddings: np.ndarray
+            (len(ids), dim) embeddings, row i belongs to ids[i]
+        """
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.embeddings = np.asarray(embeddings, dtype=np.float64).reshape(len(self.ids), -1)
+        self._tree = None
+
+    @classmethod
+    def from_rows(cls, rows: Union[None, Iterable[dict]]) -> Union[None, VectorIndex]:
+        """
+        Index of `rows` as returned by `Database`, dicts with 'id' and 'embeddings'.
+        Returns
+        -------
+        VectorIndex, None if there are no rows
+        """
+        rows = list(rows or ())
+        if not rows:
+            return None
+        return cls(np.fromiter((row['id'] for row in rows), dtype=np.int64, count=len(rows)),
+                np.vstack([row['embeddings'] for row in rows]))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Bytes of the ids and embeddings, the tree not included
+        """
+        return self.ids.nbytes + self.embeddings.nbytes
+
+    @property
+    def tree(self) -> KDTree:
+        """
+        KDTree over the current embeddings, built on first use after a change
+        """
+        if self._tree is None:
+            with STAGE_SECONDS.time('index_build'):
+                self._tree = KDTree(data=self.embeddings, indices=self.ids)
+        return self._tree
+
+    def query(self, vec: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Distances and ids of the `k` nearest bugs to `vec`, ties in
+        distance ordered by id like `ranked`
+        """
+        tree = self.tree
+        with STAGE_SECONDS.time('index_query'):
+            dists, ids = tree.query(vec, k=k)
+        order = np.lexsort((ids, dists), axis=-1)
+        return np.take_along_axis(dists, order, -1), np.take_along_axis(ids, order, -1)
+
+    def ranked(self, vec: np.ndarray, k: int,
+            page: int = 256) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Distances and ids of the `k` nearest bugs to `vec` in ranked pages, the
+        neighbours of `query` computed from the embeddings. The first page holds
+        `page` bugs and each next page twice as many, so the first results are
+        ready after one pass over the distances. Ties in distance are ordered
+        by id, also across pages.
+        Reads the current arrays, `add` and `remove` replace them instead of
+        changing them, so the pages may be consumed after releasing the lock.
+        Arguments
+        ---------
+        vec: np.ndarray
+            embeddings of the query
+        k: int
+            number of bugs, at most all of them
+        page: int
+            size of the first page
+        Returns
+        -------
+        iterator of (dists, ids) pages in ranked order
+        """
+        ids, embeddings = self.ids, self.embeddings
+        with STAGE_SECONDS.time('index_query'):
+            diff = embeddings - np.ravel(vec)
+            dists = np.sqrt(np.einsum('ij,ij->i', diff, diff))
+        k = min(k, len(ids))
+
+        def pages():
+            remaining, start, size = np.arange(len(ids)), 0, max(page, 1)
+            while start < k:
+                n = min(size, k - start)
+                if n < len(remaining):
+                    part = np.argpartition(dists[remaining], n - 1)
+                    top, remaining = remaining[part[:n]], remaining[part[n:]]
+                    edge = dists[top].max()
+                    tied = dists[remaining] == edge
+                    if tied.any():
+                        #bugs tied at the page boundary go to the smaller ids first
+                        inside = dists[top] == edge
+                        pool = np.concatenate([top[inside], remaining[tied]])
+                        pool = pool[np.argsort(ids[pool], kind='stable')]
+                        top = np.concatenate([top[~inside], pool[:np.count_nonzero(inside)]])
+                        remaining = np.concatenate([remaining[~tied],
+                                                    pool[np.count_nonzero(inside):]])
+                else:
+                    top, remaining = remaining, remaining[:0]
+                top = top[np.lexsort((ids[top], dists[top]))]
+                yield dists[top], ids[top]
+                start, size = start + n, size * 2
+        return pages()
+
+    def within(self, vec: np.ndarray, radius: float, limit: int,
+            block: int = 4096) -> Tuple[np.ndarray, np.ndarray, bool]:
+        """
+        Distances and ids of the bugs within `radius` of `vec`, nearest first, ties by id.
+        Scans the embeddings in blocks of `block` rows and stops once more
+        than `limit` bugs are found, then the result is truncated to `limit`
+        of the bugs found so far, which need not be the nearest.
+        Distances are compared as returned, with a relative tolerance of
+        RADIUS_RTOL, so the distance of a neighbour from `query` or `ranked`
+        used as `radius` includes that neighbour.
+        Arguments
+        ---------
+        vec: np.ndarray
+            embeddings of the query
+        radius: float
+            largest distance returned, inclusive
+        limit: int
+            most bugs returned
+        Returns
+        -------
+        dists, ids, and whether the result was truncated
+        """
+        ids, embeddings, vec = self.ids, self.embeddings, np.ravel(vec)
+        bound = radius * (1 + RADIUS_RTOL)
+        found, count = [], 0
+        with STAGE_SECONDS.time('index_query'):
+            for start in range(0, len(ids), block):
+                diff = embeddings[start:start + block] - vec
+                dists = np.sqrt(np.einsum('ij,ij->i', diff, diff))
+                hits = np.flatnonzero(dists <= bound)
+                found.append((dists[hits], hits + start))
+                count += len(hits)
+                if count > limit:
+                    break
+        dists = np.concatenate([dist for dist, _ in found]) if found else np.empty(0)
+        rows = np.concatenate([rows for _, rows in found]) if found else np.empty(0, dtype=np.int64)
+        order = np.lexsort((ids[rows], dists))[:limit]
+        return dists[order], ids[rows[order]], count > limit
+
+    def embedding(self, id: int) -> Union[None, np.ndarray]: #pylint: disable=redefined-builtin
+        """
+        Embeddings of the bug `id`, None if it isn't indexed
+        """
+        rows = np.flatnonzero(self.ids == id)
+        return self.embeddings[rows[0]] if len(rows) else None
+
+    def add(self, ids: List[int], embeddings: np.ndarray) -> None:
+        """
+        Add bugs, bugs whose id is already indexed are replaced.
+        Arguments
+        ---------
+        ids: list[int]
+        embeddings: np.ndarray
+            embeddings of the bugs, row i belongs to ids[i]
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        #single bugs are stored as (1, dim) arrays
+        embeddings = np.asarray(embeddings, dtype=np.float64).reshape(len(ids), -1)
+        replaced = np.isin(self.ids, ids)
+        if replaced.any():
+            self.ids, self.embeddings = self.ids[~replaced], self.embeddings[~replaced]
+            self._tree = None
+        if self._tree is not None:
+            for id, embedding in zip(ids, embeddings): #pylint: disable=redefined-builtin
+                self._tree.update(embedding[None], int(id))
+        self.ids = np.concatenate([self.ids, ids])
+        self.embeddings = np.vstack([self.embeddings, embeddings])
+
+    def remove(self, ids: List[int]) -> None:
+        """
+        Remove the bugs with `ids`, unknown ids are ignored.
+        """
+        keep = ~np.isin(self.ids, np.asarray(ids, dtype=np.int64))
+        if not keep.all():
+            self.ids, self.embeddings = self.ids[keep], self.embeddings[keep]
+            self._tree = None
+
+
+def apply_changes(index: Union[None, VectorIndex], changes: Iterable) -> Union[None, VectorIndex]:
+    """
+    Apply change log entries ('U' add or update, 'D' remove) to `index` in order.
+    Runs of the same operation are applied together, raises ValueError for other operations. Applying a change twice
+    has no further effect, so replaying from an older sequence number is safe.
+    Arguments
+    ---------
+    index: VectorIndex | None
+        the index to change, None if it is empty
+    changes: iterable of Misc.db.Change
+    Returns
+    -------
+    the changed index, a new one if `index` was None, None if it is empty
+    """
+    for op, run in groupby(changes, key=lambda change: change.op):
+        if op == 'D':
+            if index is not None:
+                index.remove([change.id for change in run])
+            continue
+        if op != 'U':
+            raise ValueError('Cannot apply change {}, reload the user'.format(op))
+        #the last change of an id in the run wins
+        latest = {change.id: change.embeddings for change in run}
+        embeddings = np.vstack([np.ravel(emb) for emb in latest.values()])
+        if index is None:
+            index = VectorIndex(list(latest), embeddings)
+        else:
+            index.add(list(latest), embeddings)
+    return index if index is not None and len(index) else None
@@ -0,0 +1,423 @@
+# pylint: disable=C0103
+"""
+@author natidemis
+October 2026
+
+Inference backends for the encoder model.
+
+`KerasBackend` runs the saved `Models` directory with TensorFlow.
+`NumpyBackend` runs a copy of its weights exported by `export_numpy` with a
+pure NumPy forward pass, avoiding the TensorFlow import and its memory per worker.
+The backend is selected with `INFERENCE_BACKEND` ('keras' or 'numpy') in '.env'.
+
+Usage:
+    python -m Misc.inference Models Models.npz
+"""
+
+from __future__ import annotations
+import os
+import json
+import argparse
+from typing import List, Optional, Tuple
+import numpy as np
+from Misc.log import logger
+
+
+class InferenceBackend:
+    """
+    Interface of the encoder backends
+    Instance methods:
+        predict
+    Instance variables:
+        input_shape
+    """
+    input_shape: Tuple[Optional[int], ...]
+
+    def predict(self, x: np.ndarray) -> np.ndarray:
+        """
+        Run the encoder on a batch of sentence matrices.
+        Arguments
+        ---------
+        x: np.ndarray of shape (batch, sentence_length, dim)
+        Returns
+        -------
+        np.ndarray of shape (batch, embedding dimension)
+        """
+        raise NotImplementedError
+
+
+class KerasBackend(InferenceBackend):
+    """
+    Runs the saved keras model with TensorFlow
+    """
+
+    def __init__(self, path: str):
+        import tensorflow as tf  # pylint: disable=import-outside-toplevel
+        self.model = tf.keras.models.load_model(path, compile=False)
+        self.input_shape = tuple(self.model.input_shape)
+
+    def predict(self, x: np.ndarray) -> np.ndarray:
+        return self.model.predict(x)
+
+
+##################
+### Activations ##
+##################
+
+def _sigmoid(x):
+    return 1 / (1 + np.exp(-x))
+
+def _softmax(x):
+    e = np.exp(x - x.max(axis=-1, keepdims=True))
+    return e / e.sum(axis=-1, keepdims=True)
+
+def _elu(x):
+    return np.where(x > 0, x, np.expm1(np.minimum(x, 0)))
+
+ACTIVATIONS = {
+    'linear': lambda x: x,
+    'relu': lambda x: np.maximum(x, 0),
+    'tanh': np.tanh,
+    'sigmoid': _sigmoid,
+    'hard_sigmoid': lambda x: np.clip(0.2 * x + 0.5, 0, 1),
+    'softmax': _softmax,
+    'softplus': lambda x: np.logaddexp(x, 0),
+    'softsign': lambda x: x / (1 + np.abs(x)),
+    'elu': _elu,
+    'selu': lambda x: 1.0507009873554805 * np.where(x > 0, x, 1.6732632423543772 * np.expm1(np.minimum(x, 0))),
+    'swish': lambda x: x * _sigmoid(x),
+}
+
+def _activation(name: str):
+    if name not in ACTIVATIONS:
+        raise ValueError('Unsupported activation: {}'.format(name))
+    return ACTIVATIONS[name]
+
+
+##############
+### Layers ###
+##############
+
+def _dense(cfg, weights, x, mask):
+    y = x @ weights[0]
+    if cfg.get('use_bias', True):
+        y = y + weights[1]
+    return _activation(cfg['activation'])(y), mask
+
+
+def _conv1d(cfg, weights, x, mask):
+    kernel = weights[0]
+    size, stride = kernel.shape[0], cfg['strides'][0]
+    dilation = cfg['dilation_rate'][0]
+    span = (size - 1) * dilation + 1
+    if cfg['padding'] == 'same':
+        pad = max((int(np.ceil(x.shape[1] / stride)) - 1) * stride + span - x.shape[1], 0)
+        x = np.pad(x, ((0, 0), (pad // 2, pad - pad // 2), (0, 0)))
+    elif cfg['padding'] == 'causal':
+        x = np.pad(x, ((0, 0), (span - 1, 0), (0, 0)))
+    windows = np.lib.stride_tricks.sliding_window_view(x, span, axis=1)[:, ::stride, :, ::dilation]
+    y = np.einsum('btck,kco->bto', windows, kernel)
+    if cfg.get('use_bias', True):
+        y = y + weights[1]
+    return _activation(cfg['activation'])(y), None
+
+
+def _pool1d(cfg, x, reduce):
+    size, stride = cfg['pool_size'][0], cfg['strides'][0]
+    if cfg['padding'] == 'same':
+        raise ValueError('Unsupported pooling padding: same')
+    windows = np.lib.stride_tricks.sliding_window_view(x, size, axis=1)[:, ::stride]
+    return reduce(windows, axis=-1)
+
+
+def _global_pool(x, mask, average):
+    if not average:
+        return x.max(axis=1)
+    if mask is None:
+        return x.mean(axis=1)
+    m = mask[:, :, None]
+    return (x * m).sum(axis=1) / np.maximum(m.sum(axis=1), 1)
+
+
+def _batch_norm(cfg, weights, x, mask):
+    weights = list(weights)
+    gamma = weights.pop(0) if cfg.get('scale', True) else 1
+    beta = weights.pop(0) if cfg.get('center', True) else 0
+    mean, var = weights
+    return (x - mean) / np.sqrt(var + cfg['epsilon']) * gamma + beta, mask
+
+
+def _layer_norm(cfg, weights, x, mask):
+    axis = cfg['axis']
+    axis = tuple(axis) if isinstance(axis, list) else axis
+    mean = x.mean(axis=axis, keepdims=True)
+    var = x.var(axis=axis, keepdims=True)
+    y = (x - mean) / np.sqrt(var + cfg['epsilon'])
+    weights = list(weights)
+    if cfg.get('scale', True):
+        y = y * weights.pop(0)
+    if cfg.get('center', True):
+        y = y + weights.pop(0)
+    return y, mask
+
+
+def _lstm_step(cfg, weights):
+    kernel, recurrent, bias = (list(weights) + [None])[:3]
+    units = recurrent.shape[0]
+    act = _activation(cfg['activation'])
+    rec_act = _activation(cfg['recurrent_activation'])
+
+    def step(xt, state):
+        h, c = state
+        z = xt @ kernel + h @ recurrent
+        if bias is not None and cfg.get('use_bias', True):
+            z = z + bias
+        i = rec_act(z[:, :units])
+        f = rec_act(z[:, units:2 * units])
+        c = f * c + i * act(z[:, 2 * units:3 * units])
+        o = rec_act(z[:, 3 * units:])
+        h = o * act(c)
+        return h, (h, c)
+    return units, 2, step
+
+
+def _gru_step(cfg, weights):
+    kernel, recurrent = weights[0], weights[1]
+    use_bias = cfg.get('use_bias', True)
+    bias = weights[2] if use_bias else None
+    units = recurrent.shape[0]
+    act = _activation(cfg['activation'])
+    rec_act = _activation(cfg['recurrent_activation'])
+    reset_after = cfg.get('reset_after', False)
+    if use_bias and reset_after:
+        input_bias, recurrent_bias = bias[0], bias[1]
+    else:
+        input_bias, recurrent_bias = bias, None
+
+    def step(xt, state):
+        h = state[0]
+        x = xt @ kernel
+        if input_bias is not None:
+            x = x + input_bias
+        if reset_after:
+            r_in = h @ recurrent
+            if recurrent_bias is not None:
+                r_in = r_in + recurrent_bias
+            z = rec_act(x[:, :units] + r_in[:, :units])
+            r = rec_act(x[:, units:2 * units] + r_in[:, units:2 * units])
+            hh = act(x[:, 2 * units:] + r * r_in[:, 2 * units:])
+        else:
+            z = rec_act(x[:, :units] + h @ recurrent[:, :units])
+            r = rec_act(x[:, units:2 * units] + h @ recurrent[:, units:2 * units])
+            hh = act(x[:, 2 * units:] + (r * h) @ recurrent[:, 2 * units:])
+        h = z * h + (1 - z) * hh
+        return h, (h,)
+    return units, 1, step
+
+
+def _simple_rnn_step(cfg, weights):
+    kernel, recurrent = weights[0], weights[1]
+    bias = weights[2] if cfg.get('use_bias', True) else None
+    act = _activation(cfg['activation'])
+
+    def step(xt, state):
+        z = xt @ kernel + state[0] @ recurrent
+        if bias is not None:
+            z = z + bias
+        h = act(z)
+        return h, (h,)
+    return recurrent.shape[0], 1, step
+
+
+RNN_STEPS = {'LSTM': _lstm_step, 'GRU': _gru_step, 'SimpleRNN': _simple_rnn_step}
+
+
+def _rnn(class_name, cfg, weights, x, mask):
+    units, n_states, step = RNN_STEPS[class_name](cfg, weights)
+    batch, steps = x.shape[0], x.shape[1]
+    state = tuple(np.zeros((batch, units), dtype=x.dtype) for _ in range(n_states))
+    output = np.zeros((batch, units), dtype=x.dtype)
+    outputs = []
+    order = range(steps - 1, -1, -1) if cfg.get('go_backwards', False) else range(steps)
+    for t in order:
+        out, new_state = step(x[:, t], state)
+        if mask is not None:
+            m = mask[:, t, None]
+            out = np.where(m, out, output)
+            new_state = tuple(np.where(m, n, s) for n, s in zip(new_state, state))
+        output, state = out, new_state
+        if mask is not None and cfg.get('zero_output_for_mask', False):
+            outputs.append(np.where(mask[:, t, None], output, 0))
+        else:
+            outputs.append(output)
+    if cfg.get('return_sequences', False):
+        return np.stack(outputs, axis=1), mask
+    return output, None
+
+
+def _bidirectional(cfg, weights, x, mask):
+    inner = cfg['layer']
+    half = len(weights) // 2
+    #keras zeroes the masked outputs of both directions when returning sequences
+    zero = inner['config'].get('return_sequences', False)
+    forward_cfg = dict(inner['config'], go_backwards=False, zero_output_for_mask=zero)
+    backward_cfg = dict(inner['config'], go_backwards=True, zero_output_for_mask=zero)
+    forward, out_mask = _rnn(inner['class_name'], forward_cfg, weights[:half], x, mask)
+    backward, _ = _rnn(inner['class_name'], backward_cfg, weights[half:], x, mask)
+    if inner['config'].get('return_sequences', False):
+        backward = backward[:, ::-1]
+    merge = cfg.get('merge_mode', 'concat')
+    if merge == 'concat':
+        return np.concatenate([forward, backward], axis=-1), out_mask
+    if merge == 'sum':
+        return forward + backward, out_mask
+    if merge == 'ave':
+        return (forward + backward) / 2, out_mask
+    if merge == 'mul':
+        return forward * backward, out_mask
+    raise ValueError('Unsupported merge mode: {}'.format(merge))
+
+
+def _apply(layer: dict, weights: List[np.ndarray], x: np.ndarray, mask):
+    """
+    Apply an exported layer to `x`, returns the output and its mask.
+    """
+    name, cfg = layer['class_name'], layer['config']
+    if name in ('InputLayer', 'Dropout', 'SpatialDropout1D', 'GaussianNoise',
+                'GaussianDropout', 'AlphaDropout', 'ActivityRegularization'):
+        return x, mask
+    if name == 'Masking':
+        mask = np.any(x != cfg['mask_value'], axis=-1)
+        return x * mask[:, :, None], mask
+    if name == 'Dense':
+        return _dense(cfg, weights, x, mask)
+    if name == 'Activation':
+        return _activation(cfg['activation'])(x), mask
+    if name == 'Flatten':
+        return x.reshape(x.shape[0], -1), None
+    if name == 'Reshape':
+        return x.reshape((x.shape[0],) + tuple(cfg['target_shape'])), None
+    if name == 'Conv1D':
+        return _conv1d(cfg, weights, x, mask)
+    if name == 'MaxPooling1D':
+        return _pool1d(cfg, x, np.max), None
+    if name == 'AveragePooling1D':
+        return _pool1d(cfg, x, np.mean), None
+    if name == 'GlobalAveragePooling1D':
+        return _global_pool(x, mask, average=True), None
+    if name == 'GlobalMaxPooling1D':
+        return _global_pool(x, mask, average=False), None
+    if name == 'BatchNormalization':
+        return _batch_norm(cfg, weights, x, mask)
+    if name == 'LayerNormalization':
+        return _layer_norm(cfg, weights, x, mask)
+    if name in RNN_STEPS:
+        return _rnn(name, cfg, weights, x, mask)
+    if name == 'Bidirectional':
+        return _bidirectional(cfg, weights, x, mask)
+    raise ValueError('Unsupported layer: {}'.format(name))
+
+
+SUPPORTED_LAYERS = {'InputLayer', 'Dropout', 'SpatialDropout1D', 'GaussianNoise',
+    'GaussianDropout', 'AlphaDropout', 'ActivityRegularization', 'Masking', 'Dense',
+    'Activation', 'Flatten', 'Reshape', 'Conv1D', 'MaxPooling1D', 'AveragePooling1D',
+    'GlobalAveragePooling1D', 'GlobalMaxPooling1D', 'BatchNormalization',
+    'LayerNormalization', 'Bidirectional', *RNN_STEPS}
+
+
+class NumpyBackend(InferenceBackend):
+    """
+    Pure NumPy forward pass over weights exported by `export_numpy`
+    """
+
+    def __init__(self, path: str):
+        with np.load(path, allow_pickle=False) as archive:
+            spec = json.loads(str(archive['spec']))
+            self._weights = [[archive['{}_{}'.format(i, j)] for j in range(layer['n_weights'])]
+                                for i, layer in enumerate(spec['layers'])]
+        self._layers = spec['layers']
+        self.input_shape = tuple(spec['input_shape'])
+
+    def predict(self, x: np.ndarray) -> np.ndarray:
+        x = np.asarray(x, dtype=np.float32)
+        mask = None
+        for layer, weights in zip(self._layers, self._weights):
+            x, mask = _apply(layer, weights, x, mask)
+        return x
+
+
+def _flatten_layers(model) -> list:
+    layers = []
+    for layer in model.layers:
+        if hasattr(layer, 'layers') and layer.__class__.__name__ in ('Sequential', 'Functional'):
+            layers.extend(_flatten_layers(layer))
+        else:
+            layers.append(layer)
+    return layers
+
+
+def export_numpy(model, path: str) -> None:
+    """
+    Export the weights of a sequential keras `model` for `NumpyBackend`.
+    Arguments
+    ---------
+    model: tf.keras.Model
+        model whose layers are applied one after the other
+    path: str
+        '.npz' file to write
+    Returns
+    -------
+    None, raises ValueError if the model contains an unsupported layer
+    """
+    layers, arrays = [], {}
+    for i, layer in enumerate(_flatten_layers(model)):
+        name = layer.__class__.__name__
+        if name not in SUPPORTED_LAYERS:
+            raise ValueError('Unsupported layer: {}'.format(name))
+        config = layer.get_config()
+        weights = layer.get_weights()
+        layers.append({'class_name': name, 'config': config, 'n_weights': len(weights)})
+        for j, w in enumerate(weights):
+            arrays['{}_{}'.format(i, j)] = np.asarray(w, dtype=np.float32)
+    spec = {'input_shape': list(model.input_shape), 'layers': layers}
+    np.savez(path, spec=np.array(json.dumps(spec, default=str)), **arrays)
+    logger.info('Exported %d layers to %s', len(layers), path)
+
+
+def load_backend(name: str = None, path: str = None) -> InferenceBackend:
+    """
+    Load the inference backend `name`, read from `INFERENCE_BACKEND` if not given.
+    Arguments
+    ---------
+    name: str | None
+        'keras' loads `MODEL_PATH`, 'numpy' loads `NUMPY_MODEL_PATH`
+    path: str | None
+        load this model instead, the backend is picked from its extension
+        ('.npz' for numpy) when `name` is not given
+    Returns
+    -------
+    InferenceBackend
+    """
+    if path is not None and name is None:
+        name = 'numpy' if path.endswith('.npz') else 'keras'
+    name = name or os.getenv('INFERENCE_BACKEND', 'keras')
+    if name == 'keras':
+        return KerasBackend(path or os.getenv('MODEL_PATH', 'Models'))
+    if name == 'numpy':
+        return NumpyBackend(path or os.getenv('NUMPY_MODEL_PATH', 'Models.npz'))
+    raise ValueError('Unknown inference backend: {}'.format(name))
+
+
+def main():
+    """
+    Command line entry point for exporting the saved model for `NumpyBackend`
+    """
+    parser = argparse.ArgumentParser(description='Export the encoder for the numpy backend')
+    parser.add_argument('model', nargs='?', default=os.getenv('MODEL_PATH', 'Models'))
+    parser.add_argument('output', nargs='?', default=os.getenv('NUMPY_MODEL_PATH', 'Models.npz'))
+    args = parser.parse_args()
+    export_numpy(KerasBackend(args.model).model, args.output)
+
+
+if __name__ == '__main__':
+    main()
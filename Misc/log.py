@@ -3,23 +3,152 @@
 May 2021
 
 File for logging purposes
+
+Records are put on a queue by the calling thread and written by a listener
+thread, so logging never blocks the event loop on disk I/O. Exceptions are
+formatted before the record is queued and kept apart from the message.
+Configured from '.env':
+    LOG_LEVEL      - level of the logger, INFO by default
+    LOG_FILE       - file records are written to as json lines, 'server.log' by default,
+                     empty to disable the file
+    LOG_MAX_LENGTH - size cap of objects formatted with `brief`, 500 by default
 """
+import os
+import sys
+import copy
+import json
+import queue
+import atexit
 import logging
+import reprlib
+from logging.handlers import QueueHandler, QueueListener
+from dotenv import load_dotenv
+
+load_dotenv()
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FILE = os.getenv('LOG_FILE', 'server.log')
+LOG_MAX_LENGTH = int(os.getenv('LOG_MAX_LENGTH', '500'))
+
+#attributes every LogRecord has, anything else was passed through 'extra'
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+_EXCEPTION_FORMATTER = logging.Formatter()
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a record as a single json line, fields passed
+    through `extra` are included as they are.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+                'level': record.levelname,
+                'logger': record.name,
+                'file': record.filename,
+                'line': record.lineno,
+                'message': record.getMessage()}
+        entry.update({key: value for key, value in vars(record).items()
+                    if key not in _RECORD_ATTRS})
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc_info'] = record.exc_text
+        if record.stack_info:
+            entry['stack_info'] = record.stack_info
+        return json.dumps(entry, default=str)
+
+
+class RecordQueueHandler(QueueHandler):
+    """
+    `QueueHandler` keeping the exception of a record apart from its message.
+    The base class merges the traceback into 'msg', so the listener's
+    formatters would only see it as part of the message.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Copy of `record` with its message formatted and its exception formatted
+        into 'exc_text', the traceback itself isn't kept on the queue
+        """
+        record = copy.copy(record)
+        record.message = record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _EXCEPTION_FORMATTER.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class _BriefRepr(reprlib.Repr):
+    """
+    `reprlib.Repr` that also caps objects without a specific repr method
+    """
+
+    def __init__(self, maxlength: int):
+        super().__init__()
+        self.maxlevel = 3
+        self.maxdict = self.maxlist = self.maxtuple = self.maxset = 10
+        self.maxstring = self.maxother = maxlength
+        self.maxlength = maxlength
+
+    def repr(self, x) -> str:
+        text = super().repr(x)
+        if len(text) > self.maxlength:
+            text = text[:self.maxlength - 3] + '...'
+        return text
+
+
+class brief: #pylint: disable=invalid-name
+    """
+    Wraps an object passed as a logging argument, it is only formatted when
+    the record is emitted and then capped at `maxlength` characters.
+    Usage:
+        logger.debug('state: %s', brief(user_manager))
+    """
+    __slots__ = ('obj', 'maxlength')
+
+    def __init__(self, obj, maxlength: int = LOG_MAX_LENGTH):
+        self.obj = obj
+        self.maxlength = maxlength
+
+    def __str__(self) -> str:
+        return _BriefRepr(self.maxlength).repr(self.obj)
+
+    __repr__ = __str__
+
 
 logger = logging.getLogger('server_logger')
-logger.setLevel(logging.DEBUG)
-# create file handler which logs even debug messages
-fh = logging.FileHandler('server.log')
-fh.setLevel(logging.DEBUG)
-# create console handler with a higher log level
-ch = logging.StreamHandler()
+logger.setLevel(LOG_LEVEL)
+logger.propagate = False
+
+handlers = []
+if LOG_FILE:
+    # file handler writing json lines
+    fh = logging.FileHandler(LOG_FILE)
+    fh.setFormatter(JsonFormatter())
+    handlers.append(fh)
+# console handler with a higher log level
+ch = logging.StreamHandler(sys.stderr)
 ch.setLevel(logging.ERROR)
-# create formatter and add it to the handlers
-formatter = logging.Formatter('%(levelname)-8s [%(filename)s:%(lineno)d:%(asctime)s] %(message)s',
-                                 datefmt='%Y-%m-%d %H:%M:%S')
-
-ch.setFormatter(formatter)
-fh.setFormatter(formatter)
-# add the handlers to logger
-logger.addHandler(ch)
-logger.addHandler(fh)
+ch.setFormatter(logging.Formatter(
+    '%(levelname)-8s [%(filename)s:%(lineno)d:%(asctime)s] %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'))
+handlers.append(ch)
+
+log_queue = queue.SimpleQueue()
+listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+logger.addHandler(RecordQueueHandler(log_queue))
+listener.start()
+atexit.register(listener.stop)
+
+
+def _restart_listener():
+    """
+    Threads do not survive a fork, gunicorn workers forked from a
+    '--preload' master need their own listener.
+    """
+    listener._thread = None #pylint: disable=protected-access
+    listener.start()
+
+
+os.register_at_fork(after_in_child=_restart_listener)
@@ -0,0 +1,235 @@
+"""
+@author natidemis
+October 2026
+
+Prometheus style metrics, rendered in the text exposition format on '/metrics'.
+
+Metrics are plain in-process objects so recording one is a dict update,
+cheap enough for the request hot path. Each gunicorn worker exposes its own.
+"""
+
+from __future__ import annotations
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple
+
+DEFAULT_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metric:
+    """
+    Base class of all metrics
+    Instance methods:
+        render
+    Instance variables:
+        name
+        documentation
+        labelnames
+    """
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _labels(self, labels: tuple, extra: str = '') -> str:
+        pairs = ['{}="{}"'.format(n, _escape(v)) for n, v in zip(self.labelnames, labels)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    def _samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        """
+        Lines of this metric in the text exposition format
+        """
+        with self._lock:
+            samples = list(self._samples())
+        return ['# HELP {} {}'.format(self.name, self.documentation),
+                '# TYPE {} {}'.format(self.name, self.kind)] + samples
+
+
+class Counter(Metric):
+    """
+    Monotonically increasing count
+    """
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        """
+        Increase the count for `labels` by `amount`
+        """
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def get(self, *labels) -> float:
+        """
+        Current count for `labels`
+        """
+        return self._values.get(labels, 0)
+
+    def _samples(self):
+        for labels, value in self._values.items():
+            yield '{}{} {}'.format(self.name, self._labels(labels), value)
+
+
+class Gauge(Metric):
+    """
+    Value that can go up and down
+    """
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[tuple, float] = {}
+
+    def set(self, value: float, *labels) -> None:
+        """
+        Set the value for `labels`
+        """
+        with self._lock:
+            self._values[labels] = value
+
+    def remove(self, *labels) -> None:
+        """
+        Stop exposing the value for `labels`
+        """
+        with self._lock:
+            self._values.pop(labels, None)
+
+    def get(self, *labels) -> float:
+        """
+        Current value for `labels`
+        """
+        return self._values.get(labels, 0)
+
+    def _samples(self):
+        for labels, value in self._values.items():
+            yield '{}{} {}'.format(self.name, self._labels(labels), value)
+
+
+class Histogram(Metric):
+    """
+    Distribution of observed values in cumulative buckets
+    """
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._counts: Dict[tuple, List[int]] = {}
+        self._sums: Dict[tuple, float] = {}
+
+    def observe(self, value: float, *labels) -> None:
+        """
+        Record `value` for `labels`
+        """
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.get(labels)
+            if counts is None:
+                counts = self._counts[labels] = [0] * (len(self.buckets) + 1)
+                self._sums[labels] = 0.0
+            counts[i] += 1
+            self._sums[labels] += value
+
+    @contextmanager
+    def time(self, *labels):
+        """
+        Context manager observing the seconds spent in its body
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def count(self, *labels) -> int:
+        """
+        Number of observations for `labels`
+        """
+        return sum(self._counts.get(labels, ()))
+
+    def _samples(self):
+        for labels, counts in self._counts.items():
+            total = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                total += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                yield '{}_bucket{} {}'.format(self.name,
+                                            self._labels(labels, 'le="{}"'.format(le)), total)
+            yield '{}_sum{} {}'.format(self.name, self._labels(labels), self._sums[labels])
+            yield '{}_count{} {}'.format(self.name, self._labels(labels), total)
+
+
+class MetricsRegistry:
+    """
+    Collection of metrics rendered together
+    Instance methods:
+        register
+        render
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        """
+        Add `metric`, raises ValueError if its name is taken
+        """
+        if metric.name in self._metrics:
+            raise ValueError('Metric {} already registered'.format(metric.name))
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """
+        All metrics in the text exposition format
+        """
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'bcj_stage_seconds',
+    'Seconds spent per pipeline stage (clean, sentence_matrix, predict, lock_wait, '
+    'index_query, index_build, clustering)',
+    ('stage',)))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'bcj_http_request_seconds', 'Seconds spent per HTTP request', ('method', 'route', 'status')))
+DB_ACQUIRE_SECONDS = REGISTRY.register(Histogram(
+    'bcj_db_pool_acquire_seconds', 'Seconds waited for a pooled database connection'))
+DB_SECONDS = REGISTRY.register(Histogram(
+    'bcj_db_seconds', 'Seconds a database connection was held per operation', ('operation',)))
+DB_POOL_CONNECTIONS = REGISTRY.register(Gauge(
+    'bcj_db_pool_connections', 'Open database connections in the pool', ('pool', 'state')))
+DB_REPLICA_LAG = REGISTRY.register(Gauge(
+    'bcj_db_replica_lag_seconds', 'Replication lag of the read replica, -1 when unreachable'))
+INDEX_SIZE = REGISTRY.register(Gauge(
+    'bcj_index_size', 'Number of bugs in the indexes of all users'))
+INDEX_BYTES = REGISTRY.register(Gauge(
+    'bcj_index_bytes', 'Bytes of the ids and embeddings in the indexes of all users'))
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    'bcj_cache_requests_total', 'Cache lookups by cache and result (hit, miss)',
+    ('cache', 'result')))
+CACHE_BYTES = REGISTRY.register(Gauge(
+    'bcj_cache_bytes', 'Bytes held by a cache', ('cache',)))
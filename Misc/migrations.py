@@ -0,0 +1,169 @@
+"""
+@author natidemis
+October 2026
+
+Versioned schema migrations.
+
+Migrations are the files 'sql/migrations/NNNN_name.sql', applied in order
+of their version number NNNN, each in its own transaction. Applied versions
+are recorded in the 'schema_migrations' table, so a migration runs once per
+database. Workers starting together are serialized with an advisory lock.
+Never edit an applied migration, add a new one.
+
+Hash partitioning of Vectors by user_id is optional, for large deployments,
+and is run by hand while the servers are stopped:
+    python -m Misc.migrations --partitions 16
+"""
+
+from __future__ import annotations
+import os
+import re
+import asyncio
+import argparse
+from typing import List, NamedTuple
+from dotenv import load_dotenv
+import asyncpg
+from Misc.log import logger
+
+MIGRATIONS_PATH = os.path.join('sql', 'migrations')
+MIGRATION_FILE = re.compile(r'^(\d{4})_(\w+)\.sql$')
+#advisory lock key held while migrating, any constant shared by the workers
+MIGRATION_LOCK = 7265617
+CREATE_MIGRATIONS = """
+CREATE TABLE IF NOT EXISTS schema_migrations(
+    version integer primary key,
+    name text not null,
+    applied_at timestamptz not null default now()
+);"""
+
+
+class Migration(NamedTuple):
+    """
+    A migration file
+    """
+    version: int
+    name: str
+    path: str
+
+
+def load_migrations(path: str = MIGRATIONS_PATH) -> List[Migration]:
+    """
+    The migrations in `path` ordered by version
+    Arguments
+    ---------
+    path: str
+        directory of the migration files
+    Returns
+    -------
+    list of Migration, raises ValueError if two files share a version
+    """
+    migrations = []
+    for file_name in os.listdir(path):
+        match = MIGRATION_FILE.match(file_name)
+        if match is not None:
+            migrations.append(Migration(int(match.group(1)), match.group(2),
+                                        os.path.join(path, file_name)))
+    migrations.sort()
+    versions = [migration.version for migration in migrations]
+    if len(set(versions)) != len(versions):
+        raise ValueError('Duplicate migration versions in {}'.format(path))
+    return migrations
+
+
+async def migrate(conn: asyncpg.Connection, path: str = MIGRATIONS_PATH) -> List[Migration]:
+    """
+    Apply the migrations in `path` that haven't been applied to the database
+    Arguments
+    ---------
+    conn: asyncpg.Connection
+    path: str
+        directory of the migration files
+    Returns
+    -------
+    list of the applied Migration
+    """
+    await conn.execute('SELECT pg_advisory_lock($1);', MIGRATION_LOCK)
+    try:
+        await conn.execute(CREATE_MIGRATIONS)
+        applied = {row['version'] for row in
+                    await conn.fetch('SELECT version FROM schema_migrations;')}
+        pending = [migration for migration in load_migrations(path)
+                    if migration.version not in applied]
+        for migration in pending:
+            with open(migration.path, 'r') as sql_file:
+                query = sql_file.read()
+            async with conn.transaction():
+                await conn.execute(query)
+                await conn.execute('INSERT INTO schema_migrations(version,name) VALUES($1,$2);',
+                                migration.version, migration.name)
+            logger.info('Applied migration %04d_%s', migration.version, migration.name)
+        return pending
+    finally:
+        await conn.execute('SELECT pg_advisory_unlock($1);', MIGRATION_LOCK)
+
+
+def partition_queries(partitions: int) -> List[str]:
+    """
+    Queries replacing Vectors with a copy hash partitioned by user_id
+    into `partitions` tables
+    """
+    if partitions < 2:
+        raise ValueError('At least 2 partitions are needed, got {}'.format(partitions))
+    return ["ALTER TABLE Vectors RENAME TO Vectors_unpartitioned;",
+            "ALTER INDEX vectors_pkey RENAME TO vectors_unpartitioned_pkey;",
+            "ALTER INDEX vectors_user_batch RENAME TO vectors_unpartitioned_user_batch;",
+            """CREATE TABLE Vectors (LIKE Vectors_unpartitioned INCLUDING DEFAULTS)
+            PARTITION BY HASH (user_id);""",
+            "ALTER TABLE Vectors ADD PRIMARY KEY (user_id, id);",
+            """ALTER TABLE Vectors ADD CONSTRAINT fk_user
+            FOREIGN KEY (user_id) REFERENCES Users(user_id);""",
+            "CREATE INDEX vectors_user_batch on Vectors(user_id, batch_id);",
+            *["""CREATE TABLE Vectors_p{0} PARTITION OF Vectors
+            FOR VALUES WITH (MODULUS {1}, REMAINDER {0});""".format(i, partitions)
+                for i in range(partitions)],
+            "INSERT INTO Vectors SELECT * FROM Vectors_unpartitioned;",
+            "DROP TABLE Vectors_unpartitioned;"]
+
+
+async def partition_vectors(conn: asyncpg.Connection, partitions: int) -> bool:
+    """
+    Hash partition Vectors by user_id, copying every row in one transaction.
+    The migrations must be applied and no server may be running.
+    Arguments
+    ---------
+    conn: asyncpg.Connection
+    partitions: int
+        number of partitions, at least 2
+    Returns
+    -------
+    True if Vectors was partitioned, False if it already is
+    """
+    partitioned = await conn.fetchval("""
+        SELECT count(*) FROM pg_partitioned_table
+        WHERE partrelid = 'vectors'::regclass;""")
+    if partitioned:
+        return False
+    async with conn.transaction():
+        for query in partition_queries(partitions):
+            await conn.execute(query)
+    logger.info('Partitioned Vectors into %d partitions', partitions)
+    return True
+
+
+async def main(args: argparse.Namespace) -> None:
+    load_dotenv()
+    conn = await asyncpg.connect(os.getenv('DATABASE_URL'))
+    try:
+        await migrate(conn)
+        if args.partitions:
+            if not await partition_vectors(conn, args.partitions):
+                logger.info('Vectors is already partitioned')
+    finally:
+        await conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Apply the schema migrations')
+    parser.add_argument('--partitions', type=int, default=0,
+                        help='hash partition Vectors by user_id into this many tables')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,246 @@
+"""
+@author natidemis
+October 2026
+
+Lazy loading of the word embedder and the encoder models.
+
+Every stored embedding is tagged with the version of the model that produced
+it, so older versions listed in `LEGACY_MODELS` stay loadable until all users
+have been re-embedded with the current `MODEL_VERSION`.
+
+Importing TensorFlow and the word vectors takes a long time, so nothing is
+loaded on import. The models are loaded on first use, by a background warm-up
+started on app startup, or once in the gunicorn master with `PRELOAD_MODELS=True`
+and `gunicorn --preload` so forked workers share them copy-on-write.
+"""
+
+from __future__ import annotations
+import os
+import asyncio
+import functools
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List
+import numpy as np
+from dotenv import load_dotenv
+from Misc.log import logger
+from Misc.inference import load_backend
+from Misc.metrics import STAGE_SECONDS
+
+load_dotenv()
+
+DEFAULT_VERSION = 'default'
+
+
+class Encoder:
+    """
+    Turns sentences into embeddings with a word embedder and an encoder model.
+    Instance methods:
+        encode
+    Instance variables:
+        w2v
+        model
+    """
+
+    def __init__(self, w2v, model):
+        """
+        Arguments
+        ---------
+        w2v:
+            word embedder with a `get_sentence_matrix` method
+        model: Misc.inference.InferenceBackend
+            encoder with a `predict` method
+        """
+        self.w2v = w2v
+        self.model = model
+
+    def encode(self, sentences: List[str]) -> np.ndarray:
+        """
+        Encode `sentences`.
+        Arguments
+        ---------
+        sentences: list[str]
+            cleaned sentences
+        Returns
+        -------
+        array of shape (len(sentences), embedding dimension)
+        """
+        with STAGE_SECONDS.time('sentence_matrix'):
+            matrix = np.array(self.w2v.get_sentence_matrix(sentences))
+        with STAGE_SECONDS.time('predict'):
+            return self.model.predict(matrix)
+
+
+@functools.lru_cache(maxsize=None)
+def load_w2v(sentence_length: int):
+    """
+    Load the word embedder configured in '.env', shared by all model versions.
+    """
+    #'compact' uses a table built by Misc.vocab
+    if os.getenv('DATASET') == 'compact':
+        from Misc.vocab import CompactWord2Vec  # pylint: disable=import-outside-toplevel
+        return CompactWord2Vec(os.getenv('COMPACT_VOCAB_PATH', 'vocab'),
+                            sentence_length=sentence_length)
+    from up_utils.word2vec import Word2Vec  # pylint: disable=import-outside-toplevel
+    return Word2Vec(
+            outputfile=os.getenv('OUTPUT_FILE'),
+            dataset=os.getenv('DATASET'), # Dataset can be googlenews or commoncrawl
+            commoncrawl_path=os.getenv('COMMONCRAWL_PATH'),
+            googlenews_path=os.getenv('GOOGLENEWS_PATH'))
+
+
+def load_encoder(path: str = None) -> Encoder:
+    """
+    Load the encoder backend and the word embedder configured in '.env'.
+    Arguments
+    ---------
+    path: str | None
+        model to load instead of the configured one
+    """
+    model = load_backend(path=path)
+    return Encoder(load_w2v(model.input_shape[1]), model)
+
+
+def configured_loaders() -> Dict[str, Callable[[], Encoder]]:
+    """
+    Encoder loaders per model version. `MODEL_VERSION` names the configured
+    model, `LEGACY_MODELS` lists older ones still in use as 'version=path,...'.
+    """
+    loaders = {}
+    for pair in filter(None, os.getenv('LEGACY_MODELS', '').split(',')):
+        version, path = (v.strip() for v in pair.split('='))
+        loaders[version] = functools.partial(load_encoder, path)
+    loaders[os.getenv('MODEL_VERSION', DEFAULT_VERSION)] = load_encoder
+    return loaders
+
+
+class ModelRegistry:
+    """
+    Loads each encoder version once, lazily or in the background.
+    Instance methods:
+        load
+        warm_up
+        get_encoder
+        register
+    Instance variables:
+        version
+        versions
+        ready
+    """
+
+    def __init__(self, loaders: Dict[str, Callable[[], Encoder]] = None, version: str = None):
+        """
+        Arguments
+        ---------
+        loaders: dict[str, callable] | None
+            model version -> callable returning an `Encoder`, each called at most once.
+            Read from '.env' if not given.
+        version: str | None
+            model version new users are encoded with, read from `MODEL_VERSION` if not given
+        """
+        self.version = version or os.getenv('MODEL_VERSION', DEFAULT_VERSION)
+        self._loaders = dict(loaders) if loaders is not None else configured_loaders()
+        self._encoders = {}
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='model-loader')
+
+    @property
+    def versions(self) -> List[str]:
+        """
+        All model versions that can be loaded
+        """
+        return list(self._loaders)
+
+    @property
+    def ready(self) -> bool:
+        """
+        True once the encoder for the current version has been loaded
+        """
+        return self.version in self._encoders
+
+    def _load(self, version: str) -> Encoder:
+        logger.info('Loading encoder version %s..', version)
+        encoder = self._loaders[version]()
+        self._encoders[version] = encoder
+        logger.info('Encoder version %s loaded', version)
+        return encoder
+
+    def warm_up(self, version: str = None) -> Future:
+        """
+        Start loading an encoder in a background thread if not already started.
+        Arguments
+        ---------
+        version: str | None
+            model version, the current one if not given
+        Returns
+        -------
+        concurrent.futures.Future resolving to the encoder,
+        raises KeyError if `version` is unknown.
+        A failed load is forgotten, so the next call loads the version again.
+        """
+        version = version or self.version
+        submitted = False
+        with self._lock:
+            future = self._futures.get(version)
+            if future is None:
+                if version in self._encoders:
+                    future = Future()
+                    future.set_result(self._encoders[version])
+                else:
+                    if version not in self._loaders:
+                        raise KeyError('No encoder for model version {}'.format(version))
+                    future = self._executor.submit(self._load, version)
+                    submitted = True
+                self._futures[version] = future
+        if submitted:
+            #outside the lock, the callback runs right away if the load already finished
+            future.add_done_callback(functools.partial(self._forget_failed, version))
+        return future
+
+    def _forget_failed(self, version: str, future: Future) -> None:
+        if not future.cancelled() and future.exception() is None:
+            return
+        logger.error('Loading encoder version %s failed: %s', version,
+                    'cancelled' if future.cancelled() else future.exception())
+        with self._lock:
+            if self._futures.get(version) is future:
+                del self._futures[version]
+
+    def load(self, version: str = None) -> Encoder:
+        """
+        Load an encoder in the calling thread, blocks until loaded.
+        Used for preloading in the gunicorn master, where no loader thread
+        should be running when the workers are forked.
+        """
+        version = version or self.version
+        with self._lock:
+            if version not in self._encoders and version not in self._futures:
+                return self._load(version)
+        return self.warm_up(version).result()
+
+    async def get_encoder(self, version: str = None) -> Encoder:
+        """
+        Return an encoder, waiting for it to load without blocking the event loop.
+        Arguments
+        ---------
+        version: str | None
+            model version, the current one if not given
+        """
+        encoder = self._encoders.get(version or self.version)
+        if encoder is not None:
+            return encoder
+        return await asyncio.wrap_future(self.warm_up(version))
+
+    def register(self, encoder: Encoder, version: str = None) -> None:
+        """
+        Use `encoder` for `version` instead of loading one, e.g. a stub encoder for testing.
+        """
+        version = version or self.version
+        with self._lock:
+            self._encoders[version] = encoder
+            self._loaders.setdefault(version, lambda: encoder)
+            self._futures.pop(version, None)
+
+
+registry = ModelRegistry()
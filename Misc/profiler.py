@@ -0,0 +1,167 @@
+"""
+@author natidemis
+October 2026
+
+Diagnostics for a live worker.
+
+`sample_stacks` samples the stacks of every thread in the process (the
+event loop thread and the executor threads) from a background thread and
+returns them in the collapsed format read by flamegraph.pl and speedscope:
+    thread;outer_function (file:line);...;inner_function (file:line) count
+
+`LoopLagMonitor` schedules itself on the event loop and logs a warning when
+it runs later than LOOP_LAG_THRESHOLD seconds (0.1 by default in '.env'),
+meaning a callback blocked the loop for that long.
+"""
+
+from __future__ import annotations
+import os
+import sys
+import time
+import asyncio
+import threading
+from collections import Counter
+from typing import Dict, Union
+from dotenv import load_dotenv
+from Misc.log import logger
+from Misc.metrics import REGISTRY, Histogram
+
+load_dotenv()
+LOOP_LAG_THRESHOLD = float(os.getenv('LOOP_LAG_THRESHOLD', '0.1'))
+LOOP_LAG_INTERVAL = float(os.getenv('LOOP_LAG_INTERVAL', '0.5'))
+MAX_PROFILE_SECONDS = 60.0
+
+LOOP_LAG_SECONDS = REGISTRY.register(Histogram(
+    'bcj_event_loop_lag_seconds', 'Delay of event loop callbacks behind schedule'))
+
+_profiling = threading.Lock()
+
+
+class ProfilerBusyError(Exception):
+    """
+    Error when a profile is requested while another one is running.
+    """
+    def __init__(self, message: str, *args):
+        super().__init__(message, *args)
+        self.message = message
+        self.args = args
+
+    def __str__(self):
+        return "{}: {}".format(self.message,self.args)
+
+
+def _collapse(frame, thread_name: str) -> str:
+    """
+    Collapsed stack of `frame`, outermost frame first
+    """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append('{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename),
+                                        frame.f_lineno))
+        frame = frame.f_back
+    names.append(thread_name)
+    return ';'.join(reversed(names))
+
+
+def sample_stacks(seconds: float, interval: float = 0.005) -> str:
+    """
+    Sample the stacks of all threads, except the sampler, for `seconds`.
+    Blocks the calling thread, run it in an executor from the event loop.
+    Arguments
+    ---------
+    seconds: float
+        how long to sample for, at most MAX_PROFILE_SECONDS
+    interval: float
+        seconds between samples
+    Returns
+    -------
+    Collapsed stacks, one 'stack count' line per distinct stack.
+    Raises ProfilerBusyError when a profile is already running.
+    """
+    if not _profiling.acquire(blocking=False):
+        raise ProfilerBusyError('A profile is already running')
+    try:
+        seconds = min(max(seconds, 0.0), MAX_PROFILE_SECONDS)
+        me = threading.get_ident()
+        counts: Counter = Counter()
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            names: Dict[int, str] = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items(): #pylint: disable=protected-access
+                if ident != me:
+                    counts[_collapse(frame, names.get(ident, str(ident)))] += 1
+            time.sleep(interval)
+        return ''.join('{} {}\n'.format(stack, count) for stack, count in counts.most_common())
+    finally:
+        _profiling.release()
+
+
+class LoopLagMonitor:
+    """
+    Measures how late the event loop runs a callback scheduled every `interval`
+    seconds. A watchdog thread logs the stack of the loop thread while it is
+    blocked for longer than `threshold`, pointing at the blocking callback.
+    Instance methods:
+        start
+        stop
+    Instance variables:
+        threshold
+        interval
+    """
+
+    def __init__(self, threshold: float = LOOP_LAG_THRESHOLD, interval: float = LOOP_LAG_INTERVAL):
+        self.threshold = threshold
+        self.interval = interval
+        self._handle: Union[None, asyncio.TimerHandle] = None
+        self._expected = 0.0
+        self._beat = 0.0
+        self._loop_thread = None
+        self._stopped = threading.Event()
+
+    def start(self, loop: asyncio.AbstractEventLoop = None) -> None:
+        """
+        Start monitoring `loop`, the running loop if not given
+        """
+        loop = loop or asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stopped.clear()
+        self._schedule(loop)
+        threading.Thread(target=self._watch, name='loop-lag-watchdog', daemon=True).start()
+
+    def stop(self) -> None:
+        """
+        Stop monitoring
+        """
+        self._stopped.set()
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _schedule(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._expected = loop.time() + self.interval
+        self._handle = loop.call_at(self._expected, self._check, loop)
+
+    def _check(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._beat = time.monotonic()
+        lag = max(loop.time() - self._expected, 0.0)
+        LOOP_LAG_SECONDS.observe(lag)
+        if lag > self.threshold:
+            logger.warning('Event loop blocked for %.3fs', lag, extra={'loop_lag': lag})
+        self._schedule(loop)
+
+    def _watch(self) -> None:
+        """
+        Watchdog thread, logs the loop thread's stack once per stall
+        """
+        reported = 0.0
+        while not self._stopped.wait(self.threshold / 2):
+            beat = self._beat
+            if beat != reported and time.monotonic() - beat > self.interval + self.threshold:
+                reported = beat
+                frame = sys._current_frames().get(self._loop_thread) #pylint: disable=protected-access
+                if frame is not None:
+                    logger.warning('Event loop blocked, loop thread is in: %s',
+                                _collapse(frame, 'loop').replace(';', ' -> '),
+                                extra={'loop_blocked': time.monotonic() - beat - self.interval})
@@ -0,0 +1,156 @@
+"""
+@author natidemis
+October 2026
+
+Encoding of responses.
+
+`dumps` writes NumPy arrays and scalars directly, so results such as the ids
+and distances of `get_similar_bugs_k` are not converted to Python lists first.
+Uses orjson when it is installed, the standard library otherwise.
+
+Similarity results can also be sent in another format chosen with the
+'Accept' header, see `negotiate`:
+    application/x-ndjson - the neighbours streamed in ranked pages, one json
+        object {"rank": rank of the first, "id": [...], "dist": [...]} per line
+    application/x-bcj-neighbours - one frame per result, frames are concatenated:
+        b'BCJ1', uint32 count n, n int64 ids, n float64 distances, all little-endian
+    application/msgpack - {'n': n, 'id': bytes, 'dist': bytes} with the same
+        little-endian arrays, if msgpack is installed, and 'truncated' for radius queries
+"""
+
+import json
+import struct
+from enum import Enum
+from typing import Any, List, Tuple
+import numpy as np
+
+try:
+    import orjson
+except ImportError: #optional, 'pip install orjson'
+    orjson = None
+
+try:
+    import msgpack
+except ImportError: #optional, 'pip install msgpack'
+    msgpack = None
+
+JSON = 'application/json'
+NDJSON = 'application/x-ndjson'
+NEIGHBOURS = 'application/x-bcj-neighbours'
+MSGPACK = 'application/msgpack'
+MAGIC = b'BCJ1'
+HEADER = struct.Struct('<4sI')
+
+
+def _default(obj: Any) -> Any:
+    """
+    Encoding of the types the json module doesn't know
+    """
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, Enum):
+        return obj.value
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(obj).__name__))
+
+
+def dumps(content: Any) -> bytes:
+    """
+    Encode `content` as compact utf-8 json
+    Arguments
+    ---------
+    content: json serializable object, may contain NumPy arrays and scalars
+    Returns
+    -------
+    bytes
+    """
+    if orjson is not None:
+        return orjson.dumps(content, default=_default,
+                            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, default=_default, ensure_ascii=False,
+                    separators=(',', ':')).encode('utf-8')
+
+
+def negotiate(accept: str) -> str:
+    """
+    The media type for a similarity result requested by the 'Accept' header `accept`
+    Arguments
+    ---------
+    accept: str
+        value of the 'Accept' header, may be empty
+    Returns
+    -------
+    the available type with the highest quality, NDJSON, NEIGHBOURS, MSGPACK
+    if msgpack is installed, or JSON which is also the default
+    """
+    available = {JSON, NDJSON, NEIGHBOURS}
+    if msgpack is not None:
+        available.add(MSGPACK)
+    best, best_q = JSON, 0.0
+    for part in accept.split(','):
+        media_type, *params = [item.strip() for item in part.split(';')]
+        q = 1.0
+        for param in params:
+            if param.startswith('q='):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if media_type.lower() in available and q > best_q:
+            best, best_q = media_type.lower(), q
+    return best
+
+
+def encode_neighbours(ids: np.ndarray, dists: np.ndarray, media_type: str = NEIGHBOURS,
+                    truncated: bool = None) -> bytes:
+    """
+    Encode a similarity result in a binary `media_type`
+    Arguments
+    ---------
+    ids: np.ndarray
+        ids of the neighbours
+    dists: np.ndarray
+        distances to the neighbours, one per id
+    media_type: str
+        NEIGHBOURS or MSGPACK
+    truncated: bool | None
+        whether a radius query found more bugs, added to MSGPACK if not None,
+        a NEIGHBOURS frame has no room for it
+    Returns
+    -------
+    bytes
+    """
+    ids = np.ascontiguousarray(ids, dtype='<i8').ravel()
+    dists = np.ascontiguousarray(dists, dtype='<f8').ravel()
+    if media_type == MSGPACK:
+        content = {'n': len(ids), 'id': ids.tobytes(), 'dist': dists.tobytes()}
+        if truncated is not None:
+            content['truncated'] = bool(truncated)
+        return msgpack.packb(content)
+    return b''.join((HEADER.pack(MAGIC, len(ids)), ids.tobytes(), dists.tobytes()))
+
+
+def decode_neighbours(data: bytes) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Decode the concatenated NEIGHBOURS frames in `data`
+    Returns
+    -------
+    list of (ids, dists) per frame, raises ValueError if `data` is malformed
+    """
+    frames, offset = [], 0
+    view = memoryview(data)
+    while offset < len(data):
+        if len(data) - offset < HEADER.size:
+            raise ValueError('Truncated frame header at {}'.format(offset))
+        magic, count = HEADER.unpack_from(view, offset)
+        if magic != MAGIC:
+            raise ValueError('Not a neighbours frame at {}'.format(offset))
+        offset += HEADER.size
+        if len(data) - offset < 16 * count:
+            raise ValueError('Truncated frame at {}'.format(offset))
+        ids = np.frombuffer(view, dtype='<i8', count=count, offset=offset)
+        dists = np.frombuffer(view, dtype='<f8', count=count, offset=offset + 8 * count)
+        frames.append((ids, dists))
+        offset += 16 * count
+    return frames
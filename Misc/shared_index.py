@@ -0,0 +1,267 @@
+"""
+@author natidemis
+October 2026
+
+Shared index of the users with few bugs.
+
+A `VectorIndex` and a semaphore per user cost more than the bugs of a user
+with a handful of them. With SHARED_INDEX_MAX in '.env' above 0, users with
+at most that many bugs are packed into one `SharedIndex` instead: a
+contiguous embeddings matrix with an id column and a tenant column, the
+tenant being a small integer code per user. Each user's rows are found
+through a per-tenant array of row positions, rows are contiguous after a
+compaction, and queries are a brute force search over them. The user's
+index in 'user_manager' is a `TenantView` of its rows.
+Removed and replaced rows are marked dead and the store is compacted, rows
+sorted by tenant, once more than half of it is dead.
+Users in the store share LOCK_STRIPES semaphores (64 by default), chosen by
+a hash of the user_id. A user growing past SHARED_INDEX_MAX is promoted to
+its own `VectorIndex` and semaphore and stays there.
+"""
+
+from __future__ import annotations
+import os
+import zlib
+import asyncio
+from typing import Dict, List, Union
+import numpy as np
+from dotenv import load_dotenv
+from Misc.index import VectorIndex
+
+load_dotenv()
+SHARED_INDEX_MAX = int(os.getenv('SHARED_INDEX_MAX', '0'))
+LOCK_STRIPES = int(os.getenv('LOCK_STRIPES', '64'))
+#dead rows tolerated before compacting, whatever the fraction
+COMPACT_MIN_DEAD = 1024
+
+
+class SharedIndex:
+    """
+    Columnar store of the bugs of many small users.
+    Used from the event loop only, a user's rows must only be changed
+    while holding the user's lock.
+    Instance methods:
+        stripe
+        is_stripe
+        fits
+        put
+        drop
+        compact
+        stats
+    Instance variables:
+        max_size
+        ids
+        tenants
+        embeddings
+        size
+        dead
+    """
+
+    def __init__(self, max_size: int = SHARED_INDEX_MAX, stripes: int = LOCK_STRIPES):
+        """
+        Arguments
+        ---------
+        max_size: int
+            most bugs of a user in the store, 0 turns the store off
+        stripes: int
+            number of semaphores shared by the users in the store
+        """
+        self.max_size = max_size
+        #columns with spare capacity, rows past 'size' are unused, dead rows have tenant -1
+        self.ids = np.empty(0, dtype=np.int64)
+        self.tenants = np.empty(0, dtype=np.int32)
+        self.embeddings = np.empty((0, 0), dtype=np.float64)
+        self.size = 0
+        self.dead = 0
+        self._codes: Dict[str, int] = {}
+        self._rows: List[np.ndarray] = []
+        self._free: List[int] = []
+        self._locks = [asyncio.BoundedSemaphore(1) for _ in range(stripes)] if max_size > 0 else []
+        self._lock_ids = {id(lock) for lock in self._locks}
+
+    def stripe(self, user_id: str) -> Union[None, asyncio.BoundedSemaphore]:
+        """
+        The semaphore shared by `user_id` while it's in the store, None if the store is off
+        """
+        if not self._locks:
+            return None
+        return self._locks[zlib.crc32(user_id.encode('utf-8')) % len(self._locks)]
+
+    def is_stripe(self, lock: asyncio.BoundedSemaphore) -> bool:
+        """
+        Whether `lock` is one of the shared semaphores
+        """
+        return id(lock) in self._lock_ids
+
+    def fits(self, index: Union[None, VectorIndex]) -> bool:
+        """
+        Whether `index` may be kept in the store
+        """
+        if not self._locks:
+            return False
+        if index is None:
+            return True
+        return len(index) <= self.max_size and \
+            (self.size == self.dead or index.embeddings.shape[1] == self.embeddings.shape[1])
+
+    def put(self, user_id: str, index: VectorIndex) -> TenantView:
+        """
+        Replace the rows of `user_id` with the bugs of `index`
+        Returns
+        -------
+        TenantView of the user's rows
+        """
+        code = self._codes.get(user_id)
+        if code is None:
+            code = self._free.pop() if self._free else len(self._rows)
+            if code == len(self._rows):
+                self._rows.append(np.empty(0, dtype=np.int64))
+            self._codes[user_id] = code
+        ids, embeddings = index.ids, index.embeddings
+        self._kill(self._rows[code])
+        self._rows[code] = self._append(code, ids, embeddings)
+        self._maybe_compact()
+        return TenantView(self, code)
+
+    def drop(self, user_id: str) -> None:
+        """
+        Remove every row of `user_id`, unknown users are ignored
+        """
+        code = self._codes.pop(user_id, None)
+        if code is None:
+            return
+        self._kill(self._rows[code])
+        self._rows[code] = np.empty(0, dtype=np.int64)
+        self._free.append(code)
+        self._maybe_compact()
+
+    def rows(self, code: int) -> np.ndarray:
+        """
+        Row positions of the tenant `code`
+        """
+        return self._rows[code]
+
+    def add(self, code: int, ids: List[int], embeddings: np.ndarray) -> None:
+        """
+        Add bugs to the tenant `code`, bugs whose id it has are replaced
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        rows = self._rows[code]
+        replaced = np.isin(self.ids[rows], ids)
+        self._kill(rows[replaced])
+        self._rows[code] = np.concatenate([rows[~replaced], self._append(code, ids, embeddings)])
+        self._maybe_compact()
+
+    def remove(self, code: int, ids: List[int]) -> None:
+        """
+        Remove the bugs with `ids` from the tenant `code`, unknown ids are ignored
+        """
+        rows = self._rows[code]
+        removed = np.isin(self.ids[rows], np.asarray(ids, dtype=np.int64))
+        if removed.any():
+            self._kill(rows[removed])
+            self._rows[code] = rows[~removed]
+            self._maybe_compact()
+
+    def compact(self) -> None:
+        """
+        Drop the dead rows and sort the rest by tenant, so each tenant's rows are contiguous
+        """
+        alive = np.flatnonzero(self.tenants[:self.size] >= 0)
+        order = alive[np.argsort(self.tenants[alive], kind='stable')]
+        self.ids, self.tenants = self.ids[order], self.tenants[order]
+        self.embeddings = self.embeddings[order]
+        self.size, self.dead = len(order), 0
+        offsets = np.searchsorted(self.tenants, np.arange(len(self._rows) + 1))
+        for code in range(len(self._rows)):
+            self._rows[code] = np.arange(offsets[code], offsets[code + 1])
+
+    def stats(self) -> dict:
+        """
+        Tenants, rows in use, dead rows and bytes of the columns
+        """
+        return {'tenants': len(self._codes),
+                'rows': self.size - self.dead,
+                'dead': self.dead,
+                'bytes': self.ids.nbytes + self.tenants.nbytes + self.embeddings.nbytes}
+
+    def _append(self, code: int, ids: np.ndarray, embeddings: np.ndarray) -> np.ndarray:
+        """
+        Write rows at the end, growing the columns by doubling, returns their positions
+        """
+        n = len(ids)
+        embeddings = np.asarray(embeddings, dtype=np.float64).reshape(n, -1)
+        if self.size == self.dead:
+            #every row is dead, start over, possibly with another dimension
+            self.size = self.dead = 0
+        if self.size + n > len(self.ids) or self.embeddings.shape[1] != embeddings.shape[1]:
+            capacity = max(2 * len(self.ids), self.size + n, 64)
+            grown = np.empty((capacity, embeddings.shape[1]), dtype=np.float64)
+            if self.size:
+                grown[:self.size] = self.embeddings[:self.size]
+            self.embeddings = grown
+            self.ids = np.resize(self.ids, capacity)
+            self.tenants = np.resize(self.tenants, capacity)
+        rows = np.arange(self.size, self.size + n)
+        self.ids[rows], self.tenants[rows], self.embeddings[rows] = ids, code, embeddings
+        self.size += n
+        return rows
+
+    def _kill(self, rows: np.ndarray) -> None:
+        self.tenants[rows] = -1
+        self.dead += len(rows)
+
+    def _maybe_compact(self) -> None:
+        if self.dead >= COMPACT_MIN_DEAD and 2 * self.dead > self.size:
+            self.compact()
+
+
+class TenantView(VectorIndex):
+    """
+    `VectorIndex` of a user's rows in a `SharedIndex`, searched by brute force.
+    'ids' and 'embeddings' are copies read from the store on access.
+    """
+    __slots__ = ('_store', '_code')
+
+    def __init__(self, store: SharedIndex, code: int): #pylint: disable=super-init-not-called
+        self._store = store
+        self._code = code
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self._store.ids[self._store.rows(self._code)]
+
+    @property
+    def embeddings(self) -> np.ndarray:
+        return self._store.embeddings[self._store.rows(self._code)]
+
+    def __len__(self) -> int:
+        return len(self._store.rows(self._code))
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Bytes of the user's rows in the store's columns
+        """
+        store = self._store
+        row = store.ids.itemsize + store.tenants.itemsize + \
+            store.embeddings.shape[1] * store.embeddings.itemsize
+        return len(self) * row
+
+    @property
+    def tree(self):
+        raise TypeError('A shared index is searched by brute force, it has no tree')
+
+    def query(self, vec: np.ndarray, k: int):
+        """
+        Distances and ids of the `k` nearest bugs to `vec`, (1, k) arrays like `VectorIndex.query`
+        """
+        dists, ids = next(self.ranked(vec, k=k, page=k),
+                        (np.empty(0), np.empty(0, dtype=np.int64)))
+        return dists[None], ids[None]
+
+    def add(self, ids: List[int], embeddings: np.ndarray) -> None:
+        self._store.add(self._code, ids, embeddings)
+
+    def remove(self, ids: List[int]) -> None:
+        self._store.remove(self._code, ids)
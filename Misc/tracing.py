@@ -0,0 +1,360 @@
+"""
+@author natidemis
+October 2026
+
+Opt-in request tracing.
+
+A sampled request gets a root span in `main.py`, every `BCJAIapi` route
+method and `Database` operation it runs adds a child span, so slow requests
+can be attributed to a tenant and a stage. The current span is kept in a
+`contextvars.ContextVar`, it follows the request across awaits and into tasks.
+Trace ids are read from and returned in the W3C 'traceparent' header.
+
+Configured from '.env':
+    TRACE_SAMPLE_RATE    - fraction of requests traced, 0 (off) by default. While tracing
+                           is on, requests with a sampled 'traceparent' are always traced.
+    TRACE_EXPORTER       - 'file' (default) or 'memory', the in-process collector stand-in
+    TRACE_FILE           - json lines file finished traces are written to, 'traces.jsonl' by default
+    TRACE_FILE_MAX_BYTES - size at which TRACE_FILE is rotated to TRACE_FILE + '.1',
+                           replacing the previous one, 100 MB by default, 0 never rotates
+
+Finished traces are exported by a background thread, never on the event loop.
+"""
+
+from __future__ import annotations
+import os
+import re
+import json
+import time
+import queue
+import atexit
+import random
+import secrets
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Union
+from dotenv import load_dotenv
+from Misc.log import logger
+
+load_dotenv()
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '0'))
+TRACE_EXPORTER = os.getenv('TRACE_EXPORTER', 'file')
+TRACE_FILE = os.getenv('TRACE_FILE', 'traces.jsonl')
+TRACE_FILE_MAX_BYTES = int(os.getenv('TRACE_FILE_MAX_BYTES', str(100 * 2**20)))
+
+TRACEPARENT = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+_current: contextvars.ContextVar = contextvars.ContextVar('span', default=None)
+
+
+class Span:
+    """
+    A timed operation within a trace
+    Instance methods:
+        set
+        child
+        finish
+        to_dict
+    Instance variables:
+        trace_id
+        span_id
+        parent_id
+        name
+        attributes
+        start
+        duration
+        error
+    """
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'attributes',
+                'start', 'duration', 'error', '_begin', '_trace', '_root')
+
+    def __init__(self, name: str, trace_id: str, parent_id: str = None,
+                trace: list = None, attributes: dict = None):
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.start = time.time()
+        self.duration = None
+        self.error = None
+        self._begin = time.perf_counter()
+        #finished spans are collected per trace and exported with the root
+        self._root = trace is None
+        self._trace = [] if trace is None else trace
+
+    @property
+    def traceparent(self) -> str:
+        """
+        W3C 'traceparent' header value pointing at this span
+        """
+        return '00-{}-{}-01'.format(self.trace_id, self.span_id)
+
+    def set(self, **attributes) -> None:
+        """
+        Add attributes to the span
+        """
+        self.attributes.update(attributes)
+
+    def child(self, name: str, attributes: dict = None) -> Span:
+        """
+        New span within the same trace with this span as parent
+        """
+        return Span(name, self.trace_id, self.span_id, self._trace, attributes)
+
+    def finish(self, error: BaseException = None) -> None:
+        """
+        End the span, the trace is exported when its root span ends
+        """
+        self.duration = time.perf_counter() - self._begin
+        if error is not None:
+            self.error = type(error).__name__
+        self._trace.append(self)
+        if self._root:
+            exporter.export(list(self._trace))
+
+    def to_dict(self) -> dict:
+        """
+        Json serializable representation of the span
+        """
+        return {'trace_id': self.trace_id,
+                'span_id': self.span_id,
+                'parent_id': self.parent_id,
+                'name': self.name,
+                'start': self.start,
+                'duration_ms': None if self.duration is None else self.duration * 1000,
+                'error': self.error,
+                'attributes': self.attributes}
+
+
+class MemoryExporter:
+    """
+    Collector stand-in keeping the last `maxlen` finished traces in memory
+    Instance methods:
+        export
+        traces
+        clear
+    """
+
+    def __init__(self, maxlen: int = 1000):
+        self.maxlen = maxlen
+        self._traces: List[List[dict]] = []
+        self._lock = threading.Lock()
+
+    def export(self, spans: List[Span]) -> None:
+        """
+        Store a finished trace
+        """
+        trace = [span.to_dict() for span in spans]
+        with self._lock:
+            self._traces.append(trace)
+            del self._traces[:-self.maxlen]
+
+    def traces(self) -> List[List[dict]]:
+        """
+        Finished traces, oldest first
+        """
+        with self._lock:
+            return list(self._traces)
+
+    def clear(self) -> None:
+        """
+        Drop all stored traces
+        """
+        with self._lock:
+            self._traces.clear()
+
+
+class FileExporter:
+    """
+    Writes finished traces as json lines, one span per line, from a background thread.
+    Once the file reaches `max_bytes` it is rotated to `path` + '.1', so at most
+    about twice `max_bytes` are kept on disk.
+    Instance methods:
+        export
+        flush
+        close
+    """
+
+    def __init__(self, path: str, max_bytes: int = TRACE_FILE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread = None
+        self._start()
+        atexit.register(self.close)
+        os.register_at_fork(after_in_child=self._start)
+
+    def _start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name='trace-exporter', daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        f = open(self.path, 'a', encoding='utf-8') #pylint: disable=consider-using-with
+        try:
+            while True:
+                spans = self._queue.get()
+                if spans is None:
+                    return
+                if isinstance(spans, threading.Event):
+                    f.flush()
+                    spans.set()
+                    continue
+                try:
+                    f.write(''.join(json.dumps(span.to_dict(), default=str) + '\n'
+                        for span in spans))
+                except (TypeError, ValueError) as e:
+                    logger.error('Could not export trace: %s', e)
+                if self.max_bytes and f.tell() >= self.max_bytes:
+                    f.close()
+                    os.replace(self.path, self.path + '.1')
+                    f = open(self.path, 'a', encoding='utf-8') #pylint: disable=consider-using-with
+        finally:
+            f.close()
+
+    def export(self, spans: List[Span]) -> None:
+        """
+        Queue a finished trace for writing
+        """
+        self._queue.put(spans)
+
+    def flush(self, timeout: float = 5.0) -> None:
+        """
+        Block until every trace queued so far has been written
+        """
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def close(self) -> None:
+        """
+        Write the remaining traces and stop the thread
+        """
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=5.0)
+
+
+class _LazyExporter:
+    """
+    Creates the configured exporter on first use, so no thread
+    or file exists while tracing is off.
+    """
+
+    def __init__(self):
+        self._exporter = None
+        self._lock = threading.Lock()
+
+    def get(self) -> Union[FileExporter, MemoryExporter]:
+        """
+        The configured exporter
+        """
+        if self._exporter is None:
+            with self._lock:
+                if self._exporter is None:
+                    self._exporter = MemoryExporter() if TRACE_EXPORTER == 'memory' \
+                        else FileExporter(TRACE_FILE)
+        return self._exporter
+
+    def export(self, spans: List[Span]) -> None:
+        """
+        Hand a finished trace to the configured exporter
+        """
+        self.get().export(spans)
+
+
+exporter = _LazyExporter()
+
+
+def current_span() -> Union[None, Span]:
+    """
+    The span of the running context, None if the request isn't sampled
+    """
+    return _current.get()
+
+
+def start_trace(name: str, traceparent: str = None, sample_rate: float = None,
+                attributes: dict = None) -> Union[None, Span]:
+    """
+    Start a root span, continuing the trace in `traceparent` if it is valid.
+    Nothing is traced while the sample rate is 0, whatever the header says.
+    Arguments
+    ---------
+    name: str
+        name of the root span
+    traceparent: str
+        incoming W3C 'traceparent' header, if any
+    sample_rate: float
+        overrides TRACE_SAMPLE_RATE
+    attributes: dict
+        attributes of the root span
+    Returns
+    -------
+    The root span, None if the trace isn't sampled
+    """
+    rate = TRACE_SAMPLE_RATE if sample_rate is None else sample_rate
+    if rate <= 0:
+        return None
+    match = TRACEPARENT.match(traceparent.strip().lower()) if traceparent else None
+    if match is not None and int(match.group(3), 16) & 1:
+        return Span(name, match.group(1), match.group(2), attributes=attributes)
+    if random.random() >= rate:
+        return None
+    trace_id = match.group(1) if match is not None else secrets.token_hex(16)
+    return Span(name, trace_id, match.group(2) if match is not None else None,
+                attributes=attributes)
+
+
+@contextmanager
+def activate(current: Union[None, Span]) -> Iterator[Union[None, Span]]:
+    """
+    Make `current` the current span for the body and finish it afterwards
+    """
+    if current is None:
+        yield None
+        return
+    token = _current.set(current)
+    error = None
+    try:
+        yield current
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        _current.reset(token)
+        current.finish(error)
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Union[None, Span]]:
+    """
+    Child span of the current span for the body, a no-op when not sampled
+    """
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+    with activate(parent.child(name, attributes)) as child:
+        yield child
+
+
+def traced(name: str) -> Callable:
+    """
+    Decorator running a coroutine function in a child span named `name`,
+    the `user_id` keyword argument is recorded as an attribute.
+    Usage:
+        @traced('bcj.add_bug')
+        async def add_bug(self, user_id, ...)
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            if _current.get() is None:
+                return await fn(*args, **kwargs)
+            attributes = {'user_id': kwargs['user_id']} if 'user_id' in kwargs else {}
+            with span(name, **attributes):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,184 @@
+"""
+@author natidemis
+October 2026
+
+Registry of the users served by `BCJAIapi`.
+
+`UserIndexRegistry` maps a user_id to a slotted `UserEntry` holding the
+user's index, semaphore, model version and change log watermark together
+with its size, memory and access statistics. Entries are kept in order of
+last access, so the least recently used users are found without scanning,
+and the registry keeps running totals of the indexed bugs and their bytes.
+"""
+
+from __future__ import annotations
+import time
+import asyncio
+from collections import OrderedDict
+from itertools import islice
+from typing import Iterator, List, Tuple, Union
+from Misc.index import VectorIndex
+
+#entries shown by the repr of a registry
+REPR_ENTRIES = 10
+
+
+class UserEntry:
+    """
+    State of a user, see `UserIndexRegistry`
+    Instance variables:
+        index: VectorIndex | None
+            the user's bugs, None if it has none or the index was evicted
+        lock: asyncio.BoundedSemaphore
+            held while using or changing the index
+        version: str
+            model version of the user's embeddings
+        seq: int
+            last change log entry applied to the index
+        size: int
+            number of indexed bugs
+        nbytes: int
+            bytes of the indexed ids and embeddings
+        last_access: float
+            time.monotonic() of the last use of the index
+        queries: int
+            similarity queries served
+        writes: int
+            writes applied to the index
+        evicted: bool
+            the index was dropped, to save memory or after a failed catch up,
+            and is reloaded on next use
+    """
+    __slots__ = ('index', 'lock', 'version', 'seq', 'size', 'nbytes',
+                'last_access', 'queries', 'writes', 'evicted')
+
+    def __init__(self, index: Union[None, VectorIndex], lock: asyncio.BoundedSemaphore,
+                version: str, seq: int = 0):
+        self.index = index
+        self.lock = lock
+        self.version = version
+        self.seq = seq
+        self.size = len(index) if index is not None else 0
+        self.nbytes = index.nbytes if index is not None else 0
+        self.last_access = time.monotonic()
+        self.queries = 0
+        self.writes = 0
+        self.evicted = False
+
+    def as_dict(self) -> dict:
+        """
+        The entry without its index and lock, for introspection
+        """
+        return {'version': self.version,
+                'seq': self.seq,
+                'size': self.size,
+                'bytes': self.nbytes,
+                'idle': time.monotonic() - self.last_access,
+                'queries': self.queries,
+                'writes': self.writes,
+                'evicted': self.evicted}
+
+    def __repr__(self) -> str:
+        return 'UserEntry({})'.format(self.as_dict())
+
+
+class UserIndexRegistry:
+    """
+    user_id -> UserEntry, ordered from the least to the most recently used.
+    Used from the event loop only.
+    Instance methods:
+        touch
+        set_index
+        least_recent
+        idle
+        stats
+    Instance variables:
+        bugs
+        nbytes
+    """
+    __slots__ = ('_entries', 'bugs', 'nbytes')
+
+    def __init__(self):
+        self._entries: OrderedDict = OrderedDict()
+        self.bugs = 0
+        self.nbytes = 0
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self._entries
+
+    def __getitem__(self, user_id: str) -> UserEntry:
+        return self._entries[user_id]
+
+    def __setitem__(self, user_id: str, entry: UserEntry) -> None:
+        if user_id in self._entries:
+            del self[user_id]
+        self._entries[user_id] = entry
+        self.bugs += entry.size
+        self.nbytes += entry.nbytes
+
+    def __delitem__(self, user_id: str) -> None:
+        entry = self._entries.pop(user_id)
+        self.bugs -= entry.size
+        self.nbytes -= entry.nbytes
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._entries)
+
+    def items(self) -> Iterator[Tuple[str, UserEntry]]:
+        return iter(self._entries.items())
+
+    def __repr__(self) -> str:
+        #the most recently used entries only, the registry may hold many users
+        recent = dict(islice(reversed(self._entries.items()), REPR_ENTRIES))
+        return 'UserIndexRegistry(users={}, bugs={}, bytes={}, recent={})'.format(
+            len(self._entries), self.bugs, self.nbytes, recent)
+
+    def touch(self, user_id: str) -> UserEntry:
+        """
+        Record a use of the user's index
+        """
+        entry = self._entries[user_id]
+        entry.last_access = time.monotonic()
+        self._entries.move_to_end(user_id)
+        return entry
+
+    def set_index(self, user_id: str, index: Union[None, VectorIndex]) -> None:
+        """
+        Replace the user's index, keeping the sizes and totals up to date
+        """
+        entry = self._entries[user_id]
+        size, nbytes = (len(index), index.nbytes) if index is not None else (0, 0)
+        self.bugs += size - entry.size
+        self.nbytes += nbytes - entry.nbytes
+        entry.index, entry.size, entry.nbytes = index, size, nbytes
+
+    def least_recent(self) -> Iterator[Tuple[str, UserEntry]]:
+        """
+        (user_id, entry) from the least to the most recently used
+        """
+        return iter(self._entries.items())
+
+    def idle(self, seconds: float) -> List[str]:
+        """
+        Users with an index not used for `seconds`, least recently used first
+        """
+        cutoff = time.monotonic() - seconds
+        users = []
+        for user_id, entry in self._entries.items():
+            if entry.last_access >= cutoff:
+                break
+            if entry.index is not None:
+                users.append(user_id)
+        return users
+
+    def stats(self) -> dict:
+        """
+        Number of users, of evicted users, of indexed bugs and their bytes
+        """
+        return {'users': len(self._entries),
+                'evicted': sum(entry.evicted for entry in self._entries.values()),
+                'bugs': self.bugs,
+                'bytes': self.nbytes}
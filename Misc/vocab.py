@@ -0,0 +1,282 @@
+# pylint: disable=C0103
+"""
+@author natidemis
+October 2026
+
+Compact, memory-mapped vocabulary table for the word embeddings.
+
+The GoogleNews binary holds 3M words x 300 dims while bug reports only use a
+small fraction of them. `build_vocab` prunes the source vectors down to the words
+seen in a corpus of bug reports and stores them in a directory:
+    vectors.npy - (N, dim) matrix, rows ordered by word hash
+    hashes.npy  - sorted uint64 word hashes, row i belongs to hashes[i]
+    words.txt   - the words in row order, for inspection only
+    meta.json   - dim, dtype and build parameters
+`CompactWord2Vec` memory-maps the table and exposes `get_sentence_matrix`
+like `up_utils.word2vec.Word2Vec`.
+
+Usage:
+    python -m Misc.vocab --source GoogleNews-vectors-negative300.bin \
+        --output vocab --min-count 2 --dtype float16 bugs.txt [more.txt ...]
+"""
+
+from __future__ import annotations
+import os
+import re
+import json
+import hashlib
+import argparse
+from collections import Counter
+from typing import Iterable, Iterator, List, Tuple, Union
+import numpy as np
+from Misc.log import logger
+from Misc.metrics import CACHE_REQUESTS
+
+TOKEN_PATTERN = re.compile(r"[\w'-]+")
+_CHUNK_SIZE = 1 << 20
+
+
+def tokenize(sentence: str) -> List[str]:
+    """
+    Split `sentence` into the tokens looked up in the vocabulary table.
+    Arguments
+    ---------
+    sentence: str
+        text to tokenize
+    Returns
+    -------
+    list of tokens
+    """
+    return TOKEN_PATTERN.findall(sentence)
+
+
+def word_hash(word: str) -> int:
+    """
+    Stable 64-bit hash of `word`, independent of PYTHONHASHSEED.
+    """
+    return int.from_bytes(hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def count_words(corpus: Iterable[str]) -> Counter:
+    """
+    Count token frequencies in `corpus`.
+    Arguments
+    ---------
+    corpus: iterable of str
+        bug report texts
+    Returns
+    -------
+    collections.Counter of token -> frequency
+    """
+    counts = Counter()
+    for text in corpus:
+        counts.update(tokenize(text))
+    return counts
+
+
+def _read_binary(path: str) -> Iterator[Tuple[str, bytes]]:
+    """
+    Stream (word, raw float32 vector bytes) pairs from a word2vec binary file.
+    """
+    with open(path, 'rb') as f:
+        _, dim = (int(v) for v in f.readline().split())
+        vec_size = dim * 4
+        buf = b''
+        pos = 0
+        eof = False
+        while True:
+            space = buf.find(b' ', pos)
+            while (space == -1 or len(buf) - space - 1 < vec_size) and not eof:
+                chunk = f.read(_CHUNK_SIZE)
+                eof = not chunk
+                buf = buf[pos:] + chunk
+                pos = 0
+                space = buf.find(b' ')
+            if space == -1 or len(buf) - space - 1 < vec_size:
+                return
+            word = buf[pos:space].strip().decode('utf-8', errors='ignore')
+            yield word, buf[space + 1:space + 1 + vec_size]
+            pos = space + 1 + vec_size
+
+
+def _read_text(path: str) -> Iterator[Tuple[str, bytes]]:
+    """
+    Stream (word, raw float32 vector bytes) pairs from a GloVe style text file.
+    """
+    with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+        for line in f:
+            word, *values = line.rstrip().split(' ')
+            if len(values) < 2:  # word2vec text header
+                continue
+            yield word, np.asarray(values, dtype=np.float32).tobytes()
+
+
+def build_vocab(corpus: Iterable[str],
+                source_path: str,
+                output_path: str,
+                min_count: int = 1,
+                dtype: str = 'float16') -> int:
+    """
+    Build a pruned vocabulary table from `source_path` for the words in `corpus`.
+    Arguments
+    ---------
+    corpus: iterable of str
+        bug report texts used to select the vocabulary
+    source_path: str
+        word2vec binary ('.bin') or text file with the full vectors
+    output_path: str
+        directory to write the table to
+    min_count: int
+        words seen less than `min_count` times in `corpus` are dropped
+    dtype: str
+        'float16' or 'float32', storage type of the vectors
+    Returns
+    -------
+    Number of words in the table
+    """
+    if dtype not in ('float16', 'float32'):
+        raise ValueError('dtype must be float16 or float32')
+    counts = count_words(corpus)
+    wanted = {word for word, count in counts.items() if count >= min_count}
+    logger.info('Building vocabulary for %d of %d corpus words', len(wanted), len(counts))
+
+    reader = _read_binary if source_path.endswith('.bin') else _read_text
+    found = {}
+    for word, raw in reader(source_path):
+        if word in wanted and word not in found:
+            found[word] = raw
+            if len(found) == len(wanted):
+                break
+
+    by_hash = {}
+    for word in found:
+        h = word_hash(word)
+        if h in by_hash:
+            logger.warning('Hash collision between %s and %s, keeping the more frequent',
+                        word, by_hash[h])
+            if counts[word] <= counts[by_hash[h]]:
+                continue
+        by_hash[h] = word
+
+    hashes = np.array(sorted(by_hash), dtype=np.uint64)
+    words = [by_hash[int(h)] for h in hashes]
+    if words:
+        vectors = np.vstack([np.frombuffer(found[word], dtype=np.float32) for word in words])
+    else:
+        vectors = np.empty((0, 0), dtype=np.float32)
+
+    os.makedirs(output_path, exist_ok=True)
+    np.save(os.path.join(output_path, 'vectors.npy'), vectors.astype(dtype))
+    np.save(os.path.join(output_path, 'hashes.npy'), hashes)
+    with open(os.path.join(output_path, 'words.txt'), 'w', encoding='utf-8') as f:
+        f.write('\n'.join(words))
+    with open(os.path.join(output_path, 'meta.json'), 'w') as f:
+        json.dump({'dim': int(vectors.shape[1]),
+                'dtype': dtype,
+                'size': len(words),
+                'min_count': min_count,
+                'source': os.path.basename(source_path)}, f)
+    logger.info('Wrote vocabulary table with %d words to %s', len(words), output_path)
+    return len(words)
+
+
+class CompactWord2Vec:
+    """
+    Drop-in replacement for `up_utils.word2vec.Word2Vec` backed by a table
+    written by `build_vocab`.
+    Instance methods:
+        get_sentence_matrix
+    Instance variables:
+        dim
+        sentence_length
+    """
+
+    def __init__(self, path: str, sentence_length: int):
+        """
+        Memory-map the vocabulary table in `path`.
+        Arguments
+        ---------
+        path: str
+            directory written by `build_vocab`
+        sentence_length: int
+            number of rows in each sentence matrix, words beyond it are dropped
+        Returns
+        -------
+        CompactWord2Vec object
+        """
+        with open(os.path.join(path, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+        self.dim = meta['dim']
+        self.sentence_length = sentence_length
+        self._vectors = np.load(os.path.join(path, 'vectors.npy'), mmap_mode='r')
+        self._hashes = np.load(os.path.join(path, 'hashes.npy'), mmap_mode='r')
+        logger.info('Loaded compact vocabulary with %d words from %s', meta['size'], path)
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def _rows(self, words: List[str]) -> np.ndarray:
+        """
+        Row numbers of the `words` present in the table, in order.
+        """
+        if not words or not len(self._hashes):
+            return np.empty(0, dtype=np.int64)
+        hashes = np.fromiter((word_hash(w) for w in words), dtype=np.uint64, count=len(words))
+        rows = np.searchsorted(self._hashes, hashes)
+        rows[rows == len(self._hashes)] = 0
+        found = self._hashes[rows] == hashes
+        hits = int(found.sum())
+        CACHE_REQUESTS.inc('vocab', 'hit', amount=hits)
+        CACHE_REQUESTS.inc('vocab', 'miss', amount=len(words) - hits)
+        return rows[found]
+
+    def _matrix(self, sentence: str) -> np.ndarray:
+        """
+        Zero padded (sentence_length, dim) matrix for a single sentence.
+        """
+        matrix = np.zeros((self.sentence_length, self.dim), dtype=np.float32)
+        rows = self._rows(tokenize(sentence))[:self.sentence_length]
+        matrix[:len(rows)] = self._vectors[rows]
+        return matrix
+
+    def get_sentence_matrix(self, data: Union[str, List[str]]) -> np.ndarray:
+        """
+        Word vector matrix for a sentence or a list of sentences.
+        Arguments
+        ---------
+        data: str | list[str]
+            sentence(s) to embed
+        Returns
+        -------
+        array of shape (sentence_length, dim) for a str,
+        (len(data), sentence_length, dim) for a list
+        """
+        if isinstance(data, str):
+            return self._matrix(data)
+        return np.stack([self._matrix(sentence) for sentence in data]) if data else \
+            np.zeros((0, self.sentence_length, self.dim), dtype=np.float32)
+
+
+def main():
+    """
+    Command line entry point for building a vocabulary table.
+    """
+    parser = argparse.ArgumentParser(description='Build a compact vocabulary table')
+    parser.add_argument('corpus', nargs='+', help='text files with one bug report per line')
+    parser.add_argument('--source', default=os.getenv('GOOGLENEWS_PATH'),
+                        help='full word2vec binary or text file')
+    parser.add_argument('--output', default=os.getenv('COMPACT_VOCAB_PATH', 'vocab'))
+    parser.add_argument('--min-count', type=int, default=1)
+    parser.add_argument('--dtype', choices=('float16', 'float32'), default='float16')
+    args = parser.parse_args()
+
+    def corpus():
+        for path in args.corpus:
+            with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+                yield from f
+
+    build_vocab(corpus(), args.source, args.output, args.min_count, args.dtype)
+
+
+if __name__ == '__main__':
+    main()
@@ -14,15 +14,22 @@ from __future__ import annotations
 from enum import IntEnum, Enum
 import os
 import asyncio
-from typing import Tuple, Union, List
-import tensorflow as tf
+from contextlib import asynccontextmanager
+from typing import Any, Tuple, Union, List, Callable, Awaitable, AsyncIterator
 import numpy as np
 import bleach
 from dotenv import load_dotenv
-from up_utils.word2vec import Word2Vec
-from up_utils.kdtree import KDTreeUP as KDTree
-from Misc.db import Database, NotFoundError,DuplicateKeyError, NoUpdatesError
-from Misc.log import logger
+from Misc.db import (Database, Change, NotFoundError,DuplicateKeyError, NoUpdatesError,
+                    VersionMismatchError)
+from Misc.log import logger, brief
+from Misc.models import registry
+from Misc.metrics import STAGE_SECONDS, INDEX_SIZE, INDEX_BYTES
+from Misc.tracing import span, traced
+from Misc.index import VectorIndex, apply_changes
+from Misc.cache import QueryCache
+from Misc.clustering import find_clusters
+from Misc.shared_index import SharedIndex, TenantView
+from Misc.users import UserEntry, UserIndexRegistry
 
 load_dotenv()
 
@@ -40,7 +47,7 @@ def authenticate_user(fn):
     async def wrapper(self, *args, **kwargs):
         user_id = kwargs.get('user_id')
         if user_id not in self.user_manager:
-            logger.error('User: %s not in database: %s, Auth failed',user_id,self.user_manager)
+            logger.error('User: %s not among %d users, Auth failed', user_id, len(self.user_manager))
             raise ValueError('User not available')
         return await fn(self, *args, **kwargs)
     return wrapper
@@ -60,9 +67,10 @@ def get_or_create_user(fn):
         user_id = kwargs.get('user_id')
         if user_id not in self.user_manager:
             try:
-                await self._database.insert_user(user_id)
-                #create an empty kdtree and asyncio.BoundedSemaphore for user
-                self.user_manager[user_id] = {'kdtree': None,'lock': asyncio.BoundedSemaphore(1)}
+                await self._database.insert_user(user_id, registry.version)
+                #create an empty index and asyncio.BoundedSemaphore for user
+                self.user_manager[user_id] = BCJAIapi._user_entry(None, registry.version,
+                                                        lock=self.shared.stripe(user_id))
             except (TypeError, DuplicateKeyError) as e:
                 logger.error('Inserting user: %s failed for err: %s',user_id, e)
                 raise ValueError from e
@@ -89,6 +97,15 @@ class BCJMessage(Enum):
     NO_UPDATES = "There were no updates to make."
     NO_DELETION = "There was nothing to delete for the given (user_id, id) pair."
     EMPTY_TREE = "No examples available"
+    NO_MODEL_VERSION = "The given model version is not available."
+    REEMBED_STARTED = "Re-embedding started, the user switches over once it completes."
+    ALREADY_ON_VERSION = "The user is already on the given model version."
+    NO_SENTENCE = "Some bugs were stored without text and can't be re-embedded."
+    CLUSTERING_STARTED = "Clustering started, fetch the clusters once it completes."
+    CLUSTERING_RUNNING = "The bugs of this user are already being clustered."
+    NO_CLUSTERS = "The bugs of this user haven't been clustered."
+    NO_BINARY_RADIUS = ("Radius queries can't be sent as 'application/x-bcj-neighbours', "
+                "accept json, ndjson or msgpack.")
 
 class BCJStatus(IntEnum):
     """
@@ -107,38 +124,43 @@ class BCJAIapi:
     Class methods:
     initialize
     Instance variables:
-        user_manager: dict
-            All user_manager currently available, key-value pairs -> {user_id: UserManager}
+        user_manager: UserIndexRegistry
+            All users currently available, user_id -> UserEntry with the user's
+            index, lock, model version and the last change log entry applied to
+            the index, see 'Misc/users.py'
         database: Database
             connection pool to the database
+        query_cache: QueryCache
+            results of recent similarity queries
+        shared: SharedIndex
+            index of the users with few bugs, see 'Misc/shared_index.py'
     Instance methods:
         get_similar_bugs_k
+        stream_similar_bugs_k
         add_bug
         remove_bug
         update_bug
+        update_bugs
         remove_batch
+        remove_bugs
         add_batch
+        start_reembed
+        reembed_user
+        start_clustering
+        cluster_bugs
+        get_clusters
+        evict_idle
     """
 
-    #Initalize up_utils.word2vec.Word2Vec
-    _w2v = Word2Vec(
-            outputfile=os.getenv('OUTPUT_FILE'),
-            dataset=os.getenv('DATASET'), # Dataset can be googlenews or commoncrawl
-            commoncrawl_path=os.getenv('COMMONCRAWL_PATH'),
-            googlenews_path=os.getenv('GOOGLENEWS_PATH'))
-
-    #load Model from disk
-    _model = tf.keras.models.load_model('Models', compile=False)
-
-    def __init__(self, user_manager: dict, database: Database):
+    def __init__(self, user_manager: UserIndexRegistry, database: Database):
         """
         Initialize user_manager and database.
         Requirements:
             Initialize asyncronously using the classmethod 'initialize'.
         Arguments
         ---------
-        user_manager - dict:
-            A dict of user_ids - dict('kdtree': KDTree, 'lock': asyncio.BoundedSempaphore)
+        user_manager - UserIndexRegistry:
+            user_id -> UserEntry of every user
         database - db.Database
             a Database object with a connection pool.
         Returns
@@ -148,6 +170,12 @@ class BCJAIapi:
 
         self._database = database
         self.user_manager = user_manager
+        self._background = set()
+        self._clustering = set()
+        self._promoted = set()
+        self._sync_task = None
+        self.query_cache = QueryCache()
+        self.shared = SharedIndex()
 
 
     @classmethod
@@ -165,62 +193,333 @@ class BCJAIapi:
         """
 
         try:
-            #make a semaphore and a KDTree per user
-            user_manager = {user_id: {
-                        'kdtree': BCJAIapi._create_tree(
-                            await database.fetch_all(user_id, err=False)),
-                        'lock': asyncio.BoundedSemaphore(1)
-                    }
-                    for user_id in await database.fetch_users()}
+            user_ids = list(await database.fetch_model_versions())
         except NotFoundError: #No users available
-            user_manager = {}
-        logger.info('Initialized BCJAIapi with user_manager: %s', user_manager)
-        return cls(user_manager,database)
+            user_ids = []
+        #make a semaphore and an index per user, with the change log position it reflects,
+        #users with few bugs share the semaphores and the index of 'api.shared'
+        api = cls(UserIndexRegistry(), database)
+        for user_id in user_ids:
+            rows, seq, version = await database.fetch_snapshot(user_id)
+            index = VectorIndex.from_rows(rows)
+            lock = api.shared.stripe(user_id) if api.shared.fits(index) else None
+            api.user_manager[user_id] = BCJAIapi._user_entry(None, version, seq, lock)
+            api._set_index(user_id, index)
+        logger.info('Initialized BCJAIapi with %d users, %d in the shared index',
+                    len(api.user_manager), api.shared.stats()['tenants'])
+        logger.debug('user_manager: %s', brief(api.user_manager))
+        return api
+
+    @staticmethod
+    def _user_entry(index: Union[None,VectorIndex], version: str, seq: int = 0,
+                    lock: asyncio.BoundedSemaphore = None) -> UserEntry:
+        """
+        Private static method for creating a 'user_manager' entry,
+        'seq' is the last change log entry applied to 'index',
+        the user gets its own semaphore unless `lock` is given
+        """
+        if version not in registry.versions:
+            logger.error('No encoder available for model version %s', version)
+        return UserEntry(index, lock or asyncio.BoundedSemaphore(1), version, seq)
+
+    @staticmethod
+    def _clean(text: str) -> str:
+        """
+        Private static method for sanitizing `text` before vectorization
+        """
+        with STAGE_SECONDS.time('clean'):
+            return bleach.clean(text)
+
+    @asynccontextmanager
+    async def _locked(self, user_id: str):
+        """
+        Hold the lock of `user_id`, recording the time waited for it,
+        and reload the user's index if it was evicted
+        """
+        with STAGE_SECONDS.time('lock_wait'), span('lock_wait'):
+            while True:
+                lock = self.user_manager[user_id].lock
+                await lock.acquire()
+                if self.user_manager[user_id].lock is lock:
+                    break
+                #the user was promoted to its own semaphore while waiting
+                lock.release()
+        try:
+            if self.user_manager.touch(user_id).evicted:
+                await self._reload(user_id)
+            yield
+        finally:
+            if user_id in self._promoted:
+                self._promoted.discard(user_id)
+                self.user_manager[user_id].lock = asyncio.BoundedSemaphore(1)
+            lock.release()
+
+    def _set_index(self, user_id: str, index: Union[None,VectorIndex]) -> None:
+        """
+        Replace the index of `user_id`, must be called holding the user's lock.
+        Users on a shared semaphore are kept in 'self.shared' while they fit,
+        else promoted to their own index and, once the lock is released, semaphore.
+        """
+        entry = self.user_manager[user_id]
+        index = index if index is not None and len(index) else None
+        if self.shared.is_stripe(entry.lock) and user_id not in self._promoted:
+            if index is None:
+                self.shared.drop(user_id)
+            elif self.shared.fits(index):
+                if not isinstance(index, TenantView):
+                    index = self.shared.put(user_id, index)
+            else:
+                index = VectorIndex(index.ids, index.embeddings)
+                self.shared.drop(user_id)
+                self._promoted.add(user_id)
+                logger.info('Promoted user %s to its own index with %d bugs', user_id, len(index))
+        self.user_manager.set_index(user_id, index)
+        INDEX_SIZE.set(self.user_manager.bugs)
+        INDEX_BYTES.set(self.user_manager.nbytes)
+        #results of the old index never hit again, free their memory
+        self.query_cache.invalidate(user_id)
+
+
+    @staticmethod
+    async def _encode(sentences: List[str], version: str) -> np.ndarray:
+        """
+        Private static method for encoding cleaned `sentences`,
+        waits for the encoder to finish loading if needed.
+        Arguments
+        ---------
+            sentences: list[str]
+            version: str
+                model version to encode with
+        Returns
+        -------
+        np.ndarray of embeddings, one row per sentence
+        """
+        with span('encode', sentences=len(sentences), model_version=version):
+            encoder = await registry.get_encoder(version)
+            return encoder.encode(sentences)
+
+    async def _query_vector(self, user_id: str, index: VectorIndex, data: str,
+                            id: Union[None,int]) -> Tuple[BCJStatus, Union[np.ndarray,BCJMessage]]: #pylint: disable=redefined-builtin
+        """
+        Embeddings to query `index` with, those of the stored bug `id`
+        if given, else the cleaned text `data` encoded with the user's model.
+        Must be called holding the user's lock.
+        Returns
+        -------
+        BCJStatus, np.ndarray or the BCJMessage of the failure
+        """
+        if id is not None:
+            vec = index.embedding(id)
+            if vec is None:
+                return BCJStatus.NOT_FOUND, BCJMessage.NO_EXAMPLE
+            return BCJStatus.OK, vec[None]
+        try:
+            #use 'structured_info' when model supports it
+            return BCJStatus.OK, await BCJAIapi._encode([data], self.user_manager[user_id].version)
+        except Exception:
+            logger.error('Could not predict/vectorize for %s', brief(data))
+            return BCJStatus.NOT_IMPLEMENTED, BCJMessage.UNPROCESSABLE_INPUT
 
     @staticmethod
-    def _create_tree(new_data: Union[None,List[dict]]) -> KDTree:
+    def _exclude(dists: np.ndarray, ids: np.ndarray, id: int, #pylint: disable=redefined-builtin
+                k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Private static method leaving the bug `id` out of ranked neighbours, keeps at most `k`
         """
-        Private static method for creating 'kdtree' with `new_data`
+        keep = ids != id
+        return dists[keep][:k], ids[keep][:k]
+
+    async def _encode_and_write(self,
+                            user_id: str,
+                            sentences: List[str],
+                            write: Callable[[np.ndarray, str], Awaitable]) -> Tuple[np.ndarray,Any]:
+        """
+        Encode `sentences` with the user's model version and store them with `write`.
+        Encodes again with the new version if the user was switched to another
+        version in the meantime.
         Arguments
         ---------
-            new_data: list[dict]
-                data containing a list of embeddings and IDs
+            user_id: str
+            sentences: list[str]
+            write: coroutine function (embeddings, version)
         Returns
         -------
-        KDTree
+        np.ndarray of the stored embeddings and the result of `write`
         """
-        if new_data:
-            embeddings = np.vstack([data['embeddings'] for data in new_data])
-            ids = np.array([data['id'] for data in new_data])
-            return KDTree(data=embeddings, indices=ids)
-        return None
+        version = self.user_manager[user_id].version
+        for _ in range(2):
+            embeddings = await BCJAIapi._encode(sentences, version)
+            try:
+                return embeddings, await write(embeddings, version)
+            except VersionMismatchError:
+                async with self._locked(user_id): #wait for the switch to finish
+                    version = self.user_manager[user_id].version
+        raise VersionMismatchError('Model version changed during the write', user_id)
+
 
+    async def _apply(self, user_id: str, changes: List[Change]) -> None:
+        """
+        Apply the logged `changes` of a write to 'self.user_manager[user_id].index'
+        Arguments
+        ---------
+        user_id: str
+        changes: list[Change] | None
+            change log entries returned by the write, None if nothing was written
+        Returns
+        -------
+        None
+        """
+        if changes is None:
+            logger.warning('The write of %s returned no changes, the index is left as is', user_id)
+            return
+        async with self._locked(user_id): #Prevent threads from rewriting the index
+            await self._catch_up(user_id, changes)
 
-    async def _update_tree_for_user(self, user_id: str) -> None:
+    async def _catch_up(self, user_id: str, changes: List[Change] = ()) -> None:
         """
-        Update 'self.user_manager[user_id]['kdtree']' approperiately for `user_id`
+        Bring the user's index up to date with the change log, must be called
+        holding the user's lock. Changes the index already reflects are skipped,
+        changes missing before `changes` are replayed from the log and the user
+        is reloaded when the log was pruned past the index or all bugs changed.
+        Without `changes` the caller knows the log is ahead of the index.
+        On failure the index is dropped and the user marked evicted, so it is
+        reloaded from the database on next use instead of served behind the log.
         Arguments
         ---------
-        user_id: int
+        user_id: str
+        changes: list[Change]
+            entries known to the caller, fetched from the log if empty
         Returns
         -------
         None
         """
-        data = await self._database.fetch_all(user_id, err=False)
-        async with self.user_manager[user_id]['lock']: #Prevent threads from rewriting the kdtree
-            self.user_manager[user_id]['kdtree'] = BCJAIapi._create_tree(data)
+        entry = self.user_manager[user_id]
+        try:
+            pending = [change for change in changes
+                if change.user_id == user_id and change.seq > entry.seq]
+            if changes and not pending:
+                return
+            if not pending or pending[0].seq != entry.seq + 1:
+                pending = await self._database.fetch_changes(user_id, entry.seq)
+            if not pending and changes:
+                return
+            if not pending or pending[0].seq != entry.seq + 1 or any(change.op == 'R' for change in pending):
+                await self._reload(user_id)
+                return
+            self._set_index(user_id, apply_changes(entry.index, pending))
+            entry.seq = pending[-1].seq
+            entry.writes += len(pending)
+        except Exception:
+            logger.exception('Applying changes to the index of %s failed after %d, '
+                            'reloading it on next use', user_id, entry.seq)
+            self._set_index(user_id, None)
+            entry.evicted = True
+
+    async def _reload(self, user_id: str) -> None:
+        """
+        Replace the user's index, model version and watermark with a database
+        snapshot, must be called holding the user's lock.
+        """
+        rows, seq, version = await self._database.fetch_snapshot(user_id)
+        self._set_index(user_id, VectorIndex.from_rows(rows))
+        entry = self.user_manager[user_id]
+        entry.seq, entry.version, entry.evicted = seq, version, False
+
+    async def sync(self) -> None:
+        """
+        Catch up the indexes with changes written by other workers
+        and add the users they created.
+        """
+        for user_id, seq in (await self._database.fetch_log_seqs()).items():
+            if user_id not in self.user_manager:
+                self.user_manager[user_id] = BCJAIapi._user_entry(None, registry.version,
+                                                        lock=self.shared.stripe(user_id))
+                async with self._locked(user_id):
+                    await self._reload(user_id)
+            elif seq > self.user_manager[user_id].seq and not self.user_manager[user_id].evicted:
+                async with self._locked(user_id):
+                    await self._catch_up(user_id)
+
+    def evict_idle(self, seconds: float) -> int:
+        """
+        Drop the indexes of the users not used for `seconds`, an evicted
+        index is reloaded from the database on the next use of the user.
+        Users whose lock is held are skipped.
+        Arguments
+        ---------
+        seconds: float
+        Returns
+        -------
+        number of evicted users
+        """
+        evicted = 0
+        for user_id in self.user_manager.idle(seconds):
+            entry = self.user_manager[user_id]
+            if entry.lock.locked():
+                continue
+            self._set_index(user_id, None)
+            entry.evicted = True
+            evicted += 1
+        if evicted:
+            logger.info('Evicted the indexes of %d idle users', evicted)
+        return evicted
+
+    def start_sync(self, interval: float = None, retention: float = None,
+                idle: float = None) -> None:
+        """
+        Run `sync` every `interval` seconds in the background, prune change
+        log entries older than `retention` seconds and evict the indexes of
+        users idle for `idle` seconds.
+        Arguments
+        ---------
+        interval: float | None
+            'CHANGELOG_SYNC_INTERVAL' in '.env' if None, 5 by default
+        retention: float | None
+            'CHANGELOG_RETENTION' in '.env' if None, a day by default
+        idle: float | None
+            'USER_IDLE_SECONDS' in '.env' if None, 0 by default which never evicts
+        """
+        interval = interval or float(os.getenv('CHANGELOG_SYNC_INTERVAL', '5'))
+        retention = retention or float(os.getenv('CHANGELOG_RETENTION', '86400'))
+        idle = float(os.getenv('USER_IDLE_SECONDS', '0')) if idle is None else idle
+
+        async def run():
+            while True:
+                await asyncio.sleep(interval)
+                try:
+                    await self.sync()
+                    await self._database.prune_changes(retention)
+                    if idle > 0:
+                        self.evict_idle(idle)
+                except Exception:
+                    logger.exception('Change log sync failed')
+
+        self._sync_task = asyncio.create_task(run())
+
+    def stop_sync(self) -> None:
+        """
+        Stop the task started by `start_sync`
+        """
+        if self._sync_task is not None:
+            self._sync_task.cancel()
+            self._sync_task = None
 
 
+    @traced('bcj.get_similar_bugs_k')
     @authenticate_user
     async def get_similar_bugs_k(self,#pylint: disable=too-many-arguments
                             user_id: str,
                             summary: str = "",
                             description: str = "",
                             structured_info: str=None,
-                            k: int=5) -> Tuple[BCJStatus, Union[dict,BCJMessage]]:
+                            k: int=5,
+                            radius: float=None,
+                            id: int=None) -> Tuple[BCJStatus, Union[dict,BCJMessage]]: #pylint: disable=redefined-builtin
         """
         Return the IDs and distance values of the k most similar bugs
-        based on the given summary, description, and structured information.
+        based on the given summary, description, and structured information,
+        or to the stored bug 'id', which is left out of the result.
+        With a 'radius', return the bugs within that distance instead, at most k of them.
         Arguments
         ---------
             user_id: str
@@ -233,42 +532,137 @@ class BCJAIapi:
                 'date': str
                     A string representation of a date for the bug
             'k': int
-                The number of similar bugs to fetch
+                The number of similar bugs to fetch, the most returned with a 'radius'
+            'radius': float | None
+                Distance of the bugs to fetch, for duplicate detection
+            'id': int | None
+                Id of a stored bug to query by instead of the text, its
+                embeddings are read from the index without encoding
         Returns
         -------
-        BCJStatus, dict containing Id's and distances of the 'k' most similar
+        BCJStatus, dict containing Id's and distances of the 'k' most similar,
+        with a 'radius' also 'truncated', whether more than 'k' bugs were found
         """
 
-        assert bool(summary) or bool(description)
+        assert id is not None or bool(summary) or bool(description)
 
         #prepare data for vectorization and insertion
-        data = bleach.clean(description) if bool(description) \
-            else bleach.clean(summary)
-        async with self.user_manager[user_id]['lock']:
-            if self.user_manager[user_id]['kdtree'] is None:
-                logger.info('KDTree is empty for user: %s', user_id)
+        data = '' if id is not None else BCJAIapi._clean(description) if bool(description) \
+            else BCJAIapi._clean(summary)
+        filters = None if radius is None else ('radius', radius)
+        if id is not None:
+            filters = ('id', id, filters)
+        async with self._locked(user_id):
+            entry = self.user_manager[user_id]
+            entry.queries += 1
+            index = entry.index
+            if index is None:
+                logger.info('Index is empty for user: %s', user_id)
                 raise NotFoundError(f"{user_id} has no available data")
 
-            N = len(self.user_manager[user_id]['kdtree'].indices)
+            N = len(index)
             k = min(k,N)
 
-            try:
-                #use 'structured_info' when model supports it
-                vec= BCJAIapi._model.predict(np.array([BCJAIapi._w2v.get_sentence_matrix(data)]))
-            except Exception:
-                logger.error('Could not predict/vectorize for %s', data)
-                return BCJStatus.NOT_IMPLEMENTED, BCJMessage.UNPROCESSABLE_INPUT
+            #the change log sequence number versions the index
+            key = QueryCache.key(user_id, data, k, filters)
+            version = entry.seq
+            cached = self.query_cache.get(key, version)
+            if cached is not None:
+                ids, dists = cached
+                if radius is not None:
+                    #truncated results are not cached
+                    return BCJStatus.OK, {"id": ids, "dist": dists, "truncated": False}
+                return BCJStatus.OK, {"id": ids, "dist": dists}
 
-            dists,ids = self.user_manager[user_id]['kdtree'].query(vec, k=k)
+            status, vec = await self._query_vector(user_id, index, data, id)
+            if status != BCJStatus.OK:
+                return status, vec
+            #one more for the bug queried by, which is left out
+            extra = 0 if id is None else 1
 
+            if radius is not None:
+                dists, ids, truncated = index.within(vec, radius, limit=k + extra)
+                if id is not None:
+                    #the bug queried by doesn't count towards 'k'
+                    found = int(np.count_nonzero(ids != id))
+                    truncated = truncated or found > k
+                    dists, ids = BCJAIapi._exclude(dists, ids, id, k)
+                if not truncated:
+                    self.query_cache.put(key, version, ids, dists)
+                return BCJStatus.OK, {"id": ids, "dist": dists, "truncated": truncated}
+
+            dists,ids = index.query(vec, k=min(k + extra, N))
+            if id is not None:
+                dists, ids = BCJAIapi._exclude(dists.ravel(), ids.ravel(), id, k)
+            self.query_cache.put(key, version, ids.ravel(), dists.ravel())
+
+            #arrays are encoded directly by the response, see 'Misc/serialization.py'
             response = {
-                "id": ids.flatten().tolist(),
-                "dist": dists.flatten().tolist()
+                "id": ids.ravel(),
+                "dist": dists.ravel()
             }
 
         return BCJStatus.OK, response
 
 
+    @traced('bcj.stream_similar_bugs_k')
+    @authenticate_user
+    async def stream_similar_bugs_k(self,#pylint: disable=too-many-arguments
+                            user_id: str,
+                            summary: str = "",
+                            description: str = "",
+                            structured_info: str=None,
+                            k: int=5,
+                            radius: float=None,
+                            id: int=None) -> Tuple[BCJStatus, Union[AsyncIterator,BCJMessage]]: #pylint: disable=redefined-builtin
+        """
+        Like `get_similar_bugs_k`, but the k most similar bugs are produced in
+        ranked pages, so the first ones can be sent before the rest are ranked.
+        The bugs within a 'radius' are produced in a single page.
+        Arguments
+        ---------
+            as for `get_similar_bugs_k`
+        Returns
+        -------
+        BCJStatus, async iterator of (distances, ids) pages in ranked order
+        """
+
+        assert id is not None or bool(summary) or bool(description)
+
+        data = '' if id is not None else BCJAIapi._clean(description) if bool(description) \
+            else BCJAIapi._clean(summary)
+        async with self._locked(user_id):
+            entry = self.user_manager[user_id]
+            entry.queries += 1
+            index = entry.index
+            if index is None:
+                logger.info('Index is empty for user: %s', user_id)
+                raise NotFoundError(f"{user_id} has no available data")
+
+            status, vec = await self._query_vector(user_id, index, data, id)
+            if status != BCJStatus.OK:
+                return status, vec
+            extra = 0 if id is None else 1
+
+            if radius is not None:
+                pages = iter([index.within(vec, radius, limit=k + extra)[:2]])
+            else:
+                pages = index.ranked(vec, k=k + extra)
+
+        async def stream():
+            remaining = k
+            for dists, ids in pages:
+                if remaining <= 0:
+                    break
+                if id is not None:
+                    dists, ids = BCJAIapi._exclude(dists, ids, id, remaining)
+                remaining -= len(ids)
+                yield dists, ids
+                await asyncio.sleep(0) #let the response send the page
+
+        return BCJStatus.OK, stream()
+
+    @traced('bcj.add_bug')
     @get_or_create_user
     async def add_bug(self,
                 user_id: str,
@@ -298,29 +692,26 @@ class BCJAIapi:
         """
         assert bool(description) or bool(summary)
         # Sanitize and prepare the data for vectorization and insertion
-        data = bleach.clean(description) if bool(description) \
-            else bleach.clean(summary)
+        data = BCJAIapi._clean(description) if bool(description) \
+            else BCJAIapi._clean(summary)
         batch_id = structured_info['batch_id'] if 'batch_id' in structured_info else None
-        embeddings= BCJAIapi._model.predict(np.array([BCJAIapi._w2v.get_sentence_matrix(data)]))
 
         try:
-            await self._database.insert(id=structured_info['id'],
+            _, changes = await self._encode_and_write(user_id, [data],
+                lambda embeddings, version: self._database.insert(id=structured_info['id'],
                         user_id=user_id,
                         embeddings=embeddings,
-                        batch_id=batch_id)
+                        batch_id=batch_id,
+                        model_version=version,
+                        sentence=data))
         except DuplicateKeyError:
             return BCJStatus.BAD_REQUEST, BCJMessage.DUPLICATE_ID
 
-        async with self.user_manager[user_id]['lock']: #prevent race conditions
-            if self.user_manager[user_id]['kdtree'] is None:
-                self.user_manager[user_id]['kdtree'] = KDTree(data=embeddings,
-                                                    indices=[structured_info['id']])
-            else:
-                self.user_manager[user_id]['kdtree'].update(embeddings, structured_info['id'])
-
-            return BCJStatus.OK, BCJMessage.VALID_INPUT
+        await self._apply(user_id, changes)
+        return BCJStatus.OK, BCJMessage.VALID_INPUT
 
 
+    @traced('bcj.remove_bug')
     @authenticate_user
     async def remove_bug(self,user_id: str, id: int) -> Tuple[BCJStatus, BCJMessage]: #pylint: disable=redefined-builtin
         """
@@ -337,12 +728,13 @@ class BCJAIapi:
         """
 
         try:
-            await self._database.delete(id=id,user_id=user_id)
+            changes = await self._database.delete(id=id,user_id=user_id)
         except NoUpdatesError:
             return BCJStatus.NOT_FOUND, BCJMessage.NO_EXAMPLE
-        await self._update_tree_for_user(user_id)
+        await self._apply(user_id, changes)
         return BCJStatus.OK, BCJMessage.VALID_INPUT
 
+    @traced('bcj.update_bug')
     @authenticate_user
     async def update_bug(self,
                     user_id: str,
@@ -388,22 +780,68 @@ class BCJAIapi:
                 return BCJStatus.BAD_REQUEST, BCJMessage.NO_UPDATES
 
         #clean data and vectorize
-        data = bleach.clean(description) if bool(description) \
-            else bleach.clean(summary)
-        embeddings= BCJAIapi._model.predict(np.array([BCJAIapi._w2v.get_sentence_matrix(data)]))
+        data = BCJAIapi._clean(description) if bool(description) \
+            else BCJAIapi._clean(summary)
 
         try:
-            await self._database.update(id=structured_info['id'],
+            _, changes = await self._encode_and_write(user_id, [data],
+                lambda embeddings, version: self._database.update(id=structured_info['id'],
                             user_id=user_id,
                             embeddings=embeddings,
-                            batch_id=batch_id)
+                            batch_id=batch_id,
+                            model_version=version,
+                            sentence=data))
         except(TypeError, NoUpdatesError):
             return BCJStatus.BAD_REQUEST, BCJMessage.NO_UPDATES
 
-        await self._update_tree_for_user(user_id)
+        await self._apply(user_id, changes)
         return BCJStatus.OK, BCJMessage.VALID_INPUT
 
 
+    @traced('bcj.update_bugs')
+    @authenticate_user
+    async def update_bugs(self, user_id: str, data: list) -> Tuple[BCJStatus, dict]:
+        """
+        Updates many bugs in one statement. Only bugs with a new summary or
+        description are encoded, together, and the index is updated once.
+        Arguments
+        ---------
+            user_id: str
+                Indentification number of the user: must exist in the database
+            data: list of dicts with the 'summary', 'description' and 'structured_info'
+                of a bug as for `update_bug`, a None 'batch_id' keeps the bug's batch
+        Returns
+        -------
+        BCJStatus, dict of the 'updated' ids and the ids 'not_found' for the user
+        """
+        ids = [bug['structured_info']['id'] for bug in data]
+        #the description is encoded if available, as in `update_bug`
+        sentences = {bug['structured_info']['id']: BCJAIapi._clean(bug['description']
+                        if bool(bug['description']) else bug['summary'])
+                    for bug in data if bool(bug['description']) or bool(bug['summary'])}
+
+        def update_many(embeddings, version):
+            rows = dict(zip(sentences, embeddings))
+            return self._database.update_many(user_id,
+                            [(bug_id, rows.get(bug_id), bug['structured_info']['batch_id'],
+                                sentences.get(bug_id)) for bug_id, bug in zip(ids, data)],
+                            model_version=version)
+
+        try:
+            if sentences:
+                _, (updated, changes) = await self._encode_and_write(user_id,
+                                                    list(sentences.values()), update_many)
+            else:
+                updated, changes = await update_many([], None)
+        except NoUpdatesError:
+            updated, changes = [], []
+        if changes:
+            await self._apply(user_id, changes)
+        updated = set(updated)
+        return BCJStatus.OK, {'updated': [bug_id for bug_id in ids if bug_id in updated],
+                            'not_found': [bug_id for bug_id in ids if bug_id not in updated]}
+
+    @traced('bcj.remove_batch')
     @authenticate_user
     async def remove_batch(self,user_id: str, batch_id: int) -> Tuple[BCJStatus, BCJMessage]:
         """
@@ -420,13 +858,41 @@ class BCJAIapi:
         """
 
         try:
-            await self._database.delete_batch(batch_id,user_id)
+            changes = await self._database.delete_batch(batch_id,user_id)
         except NoUpdatesError:
             return BCJStatus.BAD_REQUEST, BCJMessage.NO_DELETION
 
-        await self._update_tree_for_user(user_id)
+        await self._apply(user_id, changes)
         return BCJStatus.OK, BCJMessage.VALID_INPUT
 
+    @traced('bcj.remove_bugs')
+    @authenticate_user
+    async def remove_bugs(self, user_id: str, ids: List[int]) -> Tuple[BCJStatus, dict]:
+        """
+        Removes the bugs with the given ids in one statement and one index update.
+        Arguments
+        ---------
+            user_id: str
+                Indentification number of the user: must exist in the database
+            ids: list[int]
+                Identification numbers of the bugs
+        Returns
+        -------
+        BCJStatus, dict of the 'removed' ids and the ids 'not_found' for the user
+        """
+
+        try:
+            changes = await self._database.delete_many(ids, user_id)
+        except NoUpdatesError:
+            changes = []
+        if changes:
+            await self._apply(user_id, changes)
+        removed = {change.id for change in changes}
+        ids = list(dict.fromkeys(ids))
+        return BCJStatus.OK, {'removed': [bug_id for bug_id in ids if bug_id in removed],
+                            'not_found': [bug_id for bug_id in ids if bug_id not in removed]}
+
+    @traced('bcj.add_batch')
     @get_or_create_user
     async def add_batch(self,user_id: str, data: list) -> Tuple[BCJStatus, BCJMessage]:
         """
@@ -461,18 +927,179 @@ class BCJAIapi:
             sentence = bug['description'] if bool(bug['description']) else bug['summary']
             if not bool(sentence):
                 raise AssertionError
-            sentences.append(bleach.clean(sentence))
+            sentences.append(BCJAIapi._clean(sentence))
 
         #vectorize sentences and combine them with the approperiate id
-        embeddings = BCJAIapi._model.predict(np.array(BCJAIapi._w2v.get_sentence_matrix(sentences)))
-        batch_data = [(bug['structured_info']['id'],user_id,
-                            embedding,bug['structured_info']['batch_id'])
-                            for bug, embedding in zip(data, embeddings)]
+        def insert_batch(embeddings, version):
+            return self._database.insert_batch([(bug['structured_info']['id'],user_id,
+                            embedding,bug['structured_info']['batch_id'],sentence)
+                            for bug, embedding, sentence in zip(data, embeddings, sentences)],
+                            model_version=version)
 
         try:
-            await self._database.insert_batch(batch_data)
+            _, changes = await self._encode_and_write(user_id, sentences, insert_batch)
         except DuplicateKeyError:
             return BCJStatus.ERROR, BCJMessage.DUPLICATE_ID_BATCH
 
-        await self._update_tree_for_user(user_id)
+        await self._apply(user_id, changes)
+        return BCJStatus.OK, BCJMessage.VALID_INPUT
+
+    @traced('bcj.start_reembed')
+    @authenticate_user
+    async def start_reembed(self, user_id: str, model_version: str = None) -> Tuple[BCJStatus, BCJMessage]:
+        """
+        Start re-embedding all bugs of `user_id` with `model_version` in the background.
+        Arguments
+        ---------
+            user_id: str
+                Indentification number of the user: must exist in the database
+            model_version: str | None
+                Version to switch to, the current model version if None
+        Returns
+        -------
+        BCJStatus, BCJMessage
+        """
+        model_version = model_version or registry.version
+        if model_version not in registry.versions:
+            return BCJStatus.BAD_REQUEST, BCJMessage.NO_MODEL_VERSION
+        if self.user_manager[user_id].version == model_version:
+            return BCJStatus.BAD_REQUEST, BCJMessage.ALREADY_ON_VERSION
+        task = asyncio.create_task(self.reembed_user(user_id=user_id,
+                                                    model_version=model_version))
+        #keep a reference to the task until it is done
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        return BCJStatus.OK, BCJMessage.REEMBED_STARTED
+
+    @traced('bcj.reembed_user')
+    @authenticate_user
+    async def reembed_user(self,
+                        user_id: str,
+                        model_version: str,
+                        batch_size: int = None,
+                        pause: float = None) -> Tuple[BCJStatus, BCJMessage]:
+        """
+        Re-embed all bugs of `user_id` with `model_version` and switch over atomically.
+        Bugs are encoded in batches off the event loop with a pause in between
+        to protect query latency, stored next to the current embeddings and
+        swapped in together once all bugs are encoded.
+        Arguments
+        ---------
+            user_id: str
+                Indentification number of the user: must exist in the database
+            model_version: str
+                Version to switch to
+            batch_size: int | None
+                Bugs per batch, 'REEMBED_BATCH_SIZE' in '.env' if None
+            pause: float | None
+                Seconds to wait between batches, 'REEMBED_PAUSE' in '.env' if None
+        Returns
+        -------
+        BCJStatus, BCJMessage
+        """
+        batch_size = batch_size or int(os.getenv('REEMBED_BATCH_SIZE', '256'))
+        pause = float(os.getenv('REEMBED_PAUSE', '0.1')) if pause is None else pause
+        encoder = await registry.get_encoder(model_version)
+        loop = asyncio.get_running_loop()
+
+        async def stage(rows):
+            if any(sentence is None for _, sentence in rows):
+                return False
+            sentences = [sentence for _, sentence in rows]
+            embeddings = await loop.run_in_executor(None, encoder.encode, sentences)
+            await self._database.stage_embeddings(user_id, model_version,
+                [(id, embedding, sentence) for (id, sentence), embedding
+                    in zip(rows, embeddings)])
+            return True
+
+        logger.info('Re-embedding user %s with model version %s', user_id, model_version)
+        last_id = -2**63
+        while rows := await self._database.fetch_sentences(user_id, last_id, batch_size):
+            if not await stage(rows):
+                logger.error('User %s has bugs without text, re-embedding aborted', user_id)
+                return BCJStatus.BAD_REQUEST, BCJMessage.NO_SENTENCE
+            last_id = rows[-1][0]
+            await asyncio.sleep(pause)
+
+        async with self._locked(user_id):
+            #stage bugs added or changed since they were paged through, then switch
+            while missing := await self._database.cutover(user_id, model_version):
+                if not await stage(missing):
+                    return BCJStatus.BAD_REQUEST, BCJMessage.NO_SENTENCE
+            await self._catch_up(user_id)
+        logger.info('User %s switched to model version %s', user_id, model_version)
+        return BCJStatus.OK, BCJMessage.VALID_INPUT
+
+    @traced('bcj.start_clustering')
+    @authenticate_user
+    async def start_clustering(self, user_id: str, threshold: float) -> Tuple[BCJStatus, BCJMessage]:
+        """
+        Start finding the near-duplicate clusters of `user_id` in the background.
+        Arguments
+        ---------
+            user_id: str
+                Indentification number of the user: must exist in the database
+            threshold: float
+                Largest distance between bugs in the same cluster
+        Returns
+        -------
+        BCJStatus, BCJMessage
+        """
+        if user_id in self._clustering:
+            return BCJStatus.BAD_REQUEST, BCJMessage.CLUSTERING_RUNNING
+        self._clustering.add(user_id)
+        task = asyncio.create_task(self.cluster_bugs(user_id=user_id, threshold=threshold))
+        #keep a reference to the task until it is done
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        task.add_done_callback(lambda _: self._clustering.discard(user_id))
+        return BCJStatus.OK, BCJMessage.CLUSTERING_STARTED
+
+    @traced('bcj.cluster_bugs')
+    @authenticate_user
+    async def cluster_bugs(self, user_id: str, threshold: float) -> Tuple[BCJStatus, BCJMessage]:
+        """
+        Find the clusters of bugs of `user_id` linked by distances of at most
+        `threshold` and store them, replacing the previous clusters.
+        The pairwise distances are computed off the event loop on the index
+        as it was when the job started, see 'Misc/clustering.py'.
+        Arguments
+        ---------
+            user_id: str
+                Indentification number of the user: must exist in the database
+            threshold: float
+                Largest distance between bugs in the same cluster
+        Returns
+        -------
+        BCJStatus, BCJMessage
+        """
+        async with self._locked(user_id):
+            index, seq = self.user_manager[user_id].index, self.user_manager[user_id].seq
+            #writes replace the arrays instead of changing them, safe to use unlocked
+            ids, embeddings = (index.ids, index.embeddings) if index is not None \
+                else (np.empty(0, dtype=np.int64), np.empty((0, 0)))
+        loop = asyncio.get_running_loop()
+        clusters = await loop.run_in_executor(None, find_clusters, ids, embeddings, threshold)
+        await self._database.save_clusters(user_id, threshold, seq, clusters)
+        logger.info('Found %d clusters among %d bugs of user %s', len(clusters), len(ids), user_id)
         return BCJStatus.OK, BCJMessage.VALID_INPUT
+
+    @traced('bcj.get_clusters')
+    @authenticate_user
+    async def get_clusters(self, user_id: str) -> Tuple[BCJStatus, Union[dict,BCJMessage]]:
+        """
+        The stored near-duplicate clusters of `user_id`
+        Arguments
+        ---------
+            user_id: str
+                Indentification number of the user: must exist in the database
+        Returns
+        -------
+        BCJStatus, dict with 'threshold', 'seq', 'computed_at', 'clusters', lists of ids,
+        and 'stale', whether the user's bugs changed since
+        """
+        run = await self._database.fetch_clusters(user_id)
+        if run is None:
+            return BCJStatus.NOT_FOUND, BCJMessage.NO_CLUSTERS
+        run['stale'] = run['seq'] != self.user_manager[user_id].seq
+        return BCJStatus.OK, run
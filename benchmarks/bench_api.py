@@ -0,0 +1,215 @@
+"""
+@author natidemis
+October 2026
+
+Benchmark for the request hot paths of `BCJAIapi`: startup `initalize`,
+`add_bug`, `add_batch`, `get_similar_bugs_k` and `remove_bug`.
+
+Runs offline with a stub encoder and the in-memory `MemoryDatabase`, or
+against Postgres (`DATABASE_URL` in '.env', the database is reset!) with
+`--postgres`. Reports p50/p95/p99 latency and throughput per operation and
+stores the results as json so runs can be compared between commits.
+
+Usage:
+    python -m benchmarks.bench_api --users 10 --bugs 1000 --concurrency 8
+    python -m benchmarks.bench_api --compare benchmarks/results/<commit>.json
+"""
+
+import os
+import time
+import json
+import asyncio
+import argparse
+import hashlib
+import platform
+import subprocess
+from typing import Awaitable, Callable, List
+import numpy as np
+from Misc.db import Database
+from Misc.models import Encoder, registry
+from bcj_ai import BCJAIapi
+from benchmarks.memory_db import MemoryDatabase
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+WORDS = ('login page crash button slow error save upload search menu click form '
+        'scroll image loading freeze text field font color link missing report').split()
+
+
+class StubModel:
+    """
+    Stands in for the encoder backend, maps each sentence matrix to a fixed vector
+    """
+
+    def __init__(self, dim: int, cost: float):
+        self.dim = dim
+        self.cost = cost
+
+    def predict(self, x) -> np.ndarray:
+        if self.cost:
+            time.sleep(self.cost * len(x))
+        return np.stack([np.random.default_rng(
+            int.from_bytes(hashlib.blake2b(row.encode(), digest_size=8).digest(), 'little')
+            ).random(self.dim) for row in x])
+
+
+class StubW2V:
+    """
+    Stands in for the word embedder, passes the sentences through
+    """
+
+    @staticmethod
+    def get_sentence_matrix(sentences):
+        return sentences
+
+
+def sentence(rng: np.random.Generator) -> str:
+    """ Random bug report text """
+    return ' '.join(rng.choice(WORDS, size=rng.integers(5, 30)))
+
+
+def percentiles(latencies: List[float], elapsed: float) -> dict:
+    """
+    Summary of `latencies` in milliseconds and the throughput over `elapsed` seconds
+    """
+    ms = np.asarray(latencies) * 1000
+    return {'n': len(ms),
+            'p50': float(np.percentile(ms, 50)),
+            'p95': float(np.percentile(ms, 95)),
+            'p99': float(np.percentile(ms, 99)),
+            'throughput': len(ms) / elapsed if elapsed else 0.0}
+
+
+async def run(calls: List[Callable[[], Awaitable]], concurrency: int) -> dict:
+    """
+    Await every call in `calls` with at most `concurrency` in flight.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def timed(call):
+        async with semaphore:
+            start = time.perf_counter()
+            await call()
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(timed(call) for call in calls))
+    return percentiles(latencies, time.perf_counter() - start)
+
+
+async def benchmark(args) -> dict:
+    """
+    Run every scenario, returns the results per operation
+    """
+    rng = np.random.default_rng(args.seed)
+    registry.register(Encoder(StubW2V(), StubModel(args.dim, args.encoder_cost)))
+    if args.postgres:
+        database = await Database.connect_pool()
+    else:
+        database = MemoryDatabase(latency=args.db_latency)
+    await database.setup_database(reset=True)
+    await database.warm_up()
+    users = [str(i) for i in range(args.users)]
+    results = {}
+
+    #populate the database through add_batch, one batch per user
+    ai = await BCJAIapi.initalize(database)
+    results['add_batch'] = await run([
+        lambda user_id=user_id: ai.add_batch(user_id=user_id, data=[
+            {'summary': '', 'description': sentence(rng),
+                'structured_info': {'id': i, 'batch_id': 1, 'date': '2021-06-01'}}
+            for i in range(args.bugs)])
+        for user_id in users], args.concurrency)
+
+    start = time.perf_counter()
+    ai = await BCJAIapi.initalize(database)
+    results['initalize'] = percentiles([time.perf_counter() - start], time.perf_counter() - start)
+
+    results['get_similar_bugs_k'] = await run([
+        lambda: ai.get_similar_bugs_k(user_id=str(rng.choice(users)),
+                                    summary=sentence(rng), k=args.k)
+        for _ in range(args.requests)], args.concurrency)
+
+    next_id = args.bugs
+    added = []
+    calls = []
+    for _ in range(args.requests):
+        user_id = str(rng.choice(users))
+        added.append((user_id, next_id))
+        calls.append(lambda user_id=user_id, id=next_id: ai.add_bug(
+            user_id=user_id, summary='', description=sentence(rng),
+            structured_info={'id': id, 'date': '2021-06-01'}))
+        next_id += 1
+    results['add_bug'] = await run(calls, args.concurrency)
+
+    results['remove_bug'] = await run([
+        lambda user_id=user_id, id=id: ai.remove_bug(user_id=user_id, id=id)
+        for user_id, id in added], args.concurrency)
+
+    await database.close_pool()
+    return results
+
+
+def git_commit() -> str:
+    """ Current commit hash, 'unknown' outside a git checkout """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                            text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def report(results: dict, baseline: dict = None) -> None:
+    """
+    Print `results`, with the relative p50/p95 change against `baseline` if given
+    """
+    header = '{:<20}{:>8}{:>10}{:>10}{:>10}{:>12}'.format(
+        'operation', 'n', 'p50 ms', 'p95 ms', 'p99 ms', 'ops/s')
+    print(header + ('{:>10}{:>10}'.format('p50 Δ', 'p95 Δ') if baseline else ''))
+    for name, r in results.items():
+        line = '{:<20}{:>8}{:>10.2f}{:>10.2f}{:>10.2f}{:>12.1f}'.format(
+            name, r['n'], r['p50'], r['p95'], r['p99'], r['throughput'])
+        if baseline and name in baseline:
+            line += ''.join('{:>+9.1f}%'.format((r[p] / baseline[name][p] - 1) * 100)
+                if baseline[name][p] else '{:>10}'.format('-') for p in ('p50', 'p95'))
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the BCJAIapi hot paths')
+    parser.add_argument('--users', type=int, default=10, help='number of tenants')
+    parser.add_argument('--bugs', type=int, default=1000, help='bugs per tenant')
+    parser.add_argument('--requests', type=int, default=500, help='requests per operation')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--dim', type=int, default=128, help='embedding dimension')
+    parser.add_argument('--encoder-cost', type=float, default=0.0,
+                        help='simulated encoder seconds per sentence')
+    parser.add_argument('--db-latency', type=float, default=0.0,
+                        help='simulated seconds per query of the in-memory database')
+    parser.add_argument('--postgres', action='store_true',
+                        help='use the database at DATABASE_URL instead, it is reset')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='results file, by commit if not given')
+    parser.add_argument('--compare', default=None, help='results file to compare against')
+    args = parser.parse_args()
+
+    results = asyncio.run(benchmark(args))
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)['results']
+    report(results, baseline)
+
+    output = args.output or os.path.join(RESULTS_DIR, '{}.json'.format(git_commit()))
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({'commit': git_commit(),
+                'python': platform.python_version(),
+                'params': {k: v for k, v in vars(args).items() if k not in ('output', 'compare')},
+                'results': results}, f, indent=2)
+    print('Results written to {}'.format(output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+@author natidemis
+October 2026
+
+Latency benchmark for the inference backends in `Misc/inference.py`.
+Compares the keras model with its numpy export on random sentence matrices.
+
+Usage:
+    python -m benchmarks.bench_inference --model Models --numpy Models.npz --batch 1 32 256
+"""
+
+import time
+import argparse
+import numpy as np
+from Misc.inference import KerasBackend, NumpyBackend
+
+
+def time_backend(backend, x: np.ndarray, repeat: int) -> np.ndarray:
+    """
+    Run `backend.predict(x)` `repeat` times after a warm-up call.
+    Returns
+    -------
+    array of latencies in seconds
+    """
+    backend.predict(x)
+    latencies = np.empty(repeat)
+    for i in range(repeat):
+        start = time.perf_counter()
+        backend.predict(x)
+        latencies[i] = time.perf_counter() - start
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the inference backends')
+    parser.add_argument('--model', default='Models')
+    parser.add_argument('--numpy', default='Models.npz')
+    parser.add_argument('--batch', type=int, nargs='+', default=[1, 32, 256])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    backends = {'numpy': NumpyBackend(args.numpy)}
+    print('numpy load: {:.3f}s'.format(time.perf_counter() - start))
+    start = time.perf_counter()
+    backends['keras'] = KerasBackend(args.model)
+    print('keras load (incl. tensorflow import): {:.3f}s'.format(time.perf_counter() - start))
+
+    rng = np.random.default_rng(0)
+    shape = backends['numpy'].input_shape[1:]
+    print('{:<8}{:>8}{:>12}{:>12}'.format('backend', 'batch', 'p50 ms', 'p95 ms'))
+    for batch in args.batch:
+        x = rng.normal(size=(batch,) + tuple(shape)).astype(np.float32)
+        for name, backend in backends.items():
+            latencies = time_backend(backend, x, args.repeat) * 1000
+            print('{:<8}{:>8}{:>12.2f}{:>12.2f}'.format(
+                name, batch, np.percentile(latencies, 50), np.percentile(latencies, 95)))
+
+
+if __name__ == '__main__':
+    main()
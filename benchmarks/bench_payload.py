@@ -0,0 +1,76 @@
+"""
+@author natidemis
+October 2026
+
+Benchmark for request validation and response encoding by payload size.
+
+Validates '/batch' payloads of each size with the full pydantic models and
+with the light `BatchItems` validation, and encodes `get_similar_bugs_k`
+responses of each size as the stdlib json of Python lists (the previous
+`JSONResponse` path) and with `Misc.serialization.dumps`.
+
+Usage:
+    python -m benchmarks.bench_payload --sizes 100 1000 10000
+"""
+
+import json
+import time
+import argparse
+from typing import Callable, List
+import numpy as np
+from pydantic import parse_obj_as
+from Misc.datamodels import BatchItems, ValidBatchModel, valid_date
+from Misc.serialization import dumps, orjson
+
+
+def batch_payload(size: int, rng: np.random.Generator) -> List[dict]:
+    """
+    Parsed json of a '/batch' request with `size` bugs over a month of dates
+    """
+    return [{'summary': 'summary {}'.format(i),
+            'description': 'description of bug {}'.format(i),
+            'structured_info': {'id': i, 'batch_id': 1,
+                                'date': '2021-06-{:02d}'.format(int(rng.integers(1, 31)))}}
+            for i in range(size)]
+
+
+def best_of(fn: Callable, repeat: int) -> float:
+    """
+    Fastest of `repeat` runs of `fn` in milliseconds
+    """
+    times = []
+    for _ in range(repeat):
+        valid_date.cache_clear()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark validation and encoding by payload size')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    rng = np.random.default_rng(args.seed)
+
+    print('json encoder: {}'.format('orjson' if orjson is not None else 'json'))
+    print('{:<10}{:>16}{:>16}{:>16}{:>16}'.format(
+        'size', 'full ms', 'light ms', 'lists ms', 'numpy ms'))
+    for size in args.sizes:
+        payload = batch_payload(size, rng)
+        response = {'id': rng.integers(0, 1 << 40, size), 'dist': rng.random(size)}
+        print('{:<10}{:>16.2f}{:>16.2f}{:>16.2f}{:>16.2f}'.format(
+            size,
+            best_of(lambda: [item.dict() for item in
+                            parse_obj_as(List[ValidBatchModel], payload)], args.repeat),
+            best_of(lambda: BatchItems.validate(payload), args.repeat),
+            best_of(lambda: json.dumps({'id': response['id'].tolist(),
+                                        'dist': response['dist'].tolist()}).encode('utf-8'),
+                    args.repeat),
+            best_of(lambda: dumps(response), args.repeat)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,262 @@
+"""
+@author natidemis
+October 2026
+
+In-memory stand-in for `Misc.db.Database` used to benchmark `BCJAIapi`
+without a Postgres server. Implements the same methods and errors, with an
+optional simulated round trip latency per query.
+"""
+
+from __future__ import annotations
+import time
+import asyncio
+from datetime import datetime, timezone
+from typing import Dict, List, Sequence, Tuple, Union
+from Misc.db import (Change, NotFoundError, DuplicateKeyError, NoUpdatesError,
+                    VersionMismatchError)
+
+
+class MemoryDatabase:
+    """
+    Dict backed implementation of the `Database` interface
+    """
+
+    def __init__(self, latency: float = 0.0):
+        """
+        Arguments
+        ---------
+        latency: float
+            seconds to sleep per query, simulating a database round trip
+        """
+        self.latency = latency
+        self.users: Dict[str, str] = {}
+        self.vectors: Dict[str, Dict[int, dict]] = {}
+        self.staged: Dict[tuple, Dict[int, dict]] = {}
+        self.log_seqs: Dict[str, int] = {}
+        #(time logged, change) per user
+        self.changes: Dict[str, List[tuple]] = {}
+        self.clusters: Dict[str, dict] = {}
+
+    async def _round_trip(self) -> None:
+        await asyncio.sleep(self.latency)
+
+    @classmethod
+    async def connect_pool(cls) -> MemoryDatabase:
+        return cls()
+
+    async def close_pool(self) -> None:
+        pass
+
+    async def warm_up(self) -> None:
+        pass
+
+    async def setup_database(self, reset: bool = False) -> bool:
+        if reset:
+            self.users.clear()
+            self.vectors.clear()
+            self.staged.clear()
+            self.log_seqs.clear()
+            self.changes.clear()
+            self.clusters.clear()
+        return True
+
+    def _log(self, user_id: str, entries: Sequence[tuple]) -> List[Change]:
+        seq = self.log_seqs[user_id]
+        changes = [Change(user_id, seq + i, op, id, embeddings)
+            for i, (op, id, embeddings) in enumerate(entries, start=1)]
+        self.log_seqs[user_id] = seq + len(changes)
+        now = time.time()
+        self.changes[user_id].extend((now, change) for change in changes)
+        return changes
+
+    def _version(self, user_id: str, model_version: Union[str, None]) -> str:
+        if user_id not in self.users:
+            raise NotFoundError('User not in database', user_id)
+        version = self.users[user_id]
+        if model_version is not None and version != model_version:
+            raise VersionMismatchError('User is on another model version',
+                                    (user_id, version, model_version))
+        return version
+
+    async def insert(self, id: int, user_id: str, embeddings, batch_id: int = None, #pylint: disable=redefined-builtin
+                    model_version: str = None, sentence: str = None) -> List[Change]:
+        await self._round_trip()
+        version = self._version(user_id, model_version)
+        if id in self.vectors[user_id]:
+            raise DuplicateKeyError('Duplicate key error', (id, user_id))
+        self.vectors[user_id][id] = {'id': id, 'embeddings': list(embeddings),
+            'batch_id': batch_id, 'model_version': version, 'sentence': sentence}
+        return self._log(user_id, [('U', id, list(embeddings))])
+
+    async def insert_user(self, user_id: str, model_version: str = 'default') -> None:
+        await self._round_trip()
+        if user_id in self.users:
+            raise DuplicateKeyError('Duplicate key for %s' % user_id, user_id)
+        self.users[user_id] = model_version
+        self.vectors[user_id] = {}
+        self.log_seqs[user_id] = 0
+        self.changes[user_id] = []
+
+    async def insert_batch(self, data: Sequence[tuple], model_version: str = None) -> List[Change]:
+        await self._round_trip()
+        versions = {row[1]: self._version(row[1], model_version) for row in data}
+        ids = [(row[1], row[0]) for row in data]
+        if len(set(ids)) != len(ids) or any(id in self.vectors[user_id] for user_id, id in ids):
+            raise DuplicateKeyError('Duplicate key error')
+        for row in data:
+            self.vectors[row[1]][row[0]] = {'id': row[0], 'embeddings': list(row[2]),
+                'batch_id': row[3], 'model_version': versions[row[1]],
+                'sentence': row[4] if len(row) > 4 else None}
+        changes = []
+        for user_id in sorted(versions):
+            changes.extend(self._log(user_id, [('U', row[0], list(row[2]))
+                for row in data if row[1] == user_id]))
+        return changes
+
+    async def fetch_all(self, user_id: str, err: bool = True) -> Union[None, List[dict]]:
+        await self._round_trip()
+        rows = list(self.vectors.get(user_id, {}).values())
+        if err and not rows:
+            raise NotFoundError("Nothing in the Database", rows)
+        if not rows:
+            return None
+        return [{'id': row['id'], 'embeddings': row['embeddings'], 'batch_id': row['batch_id']}
+            for row in rows]
+
+    async def update(self, id: int, user_id: str, embeddings=None, batch_id: int = None, #pylint: disable=redefined-builtin
+                    model_version: str = None, sentence: str = None) -> List[Change]:
+        await self._round_trip()
+        if embeddings is not None:
+            try:
+                self._version(user_id, model_version)
+            except NotFoundError as e:
+                raise NoUpdatesError('No changes were made to the db', (id, user_id)) from e
+        row = self.vectors.get(user_id, {}).get(id)
+        if row is None:
+            raise NoUpdatesError('No changes were made to the db', (id, user_id, batch_id))
+        if embeddings is not None:
+            row['embeddings'], row['sentence'] = list(embeddings), sentence
+        if batch_id is not None or embeddings is None:
+            row['batch_id'] = batch_id
+        if embeddings is None:
+            return []
+        return self._log(user_id, [('U', id, row['embeddings'])])
+
+    async def update_many(self, user_id: str, data: Sequence[tuple],
+                        model_version: str = None) -> tuple:
+        await self._round_trip()
+        try:
+            self._version(user_id, model_version if any(row[1] is not None for row in data)
+                        else None)
+        except NotFoundError as e:
+            raise NoUpdatesError('No changes were made to the db', user_id) from e
+        rows, updated, entries = self.vectors[user_id], [], []
+        for id, embeddings, batch_id, sentence in data:
+            row = rows.get(id)
+            if row is None:
+                continue
+            updated.append(id)
+            if embeddings is not None:
+                row['embeddings'], row['sentence'] = [list(embeddings)], sentence
+                entries.append(('U', id, row['embeddings']))
+            if batch_id is not None:
+                row['batch_id'] = batch_id
+        if not updated:
+            raise NoUpdatesError('No changes were made to the db', user_id)
+        return updated, self._log(user_id, entries)
+
+    async def delete(self, id: int, user_id: str) -> List[Change]: #pylint: disable=redefined-builtin
+        await self._round_trip()
+        if self.vectors.get(user_id, {}).pop(id, None) is None:
+            raise NoUpdatesError('Nothing was changed in the database', (id, user_id))
+        return self._log(user_id, [('D', id, None)])
+
+    async def delete_batch(self, batch_id: int, user_id: str) -> List[Change]:
+        await self._round_trip()
+        rows = self.vectors.get(user_id, {})
+        ids = [id for id, row in rows.items() if row['batch_id'] == batch_id]
+        if not ids:
+            raise NoUpdatesError('Nothing was changed in the database', (batch_id, user_id))
+        for id in ids:
+            del rows[id]
+        return self._log(user_id, [('D', id, None) for id in ids])
+
+    async def delete_many(self, ids: Sequence[int], user_id: str) -> List[Change]:
+        await self._round_trip()
+        rows = self.vectors.get(user_id, {})
+        removed = [id for id in dict.fromkeys(ids) if rows.pop(id, None) is not None]
+        if not removed:
+            raise NoUpdatesError('Nothing was changed in the database', (ids, user_id))
+        return self._log(user_id, [('D', id, None) for id in removed])
+
+    async def fetch_users(self) -> List[str]:
+        await self._round_trip()
+        if not self.users:
+            raise NotFoundError("Nothing in the Database")
+        return list(self.users)
+
+    async def fetch_model_versions(self) -> Dict[str, str]:
+        await self._round_trip()
+        if not self.users:
+            raise NotFoundError("Nothing in the Database")
+        return dict(self.users)
+
+    async def fetch_snapshot(self, user_id: str) -> Tuple[Union[None, List[dict]], int, str]:
+        version = self._version(user_id, None)
+        return await self.fetch_all(user_id, err=False), self.log_seqs[user_id], version
+
+    async def fetch_changes(self, user_id: str, after_seq: int) -> List[Change]:
+        await self._round_trip()
+        return [change for _, change in self.changes.get(user_id, []) if change.seq > after_seq]
+
+    async def fetch_log_seqs(self) -> Dict[str, int]:
+        await self._round_trip()
+        return dict(self.log_seqs)
+
+    async def prune_changes(self, retention: float) -> int:
+        await self._round_trip()
+        cutoff, pruned = time.time() - retention, 0
+        for user_id, changes in self.changes.items():
+            kept = [entry for entry in changes if entry[0] >= cutoff]
+            pruned += len(changes) - len(kept)
+            self.changes[user_id] = kept
+        return pruned
+
+    async def fetch_sentences(self, user_id: str, after_id: int, limit: int) -> List[tuple]:
+        await self._round_trip()
+        ids = sorted(id for id in self.vectors.get(user_id, {}) if id > after_id)[:limit]
+        return [(id, self.vectors[user_id][id]['sentence']) for id in ids]
+
+    async def stage_embeddings(self, user_id: str, model_version: str, data: Sequence[tuple]) -> None:
+        await self._round_trip()
+        staged = self.staged.setdefault((user_id, model_version), {})
+        for id, embeddings, sentence in data:
+            staged[id] = {'embeddings': list(embeddings), 'sentence': sentence}
+
+    async def cutover(self, user_id: str, model_version: str) -> List[tuple]:
+        await self._round_trip()
+        staged = self.staged.get((user_id, model_version), {})
+        rows = self.vectors.get(user_id, {})
+        missing = [(id, row['sentence']) for id, row in rows.items()
+            if id not in staged or staged[id]['sentence'] != row['sentence']]
+        if missing:
+            return missing
+        for id, row in rows.items():
+            row['embeddings'], row['model_version'] = staged[id]['embeddings'], model_version
+        self.users[user_id] = model_version
+        self._log(user_id, [('R', None, None)])
+        for key in [key for key in self.staged if key[0] == user_id]:
+            del self.staged[key]
+        return []
+
+    async def save_clusters(self, user_id: str, threshold: float, seq: int,
+                            clusters: Sequence[Sequence[int]]) -> None:
+        await self._round_trip()
+        self.clusters[user_id] = {'threshold': float(threshold), 'seq': seq,
+            'computed_at': datetime.now(timezone.utc).isoformat(),
+            'clusters': sorted(sorted(cluster) for cluster in clusters)}
+
+    async def fetch_clusters(self, user_id: str) -> Union[None, dict]:
+        await self._round_trip()
+        run = self.clusters.get(user_id)
+        return None if run is None else {**run, 'clusters': [list(c) for c in run['clusters']]}
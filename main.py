@@ -12,24 +12,51 @@ API for AI web service
 
 import os
 import sys
+import time
+import asyncio
+from typing import AsyncIterator
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException, Depends, Request
-from fastapi.responses import JSONResponse
-from bcj_ai import BCJMessage, BCJAIapi
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from bcj_ai import BCJMessage, BCJStatus, BCJAIapi
 from Misc.datamodels import (BatchDataModel,
                         GetDataModel,
                         MainDataModel,
                         DeleteDataModel,
-                        DeleteBatchDataModel)
+                        DeleteBatchDataModel,
+                        DeleteManyDataModel,
+                        UpdateManyDataModel,
+                        ReembedDataModel,
+                        ClusterDataModel)
 from Misc.db import Database, NotFoundError
 from Misc.log import logger
+from Misc.serialization import JSON, NDJSON, NEIGHBOURS, dumps, negotiate, encode_neighbours
+from Misc.models import registry
+from Misc.metrics import REGISTRY, REQUEST_SECONDS
+from Misc.tracing import start_trace, activate
+from Misc.profiler import LoopLagMonitor, ProfilerBusyError, sample_stacks
 
 load_dotenv()
 secret_token = os.getenv('SECRET_TOKEN')
-app = FastAPI()
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse encoding NumPy arrays directly, with orjson if installed
+    """
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+app = FastAPI(default_response_class=FastJSONResponse)
 
 AICONTROLLER: BCJAIapi #pylint: disable=invalid-name
 DATABASE: Database #pylint: disable=invalid-name
+LOOP_MONITOR = LoopLagMonitor()
+
+#Load the models once in the gunicorn master when started with '--preload'
+if os.getenv('PRELOAD_MODELS') == 'True':
+    registry.load()
 
 
 def verify_token(req: Request):
@@ -45,12 +72,51 @@ def verify_token(req: Request):
             detail='Unauthorized'
         )
 
+@app.middleware('http')
+async def trace_request(request: Request, call_next):
+    """
+    Run sampled requests in a root span, the trace id is returned in 'traceparent'
+    """
+    root = start_trace('{} {}'.format(request.method, request.url.path),
+                        request.headers.get('traceparent'))
+    if root is None:
+        return await call_next(request)
+    with activate(root):
+        response = await call_next(request)
+        route = request.scope.get('route')
+        if route is not None:
+            root.name = '{} {}'.format(request.method, route.path)
+        root.set(status=response.status_code)
+        response.headers['traceparent'] = root.traceparent
+        return response
+
+
+@app.middleware('http')
+async def record_request_time(request: Request, call_next):
+    """
+    Observe the seconds spent on each request by route template
+    """
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get('route')
+        REQUEST_SECONDS.observe(time.perf_counter() - start, request.method,
+                                route.path if route is not None else 'unmatched', status)
+
+
 @app.on_event("startup")
 async def startup_event():
     """
     Initialize database and all relevant objects
     """
     logger.info('Starting app..')
+    LOOP_MONITOR.start()
+    #Load the models in the background, requests needing them wait for it
+    registry.warm_up()
     reset = os.getenv('RESET','RESET=True not in env')
 
     global DATABASE #pylint: disable=global-statement,invalid-name
@@ -60,10 +126,12 @@ async def startup_event():
     #Only start up if database has been successfully setup
     if not setup:
         sys.exit()
+    await DATABASE.warm_up()
 
     global AICONTROLLER #pylint: disable=global-statement,invalid-name
     AICONTROLLER = await BCJAIapi.initalize(DATABASE)
-
+    #Pick up writes of the other workers from the change log
+    AICONTROLLER.start_sync()
 
 
 @app.on_event("shutdown")
@@ -71,12 +139,80 @@ async def shut_down():
     """
     Close nessary variables
     """
+    LOOP_MONITOR.stop()
+    AICONTROLLER.stop_sync()
     await DATABASE.close_pool()
     logger.info("Server shutting down..")
 
 
+@app.get('/health', status_code=200)
+async def health():
+    """
+    Liveness check, answers as soon as the server accepts requests
+    """
+    return {'status': 'ok'}
+
+
+@app.get('/ready', status_code=200)
+async def ready():
+    """
+    Readiness check, 503 until the models have been loaded
+    """
+    if not registry.ready:
+        return FastJSONResponse(content={'status': 'loading'}, status_code=503)
+    return {'status': 'ready'}
+
+
+@app.get('/metrics', status_code=200)
+async def metrics(authorized: bool = Depends(verify_token)):
+    """
+    Metrics of this worker in the Prometheus text exposition format
+    """
+    DATABASE.record_pool_metrics()
+    return PlainTextResponse(REGISTRY.render(), media_type='text/plain; version=0.0.4')
+
+
+@app.get('/admin/profile', status_code=200)
+async def profile(seconds: float = 10.0, authorized: bool = Depends(verify_token)):
+    """
+    Sample the stacks of every thread of this worker for `seconds` (at most 60).
+    Returns
+    -------
+    Collapsed stacks for flamegraph.pl or speedscope, 409 if a profile is already running
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        stacks = await loop.run_in_executor(None, sample_stacks, seconds)
+    except ProfilerBusyError:
+        raise HTTPException(status_code=409, detail='A profile is already running')
+    return PlainTextResponse(stacks)
+
+
+@app.get('/admin/users', status_code=200)
+async def users(limit: int = 20, authorized: bool = Depends(verify_token)):
+    """
+    Users, indexed bugs and index memory of this worker, with the entries
+    of the `limit` most recently used users
+    """
+    recent = list(AICONTROLLER.user_manager.least_recent())[-limit:] if limit > 0 else []
+    return {'users': AICONTROLLER.user_manager.stats(),
+            'shared': AICONTROLLER.shared.stats(),
+            'recent': {user_id: entry.as_dict() for user_id, entry in reversed(recent)}}
+
+
+async def ndjson_pages(pages: AsyncIterator) -> AsyncIterator[bytes]:
+    """
+    Json lines of ranked (distances, ids) pages, each with the rank of its first bug
+    """
+    rank = 0
+    async for dists, ids in pages:
+        yield dumps({'rank': rank, 'id': ids, 'dist': dists}) + b'\n'
+        rank += len(ids)
+
+
 @app.post('/getbug', status_code=200)
-async def k_most_similar_bugs(data: GetDataModel, authorized: bool = Depends(verify_token)):
+async def k_most_similar_bugs(data: GetDataModel, request: Request,
+                            authorized: bool = Depends(verify_token)):
     """
     GET method that fetches the k UPs that are most similar to the UP
     Arguments
@@ -84,6 +220,9 @@ async def k_most_similar_bugs(data: GetDataModel, authorized: bool = Depends(ver
     data - GetDataModel
         pydantic.BaseModel object that validates the json
         with the request.
+    request - Request
+        its 'Accept' header selects json, streamed ndjson or a binary format,
+        see 'Misc/serialization.py'
     authorized - Depends
         Validates authorized access via 'verify_token'
     Returns
@@ -93,15 +232,34 @@ async def k_most_similar_bugs(data: GetDataModel, authorized: bool = Depends(ver
     """
 
 
+    media_type = negotiate(request.headers.get('accept', ''))
+    radius = data.radius is not None
+    if radius and media_type == NEIGHBOURS:
+        #the frames have no room for 'truncated'
+        raise HTTPException(status_code=406, detail=BCJMessage.NO_BINARY_RADIUS.value)
+    #the bugs within a radius are a single page, sent with 'truncated'
+    find = AICONTROLLER.stream_similar_bugs_k if media_type == NDJSON and not radius \
+        else AICONTROLLER.get_similar_bugs_k
     try:
-        bugs = await AICONTROLLER.get_similar_bugs_k(**data.dict())
+        bugs = await find(**data.dict())
     except ValueError :
         raise HTTPException(status_code=404, detail=BCJMessage.NO_USER.value)
     except AssertionError:
         raise HTTPException(status_code=400,detail=BCJMessage.UNFULFILLED_REQ.value)
     except NotFoundError:
         raise HTTPException(status_code=404, detail= BCJMessage.EMPTY_TREE.value)
-    return JSONResponse(content=bugs[1], status_code=bugs[0].value)
+    if media_type == NDJSON and bugs[0] == BCJStatus.OK:
+        if radius:
+            return Response(content=dumps({'rank': 0, **bugs[1]}) + b'\n', media_type=NDJSON,
+                            headers={'Vary': 'Accept'})
+        return StreamingResponse(ndjson_pages(bugs[1]), media_type=NDJSON,
+                                headers={'Vary': 'Accept'})
+    if media_type not in (JSON, NDJSON) and bugs[0] == BCJStatus.OK:
+        return Response(content=encode_neighbours(bugs[1]['id'], bugs[1]['dist'], media_type,
+                                                bugs[1].get('truncated')),
+                        media_type=media_type, headers={'Vary': 'Accept'})
+    return FastJSONResponse(content=bugs[1], status_code=bugs[0].value,
+                            headers={'Vary': 'Accept'})
 
 
 
@@ -129,7 +287,7 @@ async def insert_bugs(data: MainDataModel, authorized: bool = Depends(verify_tok
         raise HTTPException(status_code=404, detail= BCJMessage.NO_USER.value)
     except AssertionError:
         raise HTTPException(status_code=404, detail= BCJMessage.UNFULFILLED_REQ.value)
-    return JSONResponse(content={'detail': message.value}, status_code=status.value)
+    return FastJSONResponse(content={'detail': message.value}, status_code=status.value)
 
 @app.patch('/bug', status_code= 200)
 async def update_bug(data: MainDataModel, authorized: bool = Depends(verify_token)):
@@ -151,7 +309,7 @@ async def update_bug(data: MainDataModel, authorized: bool = Depends(verify_toke
         status, message = await AICONTROLLER.update_bug(**data.dict())
     except ValueError:
         raise HTTPException(status_code=404, detail= BCJMessage.NO_USER.value)
-    return JSONResponse(content={'detail': message.value}, status_code=status.value)
+    return FastJSONResponse(content={'detail': message.value}, status_code=status.value)
 
 
 @app.delete('/bug', status_code= 200)
@@ -173,7 +331,51 @@ async def delete_bug(data: DeleteDataModel, authorized: bool = Depends(verify_to
         status, message = await AICONTROLLER.remove_bug(**data.dict())
     except ValueError:
         raise HTTPException(status_code=404, detail= BCJMessage.NO_USER.value)
-    return JSONResponse(content={'detail': message.value}, status_code=status.value)
+    return FastJSONResponse(content={'detail': message.value}, status_code=status.value)
+
+
+@app.patch('/bug/batch', status_code= 200)
+async def update_bugs(data: UpdateManyDataModel, authorized: bool = Depends(verify_token)):
+    """
+    Method for handling a patch request on '/bug/batch' for updating many bugs at once.
+    Arguments
+    ---------
+    data - UpdateManyDataModel
+        pydantic.BaseModel object that validates the json
+        with the request.
+    authorized - Depends
+        Validates authorized access via 'verify_token'
+    Returns
+    -------
+    The ids that were 'updated' and the ids 'not_found' for the user, and status code.
+    """
+    try:
+        status, result = await AICONTROLLER.update_bugs(**data.dict())
+    except ValueError:
+        raise HTTPException(status_code=404, detail= BCJMessage.NO_USER.value)
+    return FastJSONResponse(content=result, status_code=status.value)
+
+
+@app.delete('/bug/batch', status_code= 200)
+async def delete_bugs(data: DeleteManyDataModel, authorized: bool = Depends(verify_token)):
+    """
+    Method for handling a delete request on '/bug/batch' for deleting bugs by their ids.
+    Arguments
+    ---------
+    data - DeleteManyDataModel
+        pydantic.BaseModel object that validates the json
+        with the request.
+    authorized - Depends
+        Validates authorized access via 'verify_token'
+    Returns
+    -------
+    The ids that were 'removed' and the ids 'not_found' for the user, and status code.
+    """
+    try:
+        status, result = await AICONTROLLER.remove_bugs(**data.dict())
+    except ValueError:
+        raise HTTPException(status_code=404, detail= BCJMessage.NO_USER.value)
+    return FastJSONResponse(content=result, status_code=status.value)
 
 
 @app.delete('/batch', status_code= 200)
@@ -196,7 +398,7 @@ async def delete_batch(data: DeleteBatchDataModel, authorized: bool = Depends(ve
         status, message = await AICONTROLLER.remove_batch(**data.dict())
     except ValueError:
         raise HTTPException(status_code=404, detail= BCJMessage.NO_USER.value)
-    return JSONResponse(content={'detail': message.value}, status_code=status.value)
+    return FastJSONResponse(content={'detail': message.value}, status_code=status.value)
 
 
 @app.post('/batch', status_code= 200)
@@ -217,11 +419,87 @@ async def insert_batch(data: BatchDataModel, authorized: bool = Depends(verify_t
     """
 
     try:
-        status, message = await AICONTROLLER.add_batch(**data.dict())
+        status, message = await AICONTROLLER.add_batch(user_id=data.user_id, data=data.items())
     except ValueError:
         raise HTTPException(status_code=404, detail= BCJMessage.NO_USER.value)
     except AssertionError:
         raise HTTPException(status_code=400,
             detail= ('Each example must contain same "batch_id" '
             'and either summary or description must be a valid non-empty string'))
-    return JSONResponse(content={'detail': message.value}, status_code=status.value)
\ No newline at end of file
+    return FastJSONResponse(content={'detail': message.value}, status_code=status.value)
+
+
+@app.post('/reembed', status_code= 200)
+async def reembed(data: ReembedDataModel, authorized: bool = Depends(verify_token)):
+    """
+    Method for handling a post request on '/reembed'.
+    Re-embeds all bugs of a user with another model version in the background,
+    the user keeps being served from its current embeddings until it completes.
+    Arguments
+    ---------
+    data - ReembedDataModel
+        pydantic.BaseModel object that validates the json
+        with the request.
+    authorized - Depends
+        Validates authorized access via 'verify_token'
+    Returns
+    -------
+    Message with brief explanation and status code
+    """
+
+    try:
+        status, message = await AICONTROLLER.start_reembed(**data.dict())
+    except ValueError:
+        raise HTTPException(status_code=404, detail= BCJMessage.NO_USER.value)
+    return FastJSONResponse(content={'detail': message.value}, status_code=status.value)
+
+
+@app.post('/clusters', status_code= 200)
+async def cluster_bugs(data: ClusterDataModel, authorized: bool = Depends(verify_token)):
+    """
+    Method for handling a post request on '/clusters'.
+    Finds the near-duplicate clusters of a user's bugs in the background,
+    they are fetched with a get request on '/clusters' once it completes.
+    Arguments
+    ---------
+    data - ClusterDataModel
+        pydantic.BaseModel object that validates the json
+        with the request.
+    authorized - Depends
+        Validates authorized access via 'verify_token'
+    Returns
+    -------
+    Message with brief explanation and status code
+    """
+
+    try:
+        status, message = await AICONTROLLER.start_clustering(**data.dict())
+    except ValueError:
+        raise HTTPException(status_code=404, detail= BCJMessage.NO_USER.value)
+    return FastJSONResponse(content={'detail': message.value}, status_code=status.value)
+
+
+@app.get('/clusters', status_code= 200)
+async def get_clusters(user_id: str, authorized: bool = Depends(verify_token)):
+    """
+    Method for handling a get request on '/clusters'.
+    Returns the stored near-duplicate clusters of a user.
+    Arguments
+    ---------
+    user_id - str
+        query parameter, the user whose clusters to return
+    authorized - Depends
+        Validates authorized access via 'verify_token'
+    Returns
+    -------
+    The clusters with the threshold and change log sequence number they were
+    computed with, or an error message & Status code
+    """
+
+    try:
+        status, result = await AICONTROLLER.get_clusters(user_id=user_id)
+    except ValueError:
+        raise HTTPException(status_code=404, detail= BCJMessage.NO_USER.value)
+    if status != BCJStatus.OK:
+        raise HTTPException(status_code=status.value, detail=result.value)
+    return FastJSONResponse(content=result, status_code=status.value)
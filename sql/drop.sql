@@ -1,6 +1,7 @@
-DROP INDEX IF EXISTS vectors_id;
-DROP INDEX IF EXISTS vectors_batch;
-DROP INDEX IF EXISTS vectors_unique;
-DROP INDEX IF EXISTS vectors_user_id;
+DROP TABLE IF EXISTS schema_migrations;
+DROP TABLE IF EXISTS Clusters;
+DROP TABLE IF EXISTS ClusterRuns;
+DROP TABLE IF EXISTS ChangeLog;
+DROP TABLE IF EXISTS StagedVectors;
 DROP TABLE IF EXISTS Vectors;
-DROP TABLE IF EXISTS Users;
\ No newline at end of file
+DROP TABLE IF EXISTS Users;
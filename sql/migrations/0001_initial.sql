@@ -0,0 +1,46 @@
+CREATE TABLE IF NOT EXISTS Users(
+    user_id varchar(128) primary key
+);
+CREATE TABLE IF NOT EXISTS Vectors(
+    id bigint not null,
+    user_id varchar(128) not null,
+    embeddings double precision[] not null,
+    batch_id bigint,
+    primary key (id, user_id),
+    CONSTRAINT fk_user
+        FOREIGN KEY (user_id)
+            REFERENCES Users(user_id)
+);
+CREATE INDEX IF NOT EXISTS vectors_id on Vectors(id);
+CREATE INDEX IF NOT EXISTS vectors_batch on Vectors(batch_id);
+CREATE INDEX IF NOT EXISTS vector_unique on Vectors(id,user_id);
+CREATE INDEX IF NOT EXISTS vectors_user_id on Vectors(user_id);
+CREATE INDEX IF NOT EXISTS users_idx on Users(user_id);
+ALTER TABLE Users ADD COLUMN IF NOT EXISTS model_version varchar(64) not null default 'default';
+ALTER TABLE Vectors ADD COLUMN IF NOT EXISTS model_version varchar(64) not null default 'default';
+ALTER TABLE Vectors ADD COLUMN IF NOT EXISTS sentence text;
+CREATE TABLE IF NOT EXISTS StagedVectors(
+    id bigint not null,
+    user_id varchar(128) not null,
+    model_version varchar(64) not null,
+    embeddings double precision[] not null,
+    sentence text,
+    primary key (user_id, model_version, id),
+    CONSTRAINT fk_user
+        FOREIGN KEY (user_id)
+            REFERENCES Users(user_id)
+);
+ALTER TABLE Users ADD COLUMN IF NOT EXISTS log_seq bigint not null default 0;
+CREATE TABLE IF NOT EXISTS ChangeLog(
+    user_id varchar(128) not null,
+    seq bigint not null,
+    op char(1) not null,
+    id bigint,
+    embeddings double precision[],
+    created_at timestamptz not null default now(),
+    primary key (user_id, seq),
+    CONSTRAINT fk_user
+        FOREIGN KEY (user_id)
+            REFERENCES Users(user_id)
+);
+CREATE INDEX IF NOT EXISTS changelog_created_at on ChangeLog(created_at);
@@ -0,0 +1,12 @@
+-- Every query on Vectors filters on user_id first: lead the primary key with it,
+-- so it serves fetching a user, single bug lookups and the paged re-embedding reads.
+ALTER TABLE Vectors DROP CONSTRAINT IF EXISTS vectors_pkey;
+ALTER TABLE Vectors ADD PRIMARY KEY (user_id, id);
+-- Duplicates of the primary keys, maintained on every insert for nothing
+DROP INDEX IF EXISTS vectors_id;
+DROP INDEX IF EXISTS vector_unique;
+DROP INDEX IF EXISTS vectors_user_id;
+DROP INDEX IF EXISTS users_idx;
+-- Batch deletes look a batch up within a user
+DROP INDEX IF EXISTS vectors_batch;
+CREATE INDEX IF NOT EXISTS vectors_user_batch on Vectors(user_id, batch_id);
@@ -0,0 +1,20 @@
+-- Near-duplicate clusters of a user's bugs, replaced by each clustering run.
+-- A cluster is named by its smallest bug id, bugs without duplicates have no row.
+CREATE TABLE IF NOT EXISTS ClusterRuns(
+    user_id varchar(128) primary key,
+    threshold double precision not null,
+    log_seq bigint not null,
+    computed_at timestamptz not null default now(),
+    CONSTRAINT fk_user
+        FOREIGN KEY (user_id)
+            REFERENCES Users(user_id)
+);
+CREATE TABLE IF NOT EXISTS Clusters(
+    user_id varchar(128) not null,
+    id bigint not null,
+    cluster_id bigint not null,
+    primary key (user_id, id),
+    CONSTRAINT fk_user
+        FOREIGN KEY (user_id)
+            REFERENCES Users(user_id)
+);
@@ -0,0 +1,17 @@
+"""
+@author natidemis
+October 2026
+
+Shared fixtures of the test modules.
+"""
+
+import pytest
+
+
+@pytest.fixture
+def database():
+    """
+    No database by default, 'pytest.ini' requires the fixture.
+    Modules testing against the database override it.
+    """
+    return None
@@ -22,6 +22,7 @@ import lorem
 import pytest
 import pandas as pd
 import asyncio
+import numpy as np
 
 myPath = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, myPath + '/../')
@@ -29,6 +30,9 @@ sys.path.insert(0, myPath + '/../')
 from bcj_ai import BCJAIapi, BCJStatus, BCJMessage
 
 from Misc.db import Database, NotFoundError
+from Misc.index import RADIUS_RTOL
+from Misc.shared_index import SharedIndex, TenantView
+from Misc.users import UserEntry, UserIndexRegistry
 ################
 ### FIXTURES ###
 ################
@@ -211,7 +215,7 @@ async def test_add_bug_no_desc_and_summ_available(ai,database, no_desc_and_summ)
     don't satisfy the 'bool' function.
     """
     await database.setup_database(reset=True)
-    ai.user_manager = dict()
+    ai.user_manager = UserIndexRegistry()
 
     for user_id, structured_info, summ, disc in no_desc_and_summ:
         try:
@@ -234,7 +238,8 @@ async def test_add_bug_duplicate_key(ai,duplicate_key_data,database,user_id):
         - Adding in an already existing key.
     """
     await database.setup_database(reset=True)
-    ai.user_manager = {user_id: {'kdtree': None,'lock': asyncio.BoundedSemaphore(1)} }
+    ai.user_manager = UserIndexRegistry()
+    ai.user_manager[user_id] = UserEntry(None, asyncio.BoundedSemaphore(1), 'default')
     await database.insert_user(user_id)
     await database.insert(id=1,user_id="1",embeddings=[1,1])
     for _user_id, structured_info, summ, disc in duplicate_key_data:
@@ -257,7 +262,7 @@ async def test_add_bug_valid_data(ai,valid_data,database):
         - Tests for valid insert into the database and KDTree
     """
     await database.setup_database(reset=True)
-    ai.user_manager = dict()
+    ai.user_manager = UserIndexRegistry()
     for user_id, structured_info, summ, disc in valid_data:
 
         status, message = await ai.add_bug(user_id=user_id,
@@ -283,7 +288,7 @@ async def test_similar_bugs_k_no_desc_and_summ_available(ai,no_desc_and_summ,dat
     don't satisfy the 'bool' function.
     """
     await database.setup_database(reset=True)
-    ai.user_manager = dict()
+    ai.user_manager = UserIndexRegistry()
     for user_id, structured_info, summ, disc in no_desc_and_summ:
         structured_info['id'] += 100
         try:
@@ -312,7 +317,7 @@ async def test_similar_bugs_k_no_data(ai,database,N):
     when no data is available for user.
     """
     await database.setup_database(reset=True)
-    ai.user_manager = dict()
+    ai.user_manager = UserIndexRegistry()
     for id in range(2,N):
         #add a bunch of data for user_id 1
         await ai.add_bug(user_id="1",
@@ -348,7 +353,7 @@ async def test_similar_bugs_k_valid_input_no_k(ai,valid_data,database):
     Tests for fetching 'k' most similar with the default value for k.
     """
     await database.setup_database(reset=True)
-    ai.user_manager = dict()
+    ai.user_manager = UserIndexRegistry()
     k = 5 #default value for k in get_similar_bugs_k
     num = 0 #number of bugs in the database
     for user_id, structured_info, summ, desc in valid_data:
@@ -376,7 +381,7 @@ async def test_similar_bugs_k_valid_input_w_k(ai,valid_data,database,N):
     with an arbitrary value of k
     """
     await database.setup_database(reset=True)
-    ai.user_manager = dict()
+    ai.user_manager = UserIndexRegistry()
     k = random.randint(1,N) #default value for k in get_similar_bugs_k
     num = 0 #number of bugs in the database
     for user_id, structured_info, summ, desc in valid_data:
@@ -409,7 +414,7 @@ async def test_remove_bug_valid_delete(ai,database,N):
     Tests for removing an existing example from the database
     """
     await database.setup_database(reset=True)
-    ai.user_manager = dict()
+    ai.user_manager = UserIndexRegistry()
     for i in range(N):
         await ai.add_bug(user_id="1",
             structured_info= {'id': i},
@@ -429,7 +434,7 @@ async def test_remove_bug_no_valid_id(ai,database,N,user_id):
     Tests for removing a non existent example from the database.
     """
     await database.setup_database(reset=True)
-    ai.user_manager = dict()
+    ai.user_manager = UserIndexRegistry()
     await ai.add_bug(user_id=user_id,
             structured_info= {'id': 1},
             summary="summary",
@@ -454,7 +459,7 @@ async def test_update_bug_no_summ_and_desc_update_batch_id(ai,database,user_id):
     Tests for updating batch_id alone.
     """
     await database.setup_database(reset=True)
-    ai.user_manager = dict()
+    ai.user_manager = UserIndexRegistry()
     await ai.add_bug(user_id=user_id,
             structured_info= {'id': 1},
             summary="summary", description= "description")
@@ -473,7 +478,7 @@ async def test_update_bug_no_summ_and_desc_update_batch_id_to_none(ai,database,N
     Tests for updating a batch_id to None(null) in the database
     """
     await database.setup_database(reset=True)
-    ai.user_manager = dict()
+    ai.user_manager = UserIndexRegistry()
     for i in range(N):
         await ai.add_bug(user_id=user_id,
                 structured_info= {'id': i},
@@ -491,7 +496,7 @@ async def test_update_bug_no_summ_and_desc_update_nothing(ai,database,N,user_id)
     Testing updates without any updatable value.
     """
     await database.setup_database(reset=True)
-    ai.user_manager = dict()
+    ai.user_manager = UserIndexRegistry()
     for i in range(N):
         await ai.add_bug(user_id=user_id,
                 structured_info= {'id': i,'batch_id': None},
@@ -510,7 +515,7 @@ async def test_update_bug_on_non_existing_data(ai,database,N,user_id):
     Tests update on non existent example
     """
     await database.setup_database(reset=True)
-    ai.user_manager = dict()
+    ai.user_manager = UserIndexRegistry()
     for i in range(N):
         await ai.add_bug(user_id=user_id,
                 structured_info= {'id': i,'batch_id': None},
@@ -532,7 +537,7 @@ async def test_update_bug_on_valid_data(ai,database,N, user_id):
     Tests for valid update on an existing example
     """
     await database.setup_database(reset=True)
-    ai.user_manager = dict()
+    ai.user_manager = UserIndexRegistry()
     for i in range(N):
 
         await ai.add_bug(user_id=user_id,
@@ -560,7 +565,7 @@ async def test_add_batch_valid_data(ai,database, valid_batch_data, user_id):
     Tests inserting valid chunk of batches.
     """
     await database.setup_database(reset=True)
-    ai.user_manager = dict()
+    ai.user_manager = UserIndexRegistry()
 
     data = {
         'user_id': user_id,
@@ -579,7 +584,7 @@ async def test_add_batch_valid_data_batch_id_error(ai, database, invalid_batch_d
     Tests for assertion error, all batch_id must be the same
     """
     await database.setup_database(reset=True)
-    ai.user_manager = dict()
+    ai.user_manager = UserIndexRegistry()
 
     data = {
         'user_id': user_id,
@@ -602,7 +607,7 @@ async def test_add_batch_valid_data_missing_text(ai, database, invalid_batch_dat
     must be a non-empty string.
     """
     await database.setup_database(reset=True)
-    ai.user_manager = dict()
+    ai.user_manager = UserIndexRegistry()
 
 
     data = {
@@ -625,7 +630,7 @@ async def test_add_batch_duplicate_key(ai, database, duplicate_id_batch_data, us
     must be a non-empty string.
     """
     await database.setup_database(reset=True)
-    ai.user_manager = dict()
+    ai.user_manager = UserIndexRegistry()
 
     data = {
         'user_id': user_id,
@@ -649,7 +654,7 @@ async def test_remove_batch_no_updates(ai, database,valid_batch_data,user_id):
         Removing a non-existing batch
     """
     await database.setup_database(reset=True)
-    ai.user_manager = dict()
+    ai.user_manager = UserIndexRegistry()
 
     #valid_data has batch_id=1
     data = {
@@ -671,7 +676,7 @@ async def test_remove_batch_valid_remove(ai, database,valid_batch_data,user_id):
         removing an existing batch
     """
     await database.setup_database(reset=True)
-    ai.user_manager = dict()
+    ai.user_manager = UserIndexRegistry()
 
     #valid_data has batch_id=1
     data = {
@@ -686,13 +691,25 @@ async def test_remove_batch_valid_remove(ai, database,valid_batch_data,user_id):
     await database.close_pool()
 
 #############################################
-### KDTree and Database cohesion ############
+### Index and Database cohesion #############
 #############################################
 
+def index_rows(index):
+    """
+    (id, embeddings) pairs of `index` ordered by id
+    """
+    return sorted(zip(index.ids.tolist(), index.embeddings.tolist()))
+
+def db_rows(db_data):
+    """
+    (id, embeddings) pairs of `fetch_all` rows ordered by id
+    """
+    return sorted((data['id'], np.ravel(data['embeddings']).tolist()) for data in db_data)
+
 @pytest.mark.asyncio
-async def test_db_and_kdtree_equivalency_on_delete(ai,valid_batch_data,database,N, user_id):
+async def test_db_and_index_equivalency_on_delete(ai,valid_batch_data,database,N, user_id):
     """
-    Tests for KDTree and database cohesion
+    Tests for index and database cohesion
 
     Tests
         - Adding a batch of data
@@ -701,30 +718,21 @@ async def test_db_and_kdtree_equivalency_on_delete(ai,valid_batch_data,database,
         - empty database
     """
     await database.setup_database(reset=True)
-    ai.user_manager = dict()
+    ai.user_manager = UserIndexRegistry()
     data = {
         'user_id': user_id,
         'data': valid_batch_data
     }
-    #add a batch and assert that kdtree and database contains same data.
+    #add a batch and assert that index and database contains same data.
     await ai.add_batch(**data)
     db_data = await database.fetch_all(user_id)
-    db_ids = [data['id'] for data in db_data]
-    db_embeddings = []
-    db_embeddings = [data['embeddings'] for data in db_data]
-    kdtree_ids = ai.user_manager[user_id]['kdtree'].local_indices.tolist()
-    kdtree_embeddings = ai.user_manager[user_id]['kdtree'].data.tolist()
-    assert kdtree_embeddings == db_embeddings and db_ids == kdtree_ids
-
-    #delete values and assert that kdtree and database contain the same data
+    assert index_rows(ai.user_manager[user_id].index) == db_rows(db_data)
+
+    #delete values and assert that index and database contain the same data
     for i in range(N):
         await ai.remove_bug(user_id=user_id, id=i)
         db_data = await database.fetch_all(user_id)
-        kdtree_ids = ai.user_manager[user_id]['kdtree'].local_indices.tolist()
-        kdtree_embeddings = ai.user_manager[user_id]['kdtree'].data.tolist()
-        db_ids = [data['id'] for data in db_data]
-        db_embeddings = [data['embeddings'] for data in db_data]
-        assert kdtree_embeddings == db_embeddings and db_ids == kdtree_ids
+        assert index_rows(ai.user_manager[user_id].index) == db_rows(db_data)
 
     #remove everything this user has put in, the batch with batch_id = 1.
     await ai.remove_batch(user_id= user_id,batch_id=1)
@@ -732,18 +740,18 @@ async def test_db_and_kdtree_equivalency_on_delete(ai,valid_batch_data,database,
         await database.fetch_all(user_id)
         assert False
     except NotFoundError:
-        assert ai.user_manager[user_id]['kdtree'] is None
+        assert ai.user_manager[user_id].index is None
     await database.close_pool()
 
 
 @pytest.mark.asyncio
-async def test_kdtree_and_db_equivalency_update_bug(ai,database,user_id):
+async def test_index_and_db_equivalency_update_bug(ai,database,user_id):
     """
-    KDtree and db cohesion
+    Index and db cohesion
     Test fetching the correct data for a user.
     """
     await database.setup_database(reset=True)
-    ai.user_manager = dict()
+    ai.user_manager = UserIndexRegistry()
 
 
 
@@ -764,11 +772,230 @@ async def test_kdtree_and_db_equivalency_update_bug(ai,database,user_id):
         )
 
     db_data = await database.fetch_all(user_id)
-    db_ids = [data['id'] for data in db_data]
-    db_embeddings = []
-    for data in db_data:
-        db_embeddings.extend(data['embeddings'])
-    kdtree_ids = ai.user_manager[user_id]['kdtree'].local_indices.tolist()
-    kdtree_embeddings = ai.user_manager[user_id]['kdtree'].data.tolist()
-    assert kdtree_embeddings == db_embeddings and db_ids == kdtree_ids
-    await database.close_pool()
\ No newline at end of file
+    assert index_rows(ai.user_manager[user_id].index) == db_rows(db_data)
+    await database.close_pool()
+
+@pytest.mark.asyncio
+async def test_index_catch_up_from_change_log(ai,valid_batch_data,database,user_id):
+    """
+    Index and db cohesion across workers
+    Writes of another worker are replayed from the change log by @ai.sync()
+    and before applying the next write.
+    """
+    await database.setup_database(reset=True)
+    ai.user_manager = UserIndexRegistry()
+    other = await BCJAIapi.initalize(database)
+
+    await other.add_batch(user_id=user_id, data=valid_batch_data)
+    await ai.sync()
+    assert index_rows(ai.user_manager[user_id].index) == \
+        db_rows(await database.fetch_all(user_id))
+
+    await other.remove_bug(user_id=user_id, id=0)
+    await ai.update_bug(user_id=user_id,
+                    structured_info={'id': 1},
+                    summary='new summary',
+                    description='new description')
+    assert ai.user_manager[user_id].seq == other.user_manager[user_id].seq + 1
+    assert index_rows(ai.user_manager[user_id].index) == \
+        db_rows(await database.fetch_all(user_id))
+    await database.close_pool()
+
+
+@pytest.mark.asyncio
+async def test_index_reloaded_after_failed_catch_up(ai,valid_batch_data,database,user_id,monkeypatch):
+    """
+    A failed catch up drops the index instead of leaving it behind the change log,
+    the next use of the user reloads it
+    """
+    await database.setup_database(reset=True)
+    ai.user_manager = UserIndexRegistry()
+    other = await BCJAIapi.initalize(database)
+    await ai.add_batch(user_id=user_id, data=valid_batch_data)
+    await other.sync()
+    await other.remove_bug(user_id=user_id, id=0)
+
+    async def fail(*args):
+        raise ConnectionError('lost the connection')
+    monkeypatch.setattr(database, 'fetch_changes', fail)
+    await ai.sync()
+    assert ai.user_manager[user_id].evicted and ai.user_manager[user_id].index is None
+
+    monkeypatch.undo()
+    status, _ = await ai.get_similar_bugs_k(user_id=user_id, summary='summary',
+                                        description='description', k=2)
+    assert status == BCJStatus.OK
+    assert not ai.user_manager[user_id].evicted
+    assert index_rows(ai.user_manager[user_id].index) == \
+        db_rows(await database.fetch_all(user_id))
+    await database.close_pool()
+
+
+@pytest.mark.asyncio
+async def test_remove_bugs(ai,valid_batch_data,database,user_id):
+    """
+    @ai.remove_bugs()
+    Removes the given ids with one index update and reports the unknown ids
+    """
+    await database.setup_database(reset=True)
+    ai.user_manager = UserIndexRegistry()
+    await ai.add_batch(user_id=user_id, data=valid_batch_data)
+    status, result = await ai.remove_bugs(user_id=user_id, ids=[0, 1, 1, -1])
+    assert status == BCJStatus.OK
+    assert result == {'removed': [0, 1], 'not_found': [-1]}
+    assert index_rows(ai.user_manager[user_id].index) == \
+        db_rows(await database.fetch_all(user_id))
+    status, result = await ai.remove_bugs(user_id=user_id, ids=[0])
+    assert result == {'removed': [], 'not_found': [0]}
+    with pytest.raises(ValueError):
+        await ai.remove_bugs(user_id='no user', ids=[0])
+    await database.close_pool()
+
+
+@pytest.mark.asyncio
+async def test_update_bugs(ai,valid_batch_data,database,user_id):
+    """
+    @ai.update_bugs()
+    Updates text and batch ids of many bugs with one index update
+    """
+    await database.setup_database(reset=True)
+    ai.user_manager = UserIndexRegistry()
+    await ai.add_batch(user_id=user_id, data=valid_batch_data)
+    date = valid_batch_data[0]['structured_info']['date']
+    status, result = await ai.update_bugs(user_id=user_id, data=[
+        {'summary': None, 'description': None,
+            'structured_info': {'id': 0, 'date': date, 'batch_id': 2}},
+        {'summary': 'new summary', 'description': 'new description',
+            'structured_info': {'id': 1, 'date': date, 'batch_id': None}},
+        {'summary': 'new summary', 'description': None,
+            'structured_info': {'id': -1, 'date': date, 'batch_id': None}}])
+    assert status == BCJStatus.OK
+    assert result == {'updated': [0, 1], 'not_found': [-1]}
+    assert index_rows(ai.user_manager[user_id].index) == \
+        db_rows(await database.fetch_all(user_id))
+    await database.close_pool()
+
+
+@pytest.mark.asyncio
+async def test_stream_similar_bugs_k(ai,valid_batch_data,database,user_id):
+    """
+    @ai.stream_similar_bugs_k()
+    Streamed pages hold the same neighbours as @ai.get_similar_bugs_k()
+    """
+    await database.setup_database(reset=True)
+    ai.user_manager = UserIndexRegistry()
+    await ai.add_batch(user_id=user_id, data=valid_batch_data)
+    query = {'user_id': user_id, 'summary': 'summary', 'description': 'description',
+            'k': len(valid_batch_data)}
+    status, pages = await ai.stream_similar_bugs_k(**query)
+    assert status == BCJStatus.OK
+    pages = [page async for page in pages]
+    dists = np.concatenate([page_dists for page_dists, _ in pages])
+    ids = np.concatenate([page_ids for _, page_ids in pages])
+    status, bugs = await ai.get_similar_bugs_k(**query)
+    assert np.allclose(dists, bugs['dist'])
+    #the descriptions repeat, tied bugs are compared in id order
+    def ranking(dists, ids):
+        return [int(bug_id) for _, bug_id in sorted(zip(np.round(dists, 9), ids))]
+    assert ranking(dists, ids) == ranking(bugs['dist'], bugs['id'])
+    await database.close_pool()
+
+
+@pytest.mark.asyncio
+async def test_get_similar_bugs_within_radius(ai,valid_batch_data,database,user_id):
+    """
+    @ai.get_similar_bugs_k() with a 'radius'
+    Returns the bugs within the radius, at most k of them
+    """
+    await database.setup_database(reset=True)
+    ai.user_manager = UserIndexRegistry()
+    await ai.add_batch(user_id=user_id, data=valid_batch_data)
+    query = {'user_id': user_id, 'summary': 'summary', 'description': 'description',
+            'k': len(valid_batch_data)}
+    _, bugs = await ai.get_similar_bugs_k(**query)
+    radius = float(bugs['dist'][1])
+    status, near = await ai.get_similar_bugs_k(**query, radius=radius)
+    assert status == BCJStatus.OK
+    assert not near['truncated']
+    assert all(dist <= radius for dist in near['dist'])
+    assert set(int(bug_id) for bug_id in near['id']) >= \
+        set(int(bug_id) for bug_id in bugs['id'][:2])
+    _, capped = await ai.get_similar_bugs_k(**{**query, 'k': 1}, radius=radius)
+    assert len(capped['id']) == 1
+    await database.close_pool()
+
+
+@pytest.mark.asyncio
+async def test_cluster_bugs(ai,valid_batch_data,database,user_id):
+    """
+    @ai.cluster_bugs(), @ai.get_clusters()
+    Stored clusters are returned and marked stale after a write
+    """
+    await database.setup_database(reset=True)
+    ai.user_manager = UserIndexRegistry()
+    await ai.add_batch(user_id=user_id, data=valid_batch_data)
+    assert (await ai.get_clusters(user_id=user_id))[0] == BCJStatus.NOT_FOUND
+    status, _ = await ai.cluster_bugs(user_id=user_id, threshold=1e6)
+    assert status == BCJStatus.OK
+    status, run = await ai.get_clusters(user_id=user_id)
+    assert status == BCJStatus.OK
+    assert run['clusters'] == [sorted(bug['structured_info']['id'] for bug in valid_batch_data)]
+    assert not run['stale']
+    await ai.remove_bug(user_id=user_id, id=valid_batch_data[0]['structured_info']['id'])
+    assert (await ai.get_clusters(user_id=user_id))[1]['stale']
+    await database.close_pool()
+
+
+@pytest.mark.asyncio
+async def test_get_similar_bugs_by_id(ai,valid_batch_data,database,user_id):
+    """
+    @ai.get_similar_bugs_k() with an 'id'
+    Returns the neighbours of the stored bug without the bug itself
+    """
+    await database.setup_database(reset=True)
+    ai.user_manager = UserIndexRegistry()
+    await ai.add_batch(user_id=user_id, data=valid_batch_data)
+    bug_id = valid_batch_data[0]['structured_info']['id']
+    status, bugs = await ai.get_similar_bugs_k(user_id=user_id, id=bug_id,
+                                            k=len(valid_batch_data))
+    assert status == BCJStatus.OK
+    assert sorted(int(other) for other in bugs['id']) == \
+        sorted(bug['structured_info']['id'] for bug in valid_batch_data[1:])
+    #exactly k other bugs within the radius is not truncated, the bug itself doesn't count
+    index = ai.user_manager[user_id].index
+    others = np.sort(np.linalg.norm(index.embeddings[index.ids != bug_id]
+                                    - index.embedding(bug_id), axis=1))
+    radius = float(others[1])
+    k = int(np.count_nonzero(others <= radius * (1 + RADIUS_RTOL)))
+    _, near = await ai.get_similar_bugs_k(user_id=user_id, id=bug_id, k=k, radius=radius)
+    assert len(near['id']) == k and not near['truncated']
+    assert bug_id not in near['id'].tolist()
+    _, capped = await ai.get_similar_bugs_k(user_id=user_id, id=bug_id, k=k - 1, radius=radius)
+    assert len(capped['id']) == k - 1 and capped['truncated']
+    status, _ = await ai.get_similar_bugs_k(user_id=user_id, id=-1)
+    assert status == BCJStatus.NOT_FOUND
+    await database.close_pool()
+
+
+@pytest.mark.asyncio
+async def test_shared_index_promotion(ai,valid_batch_data,database,user_id):
+    """
+    Small users are kept in the shared index on a shared semaphore
+    and promoted to their own index and semaphore once they grow
+    """
+    await database.setup_database(reset=True)
+    ai.user_manager = UserIndexRegistry()
+    ai.shared = SharedIndex(max_size=len(valid_batch_data), stripes=2)
+    await ai.add_batch(user_id=user_id, data=valid_batch_data)
+    assert isinstance(ai.user_manager[user_id].index, TenantView)
+    assert ai.shared.is_stripe(ai.user_manager[user_id].lock)
+    _, bugs = await ai.get_similar_bugs_k(user_id=user_id, summary='summary',
+                                        description='description', k=2)
+    assert len(bugs['id']) == 2
+    await ai.add_bug(user_id=user_id, summary='', description='description',
+                    structured_info={'id': 10**6, 'date': '2021-06-01'})
+    index = ai.user_manager[user_id].index
+    assert not isinstance(index, TenantView) and len(index) == len(valid_batch_data) + 1
+    assert not ai.shared.is_stripe(ai.user_manager[user_id].lock)
+    assert ai.shared.stats()['tenants'] == 0
+    await database.close_pool()
@@ -0,0 +1,85 @@
+#pylint: disable=E0401
+#pylint: disable=W0621
+#pylint: disable=C0413
+"""
+@author natidemis
+October 2026
+
+Test module for the similarity result cache in `Misc/cache.py`
+"""
+
+import sys
+import os
+import numpy as np
+import pytest
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../')
+
+from Misc.cache import QueryCache, ENTRY_OVERHEAD
+
+################
+### FIXTURES ###
+################
+
+def result(k):
+    """
+    ids and distances of `k` neighbours
+    """
+    return np.arange(k, dtype=np.int64), np.linspace(0, 1, k)
+
+#############
+### TESTS ###
+#############
+
+def test_hit_only_on_same_version():
+    """
+    A result is returned for its index version only
+    """
+    cache = QueryCache(max_bytes=1 << 20)
+    key = QueryCache.key('1', 'crash on login', 5)
+    assert cache.get(key, 0) is None
+    cache.put(key, 0, *result(5))
+    ids, dists = cache.get(key, 0)
+    assert ids.tolist() == list(range(5)) and len(dists) == 5
+    with pytest.raises(ValueError):
+        ids[0] = 9
+    assert cache.get(key, 1) is None
+    assert cache.get(key, 0) is None #dropped when the version moved on
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 3
+
+def test_lru_eviction_by_bytes():
+    """
+    The least recently used results are evicted to stay within max_bytes
+    """
+    size = 2 * 8 * 10 + ENTRY_OVERHEAD
+    cache = QueryCache(max_bytes=2 * size)
+    keys = [QueryCache.key('1', 'text {}'.format(i), 10) for i in range(3)]
+    cache.put(keys[0], 0, *result(10))
+    cache.put(keys[1], 0, *result(10))
+    assert cache.get(keys[0], 0) is not None
+    cache.put(keys[2], 0, *result(10))
+    assert cache.get(keys[1], 0) is None
+    assert cache.get(keys[0], 0) is not None and cache.get(keys[2], 0) is not None
+    assert cache.nbytes == 2 * size
+
+def test_invalidate_user():
+    """
+    Invalidating a user drops its results only
+    """
+    cache = QueryCache(max_bytes=1 << 20)
+    for user_id in ('1', '2'):
+        for k in (5, 10):
+            cache.put(QueryCache.key(user_id, 'text', k), 0, *result(k))
+    assert cache.invalidate('1') == 2
+    assert cache.get(QueryCache.key('1', 'text', 5), 0) is None
+    assert cache.get(QueryCache.key('2', 'text', 5), 0) is not None
+    assert cache.stats()['entries'] == 2
+
+def test_disabled():
+    """
+    Nothing is stored with max_bytes 0
+    """
+    cache = QueryCache(max_bytes=0)
+    key = QueryCache.key('1', 'text', 5)
+    cache.put(key, 0, *result(5))
+    assert cache.get(key, 0) is None and cache.nbytes == 0
@@ -0,0 +1,63 @@
+#pylint: disable=E0401
+#pylint: disable=W0621
+#pylint: disable=C0413
+"""
+@author natidemis
+October 2026
+
+Test module for the near-duplicate clustering in `Misc/clustering.py`
+"""
+
+import sys
+import os
+import numpy as np
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../')
+
+from Misc.clustering import UnionFind, find_clusters
+
+#############
+### TESTS ###
+#############
+
+def brute_force(ids, embeddings, threshold):
+    """
+    Clusters from the full distance matrix
+    """
+    dists = np.linalg.norm(embeddings[:, None] - embeddings[None], axis=2)
+    sets = UnionFind(len(ids))
+    for i, j in zip(*np.nonzero(np.triu(dists <= threshold, 1))):
+        sets.union(int(i), int(j))
+    return sorted(sorted(int(ids[i]) for i in group) for group in sets.groups())
+
+def test_union_find():
+    """
+    Sets merge transitively and singletons are left out
+    """
+    sets = UnionFind(6)
+    sets.union(4, 1)
+    sets.union(1, 3)
+    sets.union(5, 2)
+    assert sets.find(4) == 1
+    assert sets.groups() == [[1, 3, 4], [2, 5]]
+
+def test_find_clusters_matches_brute_force():
+    """
+    Tiled and threaded clustering finds the clusters of the full distance matrix
+    """
+    rng = np.random.default_rng(0)
+    embeddings = rng.random((700, 4))
+    ids = rng.permutation(700) * 3
+    clusters = find_clusters(ids, embeddings, 0.07, block=128, workers=3)
+    assert clusters
+    assert sorted(clusters) == brute_force(ids, embeddings, 0.07)
+    assert clusters == sorted(clusters)
+
+def test_find_clusters_duplicates():
+    """
+    Exact duplicates are clustered, distant bugs are not
+    """
+    embeddings = np.array([[0, 0], [5, 5], [0, 0], [5, 5.1], [9, 0]])
+    assert find_clusters([10, 11, 12, 13, 14], embeddings, 0.2) == [[10, 12], [11, 13]]
+    assert find_clusters([10, 11, 12, 13, 14], embeddings, 0.01) == [[10, 12]]
+    assert find_clusters([1], [[0, 0]], 1.0) == []
@@ -0,0 +1,141 @@
+#pylint: disable=E0401
+#pylint: disable=W0621
+#pylint: disable=C0413
+"""
+@author natidemis
+October 2026
+
+Test module for the request validation in `Misc/datamodels.py`
+and the response encoding in `Misc/serialization.py`
+"""
+
+import sys
+import os
+import json
+from typing import List
+import numpy as np
+import pytest
+from pydantic import parse_obj_as, ValidationError
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../')
+
+from Misc import serialization
+from Misc.datamodels import BatchItems, ValidBatchModel, GetDataModel, valid_date
+
+################
+### FIXTURES ###
+################
+
+@pytest.fixture
+def batch():
+    """
+    Valid '/batch' items
+    """
+    return [{'summary': 'summary', 'structured_info': {'id': 1, 'date': '2021-06-01', 'batch_id': 1}},
+            {'description': 'description',
+                'structured_info': {'id': 2, 'date': '2021-06-02', 'batch_id': 1}}]
+
+#############
+### TESTS ###
+#############
+
+def test_light_validation_matches_models(batch):
+    """
+    Light validation returns what the full models return for valid items
+    """
+    assert BatchItems.validate(batch) == \
+        [item.dict() for item in parse_obj_as(List[ValidBatchModel], batch)]
+
+def test_light_validation_coerces(batch):
+    """
+    Light validation coerces the types the full models coerce
+    """
+    batch[1]['structured_info'] = {'id': '5', 'date': '2021-06-02', 'batch_id': 1.0}
+    items = BatchItems.validate(batch)
+    assert items == [item.dict() for item in parse_obj_as(List[ValidBatchModel], batch)]
+    assert items[1]['structured_info'] == {'id': 5, 'date': '2021-06-02', 'batch_id': 1}
+
+@pytest.mark.parametrize('info', [{'id': 'one', 'date': '2021-06-01', 'batch_id': 1},
+                                {'id': 1, 'date': '2021-06-31', 'batch_id': 1},
+                                {'id': 1, 'date': '2021-06-01'},
+                                {'id': 1, 'date': '2021-06-01', 'batch_id': None},
+                                {'id': 1, 'date': '2021-06-01', 'batch_id': 1, 'extra': 1}])
+def test_light_validation_rejects(batch, info):
+    """
+    Invalid structured_info fails light validation
+    """
+    batch[1]['structured_info'] = info
+    with pytest.raises(ValueError, match='item 1'):
+        BatchItems.validate(batch)
+
+def test_valid_date():
+    """
+    Dates are validated as YYYY-MM-DD
+    """
+    assert valid_date('2021-02-28') and not valid_date('2021-02-30')
+    assert not valid_date('28-02-2021')
+
+@pytest.mark.parametrize('use_orjson', [True, False])
+def test_dumps_numpy(monkeypatch, use_orjson):
+    """
+    NumPy arrays and scalars are encoded like the lists they hold
+    """
+    if not use_orjson:
+        monkeypatch.setattr(serialization, 'orjson', None)
+    elif serialization.orjson is None:
+        pytest.skip('orjson not installed')
+    content = {'id': np.array([3, 1], dtype=np.int64), 'dist': np.array([0.5, 1.25]),
+            'k': np.int64(2), 'detail': 'ok'}
+    assert json.loads(serialization.dumps(content)) == \
+        {'id': [3, 1], 'dist': [0.5, 1.25], 'k': 2, 'detail': 'ok'}
+
+@pytest.mark.parametrize('accept, expected', [
+    ('', serialization.JSON),
+    ('*/*', serialization.JSON),
+    ('application/x-bcj-neighbours', serialization.NEIGHBOURS),
+    ('application/json, application/x-bcj-neighbours;q=0.5', serialization.JSON),
+    ('application/json;q=0.2, Application/X-BCJ-Neighbours', serialization.NEIGHBOURS),
+    ('application/x-bcj-neighbours;q=0', serialization.JSON),
+    ('application/x-ndjson', serialization.NDJSON)])
+def test_negotiate(accept, expected):
+    """
+    The 'Accept' type with the highest quality is chosen, json by default
+    """
+    assert serialization.negotiate(accept) == expected
+
+def test_neighbours_frames():
+    """
+    Concatenated frames decode to the encoded ids and distances
+    """
+    results = [(np.array([7, 1 << 40, 3]), np.array([0.0, 0.5, 2.25])),
+            (np.array([], dtype=np.int64), np.array([]))]
+    data = b''.join(serialization.encode_neighbours(ids, dists) for ids, dists in results)
+    assert data[:4] == b'BCJ1' and len(data) == 2 * 8 + 3 * 16
+    for (ids, dists), (expected_ids, expected_dists) in \
+        zip(serialization.decode_neighbours(data), results):
+        assert ids.tolist() == expected_ids.tolist() and dists.tolist() == expected_dists.tolist()
+    with pytest.raises(ValueError):
+        serialization.decode_neighbours(data[:-1])
+
+def test_msgpack_truncated():
+    """
+    Radius results in msgpack tell whether they were truncated
+    """
+    if serialization.msgpack is None:
+        pytest.skip('msgpack not installed')
+    ids, dists = np.array([2, 5]), np.array([0.25, 0.5])
+    content = serialization.msgpack.unpackb(
+        serialization.encode_neighbours(ids, dists, serialization.MSGPACK, truncated=True))
+    assert content['n'] == 2 and content['truncated'] is True
+    assert 'truncated' not in serialization.msgpack.unpackb(
+        serialization.encode_neighbours(ids, dists, serialization.MSGPACK))
+
+def test_get_by_id():
+    """
+    Queries by id need no structured_info, queries by text do
+    """
+    assert GetDataModel(user_id='1', id=3).id == 3
+    assert GetDataModel(user_id='1', summary='summary',
+                        structured_info={'date': '2021-06-01'}).id is None
+    with pytest.raises(ValidationError):
+        GetDataModel(user_id='1', summary='summary')
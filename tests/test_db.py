@@ -23,7 +23,8 @@ import numpy as np
 myPath = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, myPath + '/../')
 
-from Misc.db import NotFoundError, DuplicateKeyError, Database
+from Misc import db as db_module
+from Misc.db import NotFoundError, DuplicateKeyError, VersionMismatchError, NoUpdatesError, Database
 
 
 ################
@@ -378,4 +379,156 @@ async def test_fetch_users_not_empty(database):
         await database.insert_user(str(i))
 
     assert isinstance(await database.fetch_users(),list)
-    await database.close_pool()
\ No newline at end of file
+    await database.close_pool()
+
+####################
+### db.cutover() ###
+####################
+
+async def test_cutover(database, rng):
+    """
+    @db.cutover()
+    Switching a user to a new model version once all bugs are staged
+    Performs:
+        - cutover with a bug missing from the staged embeddings
+        - cutover with all bugs staged
+    """
+    await database.setup_database(reset=True)
+    await database.insert_user("1")
+    for idx in range(10):
+        await database.insert(id=idx, user_id="1", embeddings=rng.random(128),
+                            sentence="bug {}".format(idx))
+    await database.stage_embeddings("1", "v2",
+        [(idx, rng.random(64), "bug {}".format(idx)) for idx in range(9)])
+    assert await database.cutover("1", "v2") == [(9, "bug 9")]
+    assert (await database.fetch_model_versions())["1"] == "default"
+
+    await database.stage_embeddings("1", "v2", [(9, rng.random(64), "bug 9")])
+    assert await database.cutover("1", "v2") == []
+    assert (await database.fetch_model_versions())["1"] == "v2"
+    assert all(len(row['embeddings']) == 64 for row in await database.fetch_all("1"))
+    await database.close_pool()
+
+async def test_insert_version_mismatch(database, rng):
+    """
+    @db.insert()
+    Inserting embeddings made with another model version than the user's
+    """
+    await database.setup_database(reset=True)
+    await database.insert_user("1", model_version="v2")
+    try:
+        await database.insert(id=1, user_id="1", embeddings=rng.random(128),
+                            model_version="v1")
+        assert False
+    except VersionMismatchError:
+        assert True
+    await database.close_pool()
+
+async def test_mutation_deltas(database):
+    """
+    @db.insert_batch(), @db.update(), @db.delete(), @db.delete_batch()
+    Mutations log the rows they changed and return the logged changes
+    """
+    await database.setup_database(reset=True)
+    await database.insert_user("1")
+    changes = await database.insert_batch([(idx, "1", [idx, idx], 1) for idx in range(5)])
+    assert [(change.seq, change.op, change.id) for change in changes] == \
+        [(seq, 'U', seq - 1) for seq in range(1, 6)]
+    [change] = await database.update(id=2, user_id="1", embeddings=[7, 7], batch_id=2)
+    assert (change.seq, change.op, change.id, list(change.embeddings)) == (6, 'U', 2, [7, 7])
+    assert await database.update(id=2, user_id="1", batch_id=3) == []
+    [change] = await database.delete(id=0, user_id="1")
+    assert (change.seq, change.op, change.id) == (7, 'D', 0)
+    changes = await database.delete_batch(batch_id=1, user_id="1")
+    assert sorted(change.id for change in changes) == [1, 3, 4]
+    assert [change.seq for change in changes] == [8, 9, 10]
+    assert [row['id'] for row in await database.fetch_all("1")] == [2]
+    assert [change.seq for change in await database.fetch_changes("1", 8)] == [9, 10]
+    rows, seq, _ = await database.fetch_snapshot("1")
+    assert [row['id'] for row in rows] == [2] and seq == 10
+    assert (await database.fetch_log_seqs())["1"] == 10
+    assert await database.prune_changes(0) == 10
+    assert await database.fetch_changes("1", 0) == []
+    await database.close_pool()
+
+@pytest.mark.asyncio
+async def test_delete_many(database):
+    """
+    @db.delete_many()
+    Deletes the given ids of the user only and ignores unknown ids
+    """
+    await database.setup_database(reset=True)
+    await database.insert_user("1")
+    await database.insert_user("2")
+    await database.insert_batch([(idx, user_id, [idx, idx], 1)
+        for user_id in ("1", "2") for idx in range(4)])
+    changes = await database.delete_many([0, 2, 9], "1")
+    assert sorted(change.id for change in changes) == [0, 2]
+    assert {change.op for change in changes} == {'D'}
+    assert sorted(row['id'] for row in await database.fetch_all("1")) == [1, 3]
+    assert len(await database.fetch_all("2")) == 4
+    with pytest.raises(NoUpdatesError):
+        await database.delete_many([0, 9], "1")
+    with pytest.raises(NoUpdatesError):
+        await database.delete_many([1], "3")
+    await database.close_pool()
+
+@pytest.mark.asyncio
+async def test_update_many(database):
+    """
+    @db.update_many()
+    Updates embeddings and batch ids of many bugs in one statement,
+    only new embeddings are logged
+    """
+    await database.setup_database(reset=True)
+    await database.insert_user("1")
+    await database.insert_batch([(idx, "1", [idx, idx], 1) for idx in range(4)])
+    updated, changes = await database.update_many("1", [(0, None, 2, None),
+                                                        (1, [7, 7], None, 'seven'),
+                                                        (2, [8, 8], 3, 'eight'),
+                                                        (9, [9, 9], None, 'nine')],
+                                                model_version='default')
+    assert sorted(updated) == [0, 1, 2]
+    assert sorted((change.id, np.ravel(change.embeddings).tolist()) for change in changes) == \
+        [(1, [7, 7]), (2, [8, 8])]
+    rows = {row['id']: row for row in await database.fetch_all("1")}
+    assert rows[0]['batch_id'] == 2 and np.ravel(rows[0]['embeddings']).tolist() == [0, 0]
+    assert rows[1]['batch_id'] == 1 and np.ravel(rows[1]['embeddings']).tolist() == [7, 7]
+    assert rows[2]['batch_id'] == 3
+    with pytest.raises(NoUpdatesError):
+        await database.update_many("1", [(9, None, 1, None)])
+    with pytest.raises(VersionMismatchError):
+        await database.update_many("1", [(0, [1, 1], None, 'one')], model_version='other')
+    await database.close_pool()
+
+@pytest.mark.asyncio
+async def test_clusters(database):
+    """
+    @db.save_clusters(), @db.fetch_clusters()
+    A clustering run replaces the previous clusters of the user
+    """
+    await database.setup_database(reset=True)
+    await database.insert_user("1")
+    assert await database.fetch_clusters("1") is None
+    await database.save_clusters("1", 0.5, 3, [[1, 2, 7], [4, 5]])
+    await database.save_clusters("1", 0.2, 4, [[5, 4]])
+    run = await database.fetch_clusters("1")
+    assert (run['threshold'], run['seq'], run['clusters']) == (0.2, 4, [[4, 5]])
+    await database.close_pool()
+
+@pytest.mark.asyncio
+async def test_statements_across_acquisitions(monkeypatch):
+    """
+    Queries run through the statement cache keep working when a
+    connection is acquired again after going back to the pool
+    """
+    monkeypatch.setattr(db_module, 'DB_STATEMENT_CACHE_SIZE', 100)
+    database = await Database.connect_pool()
+    await database.setup_database(reset=True)
+    await database.insert_user("1")
+    #sequential acquisitions cycle through the pool, so each connection is reused
+    for id in range(3 * database.pool.get_max_size()):
+        await database.insert(id=id, user_id="1", embeddings=[id, id])
+        assert len(await database.fetch_all("1")) == 1
+        await database.delete(id=id, user_id="1")
+    await database.close_pool()
@@ -0,0 +1,145 @@
+#pylint: disable=E0401
+#pylint: disable=W0621
+#pylint: disable=C0413
+"""
+@author natidemis
+October 2026
+
+Test module for the in-memory index in `Misc/index.py`
+"""
+
+import sys
+import os
+import numpy as np
+import pytest
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../')
+
+from Misc.db import Change
+from Misc.index import VectorIndex, apply_changes, RADIUS_RTOL
+
+################
+### FIXTURES ###
+################
+
+@pytest.fixture
+def index():
+    """
+    Index of three bugs with 2 dimensional embeddings
+    """
+    return VectorIndex([1, 2, 3], [[1, 1], [2, 2], [3, 3]])
+
+#############
+### TESTS ###
+#############
+
+def contents(index):
+    """
+    id -> embeddings of `index`
+    """
+    return {int(id): list(emb) for id, emb in zip(index.ids, index.embeddings)}
+
+def test_from_rows():
+    """
+    Single bugs are stored as (1, dim) arrays and no rows make no index
+    """
+    assert VectorIndex.from_rows(None) is None
+    index = VectorIndex.from_rows([{'id': 1, 'embeddings': np.array([[1.0, 2.0]])},
+                                {'id': 2, 'embeddings': [3.0, 4.0]}])
+    assert contents(index) == {1: [1, 2], 2: [3, 4]}
+
+def test_add_replaces_and_remove_ignores_unknown(index):
+    """
+    Adding an indexed id replaces it, removing an unknown id does nothing
+    """
+    index.add([2, 4], [[5, 5], [4, 4]])
+    index.remove([1, 9])
+    assert contents(index) == {2: [5, 5], 3: [3, 3], 4: [4, 4]}
+
+def test_apply_changes_in_order(index):
+    """
+    Changes are applied in sequence order, the last change of an id wins
+    """
+    changes = [Change('1', 1, 'U', 4, [4, 4]),
+            Change('1', 2, 'U', 4, [6, 6]),
+            Change('1', 3, 'D', 1, None),
+            Change('1', 4, 'U', 1, [7, 7])]
+    index = apply_changes(index, changes)
+    assert contents(index) == {1: [7, 7], 2: [2, 2], 3: [3, 3], 4: [6, 6]}
+    #replaying is idempotent
+    assert contents(apply_changes(index, changes)) == contents(index)
+
+def test_apply_changes_empty(index):
+    """
+    An emptied index is None and a new one is made from None
+    """
+    assert apply_changes(index, [Change('1', seq, 'D', seq, None) for seq in (1, 2, 3)]) is None
+    assert contents(apply_changes(None, [Change('1', 1, 'U', 5, [5, 5])])) == {5: [5, 5]}
+
+def test_apply_changes_reload():
+    """
+    Changes of every bug can't be applied
+    """
+    with pytest.raises(ValueError):
+        apply_changes(None, [Change('1', 1, 'R', None, None)])
+
+def test_ranked_pages():
+    """
+    Pages grow and hold the k nearest bugs in ranked order
+    """
+    rng = np.random.default_rng(0)
+    embeddings = rng.random((1000, 8))
+    index = VectorIndex(np.arange(1000) * 2, embeddings)
+    vec = rng.random(8)
+    pages = list(index.ranked(vec, k=700, page=100))
+    assert [len(ids) for _, ids in pages] == [100, 200, 400]
+    expected = np.argsort(np.linalg.norm(embeddings - vec, axis=1), kind='stable')[:700] * 2
+    assert np.concatenate([ids for _, ids in pages]).tolist() == expected.tolist()
+    assert sum(len(ids) for _, ids in index.ranked(vec, k=5000)) == 1000
+
+def test_within_radius():
+    """
+    Every bug within the radius nearest first, truncated to the limit
+    """
+    rng = np.random.default_rng(0)
+    embeddings = rng.random((1000, 4))
+    index = VectorIndex(np.arange(1000) * 2, embeddings)
+    vec = rng.random(4)
+    dists = np.linalg.norm(embeddings - vec, axis=1)
+    found, ids, truncated = index.within(vec, 0.3, limit=1000, block=100)
+    assert not truncated
+    assert sorted(ids.tolist()) == (np.flatnonzero(dists <= 0.3) * 2).tolist()
+    assert np.all(np.diff(found) >= 0)
+    found, ids, truncated = index.within(vec, 0.3, limit=5, block=100)
+    assert truncated and len(ids) == 5
+    assert np.all(found <= 0.3)
+    assert len(index.within(vec, 1e-9, limit=5)[1]) == 0
+
+def test_within_neighbour_distance():
+    """
+    The distance of a returned neighbour used as the radius includes that neighbour
+    """
+    rng = np.random.default_rng(1)
+    index = VectorIndex(np.arange(500), rng.random((500, 16)))
+    vec = rng.random(16)
+    for dists, ids in (next(index.ranked(vec, k=50)), index.query(vec[None], k=50)):
+        for dist, id in zip(np.ravel(dists), np.ravel(ids)): #pylint: disable=redefined-builtin
+            found, within, _ = index.within(vec, float(dist), limit=500)
+            assert id in within and np.all(found <= dist * (1 + RADIUS_RTOL))
+
+def test_ties_ordered_by_id():
+    """
+    Bugs at the same distance are ranked by id in pages, queries and radius results
+    """
+    rng = np.random.default_rng(2)
+    points = rng.random((5, 4))
+    ids = rng.permutation(100) + 10
+    index = VectorIndex(ids, points[np.arange(100) % 5])
+    vec = rng.random(4)
+    dists = np.linalg.norm(index.embeddings - vec, axis=1)
+    expected = ids[np.lexsort((ids, np.round(dists, 12)))]
+    for page in (1, 7, 256):
+        ranked = np.concatenate([found for _, found in index.ranked(vec, k=100, page=page)])
+        assert ranked.tolist() == expected.tolist()
+    assert np.ravel(index.query(vec[None], k=100)[1]).tolist() == expected.tolist()
+    assert index.within(vec, 10.0, limit=100)[1].tolist() == expected.tolist()
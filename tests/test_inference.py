@@ -0,0 +1,73 @@
+#pylint: disable=E0401
+#pylint: disable=W0621
+#pylint: disable=C0413
+"""
+@author natidemis
+October 2026
+
+Test module for the inference backends in `Misc/inference.py`
+"""
+
+import sys
+import os
+import pytest
+import numpy as np
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../')
+
+from Misc.inference import NumpyBackend, export_numpy
+
+tf = pytest.importorskip('tensorflow')
+
+################
+### FIXTURES ###
+################
+
+@pytest.fixture
+def sentences():
+    """
+    Zero padded sentence matrices of different lengths
+    """
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=(6, 12, 16)).astype(np.float32)
+    for i, length in enumerate([12, 9, 5, 3, 1, 7]):
+        x[i, length:] = 0
+    return x
+
+def _models():
+    """ Encoders built from every supported layer type """
+    layers = tf.keras.layers
+    return [
+        [layers.Masking(0.0), layers.Bidirectional(layers.LSTM(8, return_sequences=True)),
+            layers.GRU(6), layers.Dense(4, activation='tanh')],
+        [layers.Masking(0.0), layers.Bidirectional(layers.GRU(5), merge_mode='sum'),
+            layers.Dropout(0.5), layers.Dense(3)],
+        [layers.Conv1D(8, 3, padding='same', activation='relu'), layers.MaxPooling1D(2),
+            layers.BatchNormalization(), layers.GlobalAveragePooling1D(), layers.Dense(4)],
+        [layers.SimpleRNN(7, return_sequences=True), layers.LayerNormalization(),
+            layers.Flatten(), layers.Dense(5, activation='sigmoid')],
+    ]
+
+##############################
+### NumpyBackend.predict() ###
+##############################
+
+@pytest.mark.parametrize('index', range(len(_models())))
+def test_numpy_backend_parity(index, sentences, tmp_path):
+    """
+    The numpy forward pass matches the keras outputs
+    """
+    model = tf.keras.Sequential([tf.keras.Input(shape=sentences.shape[1:])] + _models()[index])
+    path = str(tmp_path / 'model.npz')
+    export_numpy(model, path)
+    backend = NumpyBackend(path)
+    assert backend.input_shape == tuple(model.input_shape)
+    assert np.allclose(backend.predict(sentences), model.predict(sentences, verbose=0), atol=1e-4)
+
+def test_export_unsupported_layer(tmp_path):
+    """
+    Exporting a model with an unsupported layer raises ValueError
+    """
+    model = tf.keras.Sequential([tf.keras.Input(shape=(4, 4)), tf.keras.layers.UpSampling1D(2)])
+    with pytest.raises(ValueError):
+        export_numpy(model, str(tmp_path / 'model.npz'))
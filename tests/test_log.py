@@ -0,0 +1,39 @@
+#pylint: disable=E0401
+#pylint: disable=C0413
+"""
+@author natidemis
+October 2026
+
+Test module for the logging setup
+"""
+
+import sys
+import os
+import json
+import queue
+import logging
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../')
+
+from Misc.log import JsonFormatter, RecordQueueHandler
+
+#############
+### TESTS ###
+#############
+
+def test_queued_exception_kept_apart():
+    """
+    The traceback of a queued record reaches the json formatter
+    as 'exc_info', not as part of the message
+    """
+    records = queue.SimpleQueue()
+    test_logger = logging.getLogger('test_queued_exception')
+    test_logger.propagate = False
+    test_logger.addHandler(RecordQueueHandler(records))
+    try:
+        raise ValueError('bad value')
+    except ValueError:
+        test_logger.exception('Failed for %s', 'user')
+    entry = json.loads(JsonFormatter().format(records.get_nowait()))
+    assert entry['message'] == 'Failed for user'
+    assert 'Traceback' in entry['exc_info'] and 'ValueError: bad value' in entry['exc_info']
@@ -0,0 +1,63 @@
+#pylint: disable=E0401
+#pylint: disable=W0621
+#pylint: disable=C0413
+"""
+@author natidemis
+October 2026
+
+Test module for the metrics in `Misc/metrics.py`
+"""
+
+import sys
+import os
+import pytest
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../')
+
+from Misc.metrics import Counter, Gauge, Histogram, MetricsRegistry
+
+#############
+### TESTS ###
+#############
+
+def test_render():
+    """
+    Test the text exposition format of each metric type
+    """
+    registry = MetricsRegistry()
+    counter = registry.register(Counter('requests_total', 'Requests', ('cache', 'result')))
+    gauge = registry.register(Gauge('size', 'Size', ('user_id',)))
+    histogram = registry.register(Histogram('latency_seconds', 'Latency', ('stage',),
+                                            buckets=(0.1, 1)))
+    counter.inc('vocab', 'hit', amount=3)
+    counter.inc('vocab', 'hit')
+    gauge.set(5, 'a"b')
+    histogram.observe(0.05, 'clean')
+    histogram.observe(0.5, 'clean')
+    histogram.observe(2, 'clean')
+
+    lines = registry.render().splitlines()
+    assert '# TYPE requests_total counter' in lines
+    assert 'requests_total{cache="vocab",result="hit"} 4' in lines
+    assert 'size{user_id="a\\"b"} 5' in lines
+    assert 'latency_seconds_bucket{stage="clean",le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{stage="clean",le="1"} 2' in lines
+    assert 'latency_seconds_bucket{stage="clean",le="+Inf"} 3' in lines
+    assert 'latency_seconds_count{stage="clean"} 3' in lines
+    assert histogram.count('clean') == 3
+
+    with pytest.raises(ValueError):
+        registry.register(Gauge('size', 'Duplicate'))
+
+
+def test_time():
+    """
+    Test that `Histogram.time` observes even when the body raises
+    """
+    histogram = Histogram('stage_seconds', 'Stages', ('stage',))
+    with histogram.time('predict'):
+        pass
+    with pytest.raises(KeyError):
+        with histogram.time('predict'):
+            raise KeyError
+    assert histogram.count('predict') == 2
@@ -0,0 +1,87 @@
+#pylint: disable=E0401
+#pylint: disable=W0621
+#pylint: disable=C0413
+"""
+@author natidemis
+October 2026
+
+Test module for the schema migrations in `Misc/migrations.py`
+"""
+
+import sys
+import os
+import asyncio
+from contextlib import asynccontextmanager
+import pytest
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../')
+
+from Misc.migrations import load_migrations, migrate, partition_queries
+
+MIGRATIONS = os.path.join(myPath, '..', 'sql', 'migrations')
+
+################
+### FIXTURES ###
+################
+
+class FakeConnection:
+    """ Connection recording the executed queries, with `applied` migration versions """
+    def __init__(self, applied=()):
+        self.applied = list(applied)
+        self.queries = []
+
+    async def execute(self, query, *args):
+        self.queries.append(query)
+        if query.startswith('INSERT INTO schema_migrations'):
+            self.applied.append(args[0])
+
+    async def fetch(self, query, *args):
+        return [{'version': version} for version in self.applied]
+
+    @asynccontextmanager
+    async def transaction(self):
+        yield
+
+#############
+### TESTS ###
+#############
+
+def test_load_migrations():
+    """
+    Migrations are ordered by version and start with the initial schema
+    """
+    migrations = load_migrations(MIGRATIONS)
+    versions = [migration.version for migration in migrations]
+    assert versions == list(range(1, len(versions) + 1))
+    assert migrations[0].name == 'initial'
+
+def test_duplicate_versions(tmp_path):
+    """
+    Two migrations can't share a version
+    """
+    (tmp_path / '0001_a.sql').write_text('SELECT 1;')
+    (tmp_path / '0001_b.sql').write_text('SELECT 1;')
+    with pytest.raises(ValueError):
+        load_migrations(str(tmp_path))
+
+def test_migrate_applies_pending_once():
+    """
+    Only unapplied migrations run and each is recorded, under the advisory lock
+    """
+    conn = FakeConnection(applied=[1])
+    applied = asyncio.run(migrate(conn, MIGRATIONS))
+    assert [migration.version for migration in applied] == \
+        [migration.version for migration in load_migrations(MIGRATIONS)][1:]
+    assert conn.queries[0].startswith('SELECT pg_advisory_lock')
+    assert conn.queries[-1].startswith('SELECT pg_advisory_unlock')
+    assert asyncio.run(migrate(conn, MIGRATIONS)) == []
+
+def test_partition_queries():
+    """
+    One partition per remainder and at least 2 partitions
+    """
+    queries = partition_queries(4)
+    assert sum('PARTITION OF Vectors' in query for query in queries) == 4
+    assert 'REMAINDER 3' in ''.join(queries)
+    with pytest.raises(ValueError):
+        partition_queries(1)
@@ -0,0 +1,93 @@
+#pylint: disable=E0401
+#pylint: disable=W0621
+#pylint: disable=C0413
+"""
+@author natidemis
+October 2026
+
+Test module for the lazy loading of encoders in `Misc/models.py`
+"""
+
+import sys
+import os
+import time
+import asyncio
+import threading
+import pytest
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../')
+
+from Misc.models import ModelRegistry
+
+################
+### FIXTURES ###
+################
+
+class Loader:
+    """ Encoder loader counting its calls, the first `failures` calls raise OSError """
+    def __init__(self, failures=0, delay=0.0):
+        self.calls = 0
+        self.failures = failures
+        self.delay = delay
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            self.calls += 1
+            calls = self.calls
+        time.sleep(self.delay)
+        if calls <= self.failures:
+            raise OSError('model file unavailable')
+        return object()
+
+#############
+### TESTS ###
+#############
+
+def test_lazy_load():
+    """
+    Nothing is loaded until an encoder is asked for, then it is loaded once
+    """
+    loader = Loader()
+    models = ModelRegistry({'v1': loader}, version='v1')
+    assert loader.calls == 0 and not models.ready
+    encoder = asyncio.run(models.get_encoder())
+    assert models.ready and loader.calls == 1
+    assert asyncio.run(models.get_encoder('v1')) is encoder
+    assert models.load() is encoder and loader.calls == 1
+
+def test_concurrent_get_encoder():
+    """
+    Concurrent requests for an encoder share one load
+    """
+    loader = Loader(delay=0.05)
+    models = ModelRegistry({'v1': loader}, version='v1')
+
+    async def run():
+        return await asyncio.gather(*(models.get_encoder() for _ in range(5)))
+
+    encoders = asyncio.run(run())
+    assert loader.calls == 1
+    assert all(encoder is encoders[0] for encoder in encoders)
+
+def test_retry_after_failure():
+    """
+    A failed load is retried by the next request instead of failing for good
+    """
+    loader = Loader(failures=1)
+    models = ModelRegistry({'v1': loader}, version='v1')
+    with pytest.raises(OSError):
+        asyncio.run(models.get_encoder())
+    assert not models.ready
+    assert asyncio.run(models.get_encoder()) is not None
+    assert models.ready and loader.calls == 2
+
+def test_unknown_version():
+    """
+    Unknown model versions raise KeyError
+    """
+    models = ModelRegistry({'v1': Loader()}, version='v1')
+    with pytest.raises(KeyError):
+        models.warm_up('v2')
+    with pytest.raises(KeyError):
+        asyncio.run(models.get_encoder('v2'))
@@ -0,0 +1,59 @@
+#pylint: disable=E0401
+#pylint: disable=W0621
+#pylint: disable=C0413
+"""
+@author natidemis
+October 2026
+
+Test module for the diagnostics in `Misc/profiler.py`
+"""
+
+import sys
+import os
+import time
+import threading
+import pytest
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../')
+
+from Misc.profiler import sample_stacks, ProfilerBusyError
+
+#############
+### TESTS ###
+#############
+
+def busy_worker(stop: threading.Event):
+    """ Spins until `stop` is set """
+    while not stop.is_set():
+        time.sleep(0.001)
+
+
+def test_sample_stacks():
+    """
+    Test that other threads are sampled in the collapsed stack format
+    """
+    stop = threading.Event()
+    worker = threading.Thread(target=busy_worker, args=(stop,), name='worker')
+    worker.start()
+    try:
+        stacks = sample_stacks(0.1, interval=0.01)
+    finally:
+        stop.set()
+        worker.join()
+    lines = [line.rsplit(' ', 1) for line in stacks.splitlines()]
+    assert lines and all(count.isdigit() for _, count in lines)
+    assert any(stack.startswith('worker;') and 'busy_worker (test_profiler.py:' in stack
+            for stack, _ in lines)
+    assert not any('sample_stacks' in stack for stack, _ in lines)
+
+
+def test_busy():
+    """
+    Test that only one profile runs at a time
+    """
+    thread = threading.Thread(target=sample_stacks, args=(0.2,))
+    thread.start()
+    time.sleep(0.05)
+    with pytest.raises(ProfilerBusyError):
+        sample_stacks(0.1)
+    thread.join()
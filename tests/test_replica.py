@@ -0,0 +1,77 @@
+#pylint: disable=E0401
+#pylint: disable=W0621
+#pylint: disable=C0413
+#pylint: disable=W0212
+"""
+@author natidemis
+October 2026
+
+Test module for the read replica routing of `Database`
+"""
+
+import sys
+import os
+import time
+import asyncio
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../')
+
+from Misc.db import Database, REPLICA_MAX_LAG
+
+################
+### FIXTURES ###
+################
+
+class FakePool:
+    """ Pool whose connections answer every query with `value` """
+    def __init__(self, value=0.0):
+        self.value = value
+
+    def acquire(self, timeout=None):
+        pool = self
+        class Connection:
+            async def __aenter__(self):
+                return self
+            async def __aexit__(self, *exc):
+                return False
+            async def fetchval(self, query, *args, timeout=None):
+                if isinstance(pool.value, Exception):
+                    raise pool.value
+                return pool.value
+        return Connection()
+
+#############
+### TESTS ###
+#############
+
+def test_read_routing():
+    """
+    Test that reads go to the replica unless it lags or the user was just written
+    """
+    async def run():
+        primary, replica = FakePool(), FakePool(0.0)
+        db = Database(primary, replica)
+        assert db._read_pool('u1') is primary #lag not measured yet
+        await db._check_replica_lag()
+        assert db._read_pool('u1') is replica
+        assert db._read_pool() is replica
+
+        db._written('u1')
+        assert db._read_pool('u1') is primary
+        assert db._read_pool('u2') is replica
+        assert db._read_pool() is primary
+        db._writes['u1'] = db._last_write = time.monotonic() - REPLICA_MAX_LAG - 1
+        assert db._read_pool('u1') is replica
+
+        replica.value = REPLICA_MAX_LAG + 1
+        await db._check_replica_lag()
+        assert db._read_pool('u2') is primary
+
+        replica.value = OSError('unreachable')
+        await db._check_replica_lag()
+        assert db._replica_lag is None
+        assert db._read_pool('u2') is primary
+
+        assert Database(primary)._read_pool('u1') is primary
+
+    asyncio.run(run())
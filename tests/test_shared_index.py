@@ -0,0 +1,89 @@
+#pylint: disable=E0401
+#pylint: disable=W0621
+#pylint: disable=C0413
+"""
+@author natidemis
+October 2026
+
+Test module for the shared index of small users in `Misc/shared_index.py`
+"""
+
+import sys
+import os
+import numpy as np
+import pytest
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../')
+
+from Misc import shared_index
+from Misc.index import VectorIndex
+from Misc.shared_index import SharedIndex
+
+################
+### FIXTURES ###
+################
+
+@pytest.fixture
+def store():
+    """
+    Shared index of users with at most 4 bugs
+    """
+    return SharedIndex(max_size=4, stripes=2)
+
+#############
+### TESTS ###
+#############
+
+def test_views_match_dedicated_indexes(store):
+    """
+    Tenants only see their own rows and rank them like a VectorIndex
+    """
+    rng = np.random.default_rng(0)
+    dedicated = {user_id: VectorIndex(np.arange(4) + 10 * n, rng.random((4, 3)))
+                for n, user_id in enumerate('abc')}
+    views = {user_id: store.put(user_id, index) for user_id, index in dedicated.items()}
+    vec = rng.random(3)
+    for user_id, index in dedicated.items():
+        assert views[user_id].ids.tolist() == index.ids.tolist()
+        assert [ids.tolist() for _, ids in views[user_id].ranked(vec, k=4)] == \
+            [ids.tolist() for _, ids in index.ranked(vec, k=4)]
+        view_dists, view_ids = views[user_id].query(vec[None], k=2)
+        dists, ids = index.query(vec[None], k=2)
+        assert view_ids.shape == ids.shape and view_ids.tolist() == ids.tolist()
+        assert view_dists.shape == dists.shape and np.allclose(view_dists, dists)
+    assert store.stats()['tenants'] == 3
+
+def test_add_remove_and_compact(store, monkeypatch):
+    """
+    Replaced and removed rows die and compaction keeps every tenant's rows
+    """
+    monkeypatch.setattr(shared_index, 'COMPACT_MIN_DEAD', 2)
+    first = store.put('a', VectorIndex([1, 2], [[0, 0], [1, 1]]))
+    second = store.put('b', VectorIndex([1], [[5, 5]]))
+    first.add([2, 3], [[2, 2], [3, 3]])
+    assert store.dead == 1
+    first.remove([1, 9])
+    assert store.dead == 2
+    store.compact()
+    assert store.dead == 0 and store.size == 3
+    assert sorted(first.ids.tolist()) == [2, 3]
+    assert first.embedding(2).tolist() == [2, 2]
+    assert second.ids.tolist() == [1] and second.embeddings.tolist() == [[5, 5]]
+    store.drop('a')
+    assert store.stats()['tenants'] == 1
+    #compacted once most rows are dead
+    assert store.dead == 0 and store.size == 1
+    assert len(store.put('c', VectorIndex([7], [[7, 7]]))) == 1
+
+def test_fits_and_stripes(store):
+    """
+    Users fit while small and of the same dimension, stripes are shared
+    """
+    assert store.fits(None)
+    assert store.fits(VectorIndex(np.arange(4), np.zeros((4, 2))))
+    assert not store.fits(VectorIndex(np.arange(5), np.zeros((5, 2))))
+    store.put('a', VectorIndex([1], [[0, 0]]))
+    assert not store.fits(VectorIndex([1], [[0, 0, 0]]))
+    assert store.is_stripe(store.stripe('a'))
+    assert store.stripe('a') is store.stripe('a')
+    assert SharedIndex(max_size=0).stripe('a') is None
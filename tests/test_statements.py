@@ -0,0 +1,75 @@
+#pylint: disable=E0401
+#pylint: disable=W0621
+#pylint: disable=C0413
+#pylint: disable=W0212
+"""
+@author natidemis
+October 2026
+
+Test module for the prepared statements of `Database`
+"""
+
+import sys
+import os
+import asyncio
+import asyncpg
+import pytest
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../')
+
+from Misc import db
+from Misc.db import Database, NotFoundError, PreparedConnection, QueryString
+
+################
+### FIXTURES ###
+################
+
+class FakeConnection:
+    """
+    Pooled connection answering every row query with `row`, recording the queries.
+    Like asyncpg, statements prepared explicitly fail after the connection was released.
+    """
+    prepared = PreparedConnection.prepared
+
+    def __init__(self, row):
+        self.row = row
+        self.queries = []
+        self.releases = 0
+
+    def release(self):
+        self.releases += 1
+
+    async def prepare(self, query):
+        conn, releases = self, self.releases
+        class Statement:
+            async def fetchrow(self, *args):
+                if conn.releases != releases:
+                    raise asyncpg.InterfaceError('the underlying connection has been '
+                                                'released back to the pool')
+                return await conn.fetchrow(query, *args)
+        return Statement()
+
+    async def fetchrow(self, query, *args):
+        self.queries.append((query, args))
+        return self.row
+
+#############
+### TESTS ###
+#############
+
+@pytest.mark.parametrize('cache_size', [0, 100])
+def test_lock_user_across_acquisitions(monkeypatch, cache_size):
+    """
+    Test that `_lock_user` runs on each acquisition of a connection,
+    with and without the statement cache
+    """
+    monkeypatch.setattr(db, 'DB_STATEMENT_CACHE_SIZE', cache_size)
+    conn = FakeConnection({'model_version': 'default', 'log_seq': 7})
+    for _ in range(3):
+        assert asyncio.run(Database._lock_user(conn, 'u1', 'default')) == ('default', 7)
+        conn.release()
+    assert conn.queries == 3 * [(QueryString.LOCK_USER.value, ('u1',))]
+
+    conn.row = None
+    with pytest.raises(NotFoundError):
+        asyncio.run(Database._lock_user(conn, 'u1'))
@@ -0,0 +1,110 @@
+#pylint: disable=E0401
+#pylint: disable=W0621
+#pylint: disable=C0413
+"""
+@author natidemis
+October 2026
+
+Test module for the request tracing in `Misc/tracing.py`
+"""
+
+import sys
+import os
+import asyncio
+import pytest
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../')
+
+from Misc import tracing
+from Misc.tracing import (Span, MemoryExporter, FileExporter, start_trace, activate,
+                        span, traced, current_span)
+
+################
+### FIXTURES ###
+################
+
+@pytest.fixture
+def collector(monkeypatch):
+    """
+    Export traces to memory
+    """
+    memory = MemoryExporter()
+    monkeypatch.setattr(tracing.exporter, '_exporter', memory)
+    return memory
+
+#############
+### TESTS ###
+#############
+
+@traced('bcj.add_bug')
+async def add_bug(user_id: str):
+    """ Traced coroutine with a nested span """
+    with span('encode'):
+        await asyncio.sleep(0)
+    return current_span()
+
+
+def test_sampled_trace(collector):
+    """
+    Test that spans of a request are exported together with their parents
+    """
+    async def request():
+        with activate(start_trace('POST /bug', sample_rate=1.0)):
+            return await add_bug(user_id='u1')
+
+    assert asyncio.run(request()).name == 'bcj.add_bug'
+    assert current_span() is None
+    spans = {s['name']: s for s in collector.traces()[0]}
+    assert set(spans) == {'POST /bug', 'bcj.add_bug', 'encode'}
+    assert spans['bcj.add_bug']['attributes'] == {'user_id': 'u1'}
+    assert spans['bcj.add_bug']['parent_id'] == spans['POST /bug']['span_id']
+    assert spans['encode']['parent_id'] == spans['bcj.add_bug']['span_id']
+    assert len({s['trace_id'] for s in spans.values()}) == 1
+
+
+def test_traceparent(collector):
+    """
+    Test that a sampled 'traceparent' is continued while tracing is on,
+    and an unsampled request is not traced
+    """
+    trace_id, parent_id = 'ab' * 16, 'cd' * 8
+    root = start_trace('GET /ready', '00-{}-{}-01'.format(trace_id, parent_id),
+                        sample_rate=1e-9)
+    assert (root.trace_id, root.parent_id) == (trace_id, parent_id)
+    assert root.traceparent.startswith('00-{}-'.format(trace_id))
+
+    assert start_trace('GET /ready', '00-{}-{}-01'.format(trace_id, parent_id),
+                        sample_rate=0) is None
+    assert start_trace('GET /ready', '00-{}-{}-00'.format(trace_id, parent_id),
+                        sample_rate=1e-9) is None
+    assert start_trace('GET /ready', 'garbage', sample_rate=0) is None
+    with activate(None):
+        with span('encode') as s:
+            assert s is None
+    assert asyncio.run(add_bug(user_id='u1')) is None
+    assert not collector.traces()
+
+
+def test_error(collector):
+    """
+    Test that a span records the exception raised in it
+    """
+    with pytest.raises(KeyError):
+        with activate(start_trace('GET /x', sample_rate=1.0)):
+            with span('db.insert'):
+                raise KeyError
+    errors = {s['name']: s['error'] for s in collector.traces()[0]}
+    assert errors == {'GET /x': 'KeyError', 'db.insert': 'KeyError'}
+
+
+def test_file_rotation(tmp_path):
+    """
+    Test that the trace file is rotated once it reaches its size cap
+    """
+    path = str(tmp_path / 'traces.jsonl')
+    exporter = FileExporter(path, max_bytes=1000)
+    for _ in range(20):
+        exporter.export([Span('GET /x', 'ab' * 16)])
+    exporter.close()
+    assert os.path.getsize(path + '.1') >= 1000
+    assert os.path.getsize(path) < 1000
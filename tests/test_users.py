@@ -0,0 +1,72 @@
+#pylint: disable=E0401
+#pylint: disable=W0621
+#pylint: disable=C0413
+"""
+@author natidemis
+October 2026
+
+Test module for the user registry in `Misc/users.py`
+"""
+
+import sys
+import os
+import asyncio
+import pytest
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../')
+
+from Misc.index import VectorIndex
+from Misc.users import UserEntry, UserIndexRegistry, REPR_ENTRIES
+
+################
+### FIXTURES ###
+################
+
+@pytest.fixture
+def users():
+    """
+    Registry of users 'a', 'b' and 'c', used in that order, 'b' without bugs
+    """
+    registry = UserIndexRegistry()
+    for user_id, index in (('a', VectorIndex([1, 2], [[0, 0], [1, 1]])), ('b', None),
+                        ('c', VectorIndex([1], [[0, 0]]))):
+        registry[user_id] = UserEntry(index, asyncio.BoundedSemaphore(1), 'default')
+    return registry
+
+#############
+### TESTS ###
+#############
+
+def test_totals(users):
+    """
+    Bugs and bytes are kept up to date as indexes change
+    """
+    assert users.stats() == {'users': 3, 'evicted': 0, 'bugs': 3, 'bytes': 3 * 24}
+    users.set_index('a', None)
+    assert (users.bugs, users.nbytes) == (1, 24)
+    assert users['a'].size == 0
+    del users['c']
+    assert (len(users), users.bugs, users.nbytes) == (2, 0, 0)
+
+def test_recency(users):
+    """
+    Touched users move to the end, idle users are the ones with an index not used lately
+    """
+    users.touch('a')
+    assert list(users.least_recent())[0][0] == 'b'
+    assert [user_id for user_id, _ in users.least_recent()] == ['b', 'c', 'a']
+    assert users.idle(-1) == ['c', 'a']
+    assert users.idle(3600) == []
+    assert users['a'].as_dict()['size'] == 2
+
+def test_repr_capped():
+    """
+    The repr shows the totals and only the most recently used entries
+    """
+    registry = UserIndexRegistry()
+    for i in range(3 * REPR_ENTRIES):
+        registry[str(i)] = UserEntry(None, asyncio.BoundedSemaphore(1), 'default')
+    text = repr(registry)
+    assert text.startswith('UserIndexRegistry(users={}, bugs=0'.format(3 * REPR_ENTRIES))
+    assert text.count('UserEntry(') == REPR_ENTRIES
+    assert "'{}': UserEntry(".format(3 * REPR_ENTRIES - 1) in text and "'0':" not in text
@@ -0,0 +1,72 @@
+#pylint: disable=E0401
+#pylint: disable=W0621
+#pylint: disable=C0413
+"""
+@author natidemis
+October 2026
+
+Test module for the compact vocabulary table in `Misc/vocab.py`
+"""
+
+import sys
+import os
+import pytest
+import numpy as np
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../')
+
+from Misc.vocab import build_vocab, CompactWord2Vec
+
+################
+### FIXTURES ###
+################
+
+@pytest.fixture
+def vectors():
+    """
+    Small word2vec style vocabulary
+    """
+    rng = np.random.default_rng(0)
+    return {word: rng.random(8).astype(np.float32)
+        for word in ['crash', 'button', 'login', 'page', 'slow', 'unused']}
+
+@pytest.fixture
+def source(tmp_path, vectors):
+    """
+    `vectors` written in the word2vec binary format
+    """
+    path = tmp_path / 'vectors.bin'
+    with open(path, 'wb') as f:
+        f.write('{} {}\n'.format(len(vectors), 8).encode())
+        for word, vec in vectors.items():
+            f.write(word.encode() + b' ' + vec.tobytes() + b'\n')
+    return str(path)
+
+@pytest.fixture
+def corpus():
+    """ Bug reports used to select the vocabulary """
+    return ['login page crash', 'slow login page', 'button missing']
+
+#####################
+### build_vocab() ###
+#####################
+
+def test_build_vocab_prunes(source, corpus, tmp_path):
+    """
+    Only corpus words present in the source meeting 'min_count' are kept
+    """
+    assert build_vocab(corpus, source, str(tmp_path / 'vocab'), min_count=1) == 5
+    assert build_vocab(corpus, source, str(tmp_path / 'vocab2'), min_count=2) == 2
+
+def test_sentence_matrix(source, corpus, vectors, tmp_path):
+    """
+    Rows follow the sentence order, unknown words are skipped and padded with zeros
+    """
+    build_vocab(corpus, source, str(tmp_path / 'vocab'), dtype='float32')
+    w2v = CompactWord2Vec(str(tmp_path / 'vocab'), sentence_length=4)
+    matrix = w2v.get_sentence_matrix('slow unknown login')
+    assert matrix.shape == (4, 8)
+    assert np.allclose(matrix[0], vectors['slow'])
+    assert np.allclose(matrix[1], vectors['login'])
+    assert not matrix[2:].any()
+    assert w2v.get_sentence_matrix(['crash', 'page']).shape == (2, 4, 8)